@@ -0,0 +1,118 @@
+"""Running per-pixel statistics of a stream of spectra.
+
+Used by IntGraph to integrate spectra. Every frame is added to a
+float64 running sum, and to a running mean and variance kept with
+Welford's method, which stays accurate however many frames go in.
+All of this is done in buffers owned by the Accumulator, so adding
+a frame costs O(pixels) and allocates nothing.
+"""
+
+import numpy
+
+class Accumulator(object):
+    """
+    Sum, count, mean and variance of the spectra given to `add`.
+
+    With `window` = None, the statistics cover every frame since the
+    last `reset`. With `window` = N, they cover only the last N
+    frames, which are kept in a ring buffer so that the oldest frame
+    can be taken out again as each new one comes in. To stop
+    rounding errors building up, the sliding statistics are
+    recomputed from the ring once every N frames.
+
+    The arrays `sum` and `mean` are updated in place; copy them to
+    keep a snapshot. Adding a frame of a different length from the
+    last starts over.
+
+    """
+
+    def __init__(self, window=None):
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.sum = None
+        self.ring = None
+
+    def allocate(self, npix):
+        self.sum = numpy.zeros(npix)
+        self.mean = numpy.zeros(npix)
+        self.m2 = numpy.zeros(npix)  # sum of squared deviations
+        self.delta = numpy.empty(npix)
+        self.scratch = numpy.empty(npix)
+        self.count = 0
+        if self.window:
+            self.ring = numpy.empty((self.window, npix))
+        self.added = 0  # frames ever added, for indexing the ring
+
+    def add(self, y):
+        if self.sum is None or self.sum.shape != numpy.shape(y):
+            self.allocate(len(y))
+        if self.window and self.count == self.window:
+            self.replace(y)
+        else:
+            self.append(y)
+        if self.window:
+            self.ring[self.added % self.window] = y
+        self.added += 1
+        if self.window and self.added % self.window == 0:
+            self.recompute()
+
+    def append(self, y):
+        # Welford's update for one more frame
+        self.count += 1
+        numpy.subtract(y, self.mean, out=self.delta)
+        numpy.multiply(self.delta, 1. / self.count, out=self.scratch)
+        self.mean += self.scratch
+        numpy.subtract(y, self.mean, out=self.scratch)
+        self.scratch *= self.delta
+        self.m2 += self.scratch
+        self.sum += y
+
+    def replace(self, y):
+        # swap the oldest frame in the window for y
+        old = self.ring[self.added % self.window]
+        numpy.subtract(y, old, out=self.delta)
+        self.sum += self.delta
+        # M2 += (y - old) * (y - new mean + old - old mean)
+        numpy.subtract(old, self.mean, out=self.scratch)
+        self.delta *= 1. / self.count
+        self.mean += self.delta
+        self.scratch += y
+        self.scratch -= self.mean
+        self.delta *= self.count
+        self.scratch *= self.delta
+        self.m2 += self.scratch
+
+    def recompute(self):
+        """Recompute the sliding statistics exactly from the ring."""
+        numpy.add.reduce(self.ring, axis=0, out=self.sum)
+        numpy.multiply(self.sum, 1. / self.count, out=self.mean)
+        self.m2[:] = 0
+        for frame in self.ring:
+            numpy.subtract(frame, self.mean, out=self.scratch)
+            self.scratch *= self.scratch
+            self.m2 += self.scratch
+
+    @property
+    def variance(self):
+        """Per-pixel sample variance of the frames."""
+        if self.count < 2:
+            return numpy.zeros_like(self.m2)
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        """Per-pixel standard deviation of the frames."""
+        return numpy.sqrt(self.variance)
+
+    @property
+    def sum_error(self):
+        """Standard error of the sum, for error bars on `sum`."""
+        return numpy.sqrt(self.variance * self.count)
+
+    @property
+    def mean_error(self):
+        """Standard error of the mean, for error bars on `mean`."""
+        return numpy.sqrt(self.variance / max(self.count, 1))
@@ -0,0 +1,162 @@
+"""Automatic wavelength calibration from lamp spectra.
+
+The x axis that comes from the CCD program is computed from the
+center wavelength the spectrometer claims to be at, and a nominal
+dispersion. With a Ne or Ar lamp in front of the slit, we can do
+better: find the peaks in the spectrum, match them with the known
+lines of the lamp (see linedb), and fit a polynomial that takes the
+nominal wavelength of each pixel to the true one.
+
+Since the correction is a function of the nominal wavelength, it
+stays roughly right when the grating moves, and re-running it after
+a move (it takes a few milliseconds) makes it exact again.
+"""
+
+import numpy
+
+def find_peaks(y, threshold=None, max_peaks=30):
+    """
+    Fractional indices and heights of the local maxima of `y`
+    above `threshold`, strongest first, at most `max_peaks` of them.
+
+    The default threshold is the median plus ten times the noise,
+    estimated from the median absolute deviation of y. Peak
+    positions are refined by fitting a parabola through the
+    maximum and its two neighbours.
+    """
+    y = numpy.asarray(y, dtype=float)
+    if threshold is None:
+        med = numpy.median(y)
+        threshold = med + 10 * 1.4826 * numpy.median(numpy.abs(y - med))
+    left, mid, right = y[:-2], y[1:-1], y[2:]
+    i = numpy.nonzero((mid > left) & (mid >= right) & (mid > threshold))[0]
+    i = i[numpy.argsort(mid[i])[::-1]][:max_peaks]
+    a, b, c = left[i], mid[i], right[i]
+    curvature = a - 2 * b + c
+    offset = numpy.where(curvature < 0, .5 * (a - c) / numpy.where(
+        curvature < 0, curvature, -1), 0)
+    return i + 1 + offset, b
+
+def match(found, reference, tolerance):
+    """
+    Pairs each wavelength in `found` with the nearest one in the
+    sorted array `reference`, if it is closer than `tolerance`, and
+    no other found wavelength is closer to it. Returns the indices
+    into `found` and the matching reference wavelengths.
+    """
+    if len(reference) == 0:
+        return numpy.zeros(0, int), numpy.zeros(0)
+    j = numpy.clip(numpy.searchsorted(reference, found), 1, len(reference) - 1)
+    nearer_left = found - reference[j - 1] < reference[j] - found
+    j = numpy.where(nearer_left, j - 1, j)
+    dist = numpy.abs(found - reference[j])
+    ok = dist < tolerance
+    # keep only the closest found peak for each reference line
+    order = numpy.lexsort((dist, j))
+    first = numpy.ones(len(order), bool)
+    first[1:] = j[order][1:] != j[order][:-1]
+    keep = numpy.zeros(len(found), bool)
+    keep[order[first]] = True
+    i = numpy.nonzero(ok & keep)[0]
+    return i, reference[j[i]]
+
+def best_shift(found, reference, max_shift, resolution):
+    """
+    The offset that lines up the most of `found` with `reference`,
+    within +/- `max_shift`, to within `resolution`.
+    """
+    diffs = (reference[numpy.newaxis, :] - found[:, numpy.newaxis]).ravel()
+    diffs = diffs[numpy.abs(diffs) < max_shift]
+    if len(diffs) == 0:
+        return 0.
+    nbins = max(int(2 * max_shift / resolution), 1)
+    counts, edges = numpy.histogram(diffs, nbins, (-max_shift, max_shift))
+    k = numpy.argmax(counts)
+    near = diffs[(diffs >= edges[k] - resolution) &
+                 (diffs <= edges[k + 1] + resolution)]
+    return numpy.median(near)
+
+class Calibration(object):
+    """
+    Correction of a nominal wavelength axis: true wavelengths are
+    ``polyval(coeffs, nominal - origin)``.
+
+    `apply` corrects an x axis in place. The last corrected axis is
+    cached, so as long as the nominal axis stays the same (that is,
+    the grating does not move) applying the correction is a copy.
+    """
+
+    def __init__(self, coeffs, origin, rms=None, matched=None):
+        self.coeffs = numpy.asarray(coeffs, dtype=float)
+        self.origin = origin
+        self.rms = rms
+        self.matched = matched
+        self.nominal = None
+        self.corrected = None
+
+    def __call__(self, nominal):
+        return numpy.polyval(self.coeffs, numpy.asarray(nominal) - self.origin)
+
+    def apply(self, x):
+        """Replace the nominal axis x by the corrected one, in place."""
+        if (self.nominal is None or self.nominal.shape != x.shape
+                or not numpy.array_equal(self.nominal, x)):
+            self.nominal = numpy.array(x, dtype=float)
+            self.corrected = self(self.nominal)
+        x[...] = self.corrected
+        return x
+
+    def __str__(self):
+        return ("%d lines matched, rms %.3f nm, offset %+.3f nm"
+                % (self.matched, self.rms, self(self.origin) - self.origin))
+
+def calibrate(x, y, lines, degree=2, max_shift=5., tolerance=.5,
+              iterations=3, **kwargs):
+    """
+    Fit a Calibration to the lamp spectrum (x, y), where x is the
+    nominal wavelength axis and `lines` a sorted array of reference
+    wavelengths (e.g. from LineDatabase.lines).
+
+    The nominal axis may be off by up to `max_shift` nm. Peaks are
+    first lined up with the reference lines as a whole, then matched
+    one by one within `tolerance` nm, and the fit is refined over a
+    few `iterations`. Other keyword arguments go to find_peaks.
+
+    Raises ValueError if too few lines can be matched.
+    """
+    x = numpy.asarray(x, dtype=float)
+    lines = numpy.asarray(lines, dtype=float)
+    idx, heights = find_peaks(y, **kwargs)
+    found = numpy.interp(idx, numpy.arange(len(x)), x)
+    origin = .5 * (x[0] + x[-1])
+
+    # start from a pure shift of the nominal axis
+    shift = best_shift(found, lines, max_shift, tolerance)
+    coeffs = numpy.array([1., origin + shift])
+    for iteration in range(iterations):
+        guess = numpy.polyval(coeffs, found - origin)
+        i, ref = match(guess, lines, tolerance)
+        coeffs = fit(found[i] - origin, ref, degree, origin)
+        # drop outliers, such as blends of close lines, and refit
+        resid = numpy.polyval(coeffs, found[i] - origin) - ref
+        spread = 1.4826 * numpy.median(numpy.abs(resid))
+        good = numpy.abs(resid) <= max(3 * spread, .02)
+        i, ref = i[good], ref[good]
+        coeffs = fit(found[i] - origin, ref, degree, origin)
+    resid = numpy.polyval(coeffs, found[i] - origin) - ref
+    rms = numpy.sqrt(numpy.mean(resid ** 2))
+    return Calibration(coeffs, origin, rms, len(i))
+
+def fit(offsets, ref, degree, origin):
+    """
+    Polynomial coefficients taking nominal wavelengths, given as
+    `offsets` from `origin`, to the reference wavelengths `ref`.
+    """
+    if len(ref) < 2:
+        raise ValueError("only %d peaks matched reference lines" % len(ref))
+    # don't fit more terms than the matches can pin down
+    deg = min(degree, len(ref) - 2)
+    if deg == 0:
+        shift = numpy.mean(ref - offsets - origin)
+        return numpy.array([1., origin + shift])
+    return numpy.polyfit(offsets, ref, deg)
@@ -0,0 +1,179 @@
+"""Benchmark of the display path, from raw frame to drawn plot.
+
+Runs the stages that each frame goes through in ccd_client -- the
+reduction (reduce.Reducer), SpecGraph.update_plot, and the redraw
+in set_bounds -- on synthetic frames, for a few frame sizes and
+integration modes, and then times exporting the result. The graph
+draws on an Agg canvas instead of a wx window, so no display is
+needed (wxPython must still be importable).
+
+For each case it reports frames per second through all the stages,
+the median and 99th percentile time of each stage, and the peak
+resident memory of the process so far, as JSON::
+
+    python benchmarks/bench_pipeline.py --output before.json
+    python benchmarks/bench_pipeline.py --compare before.json
+
+With --compare, the exit status is 1 if the median time of any stage
+has grown by more than --tolerance since the given results.
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+from timeit import default_timer as timer
+from argparse import ArgumentParser
+
+import numpy
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from reduce import Reducer
+from save import SpecGraph
+from accumulate import Accumulator
+from export import write_csv, write_npz
+
+try:
+    import resource
+except ImportError:
+    resource = None  # not on Windows
+
+parser = ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--frames', type=int, default=200,
+        help="Number of frames per case.")
+parser.add_argument('--shapes', default='10x1024,256x1024,256x2048',
+        help="Comma-separated list of ROWSxPIXELS frame shapes.")
+parser.add_argument('--modes', default='live,integrate,window',
+        help="Comma-separated integration modes: live (no integration), "
+             "integrate (sum of all frames), window (sum of the last 100).")
+parser.add_argument('--output', metavar='FILE',
+        help="Write the results here instead of to standard output.")
+parser.add_argument('--compare', metavar='FILE',
+        help="Results of an earlier run to check for regressions.")
+parser.add_argument('--tolerance', type=float, default=.2,
+        help="Fractional slowdown counted as a regression (default: 0.2).")
+
+def headless(cls, reduce, x, grid, mode):
+    """
+    An instance of the Graph subclass `cls` set up as its __init__
+    would, but with an Agg canvas and no wx window or controls.
+    """
+    graph = cls.__new__(cls)
+    graph.init_state(lambda: (x, grid), reduce)
+    graph.accumulator = Accumulator(100 if mode == 'window' else None)
+    graph.integrating = mode != 'live'
+    graph.init_plot()
+    graph.canvas = FigureCanvasAgg(graph.fig)
+    graph.canvas.mpl_connect('draw_event', graph.on_draw)
+    graph.manual_bounds = lambda: (None, None, None, None)
+    graph.canvas.draw()
+    return graph
+
+def peak_rss():
+    """Peak resident memory of this process in bytes, or None."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def summary(times):
+    times = numpy.asarray(times)
+    return {'p50': numpy.percentile(times, 50),
+            'p99': numpy.percentile(times, 99),
+            'mean': times.mean()}
+
+def run_case(nrows, npix, mode, nframes, tmpdir):
+    x = numpy.linspace(600, 750, npix)
+    # a few distinct frames, with lines that move, so that the
+    # autoscaling sometimes has to redraw everything
+    grids = []
+    for i in range(8):
+        lines = 1000 * numpy.exp(-(x - 620 - 15 * i) ** 2 / 2.)
+        noise = numpy.random.rand(nrows, npix) * 100
+        grids.append((noise + lines / nrows).astype(numpy.uint16))
+
+    reducer = Reducer()
+    graph = headless(SpecGraph, reducer, x, grids[0], mode)
+    outputs = [reducer.allocate(grids[0].shape) for i in range(3)]
+
+    stages = {'reduce': [], 'update_plot': [], 'set_bounds': []}
+    start = timer()
+    for i in range(nframes):
+        t0 = timer()
+        xout, y = reducer(x, grids[i % len(grids)], out=outputs[i % 3])
+        t1 = timer()
+        # as on_frames does, with a copy that the plot can keep
+        graph.update_plot(*graph.keep(xout, y))
+        t2 = timer()
+        graph.set_bounds()
+        t3 = timer()
+        stages['reduce'].append(t1 - t0)
+        stages['update_plot'].append(t2 - t1)
+        stages['set_bounds'].append(t3 - t2)
+    elapsed = timer() - start
+
+    columns = graph.columns()
+    metadata = graph.metadata()
+    for ext, writer in (('csv', write_csv), ('npz', write_npz)):
+        path = os.path.join(tmpdir, 'data.' + ext)
+        t0 = timer()
+        writer(path, columns, metadata)
+        stages['export_' + ext] = [timer() - t0]
+
+    return {'shape': [nrows, npix],
+            'mode': mode,
+            'frames': nframes,
+            'fps': nframes / elapsed,
+            'stages': dict((k, summary(v)) for k, v in stages.items()),
+            'peak_rss': peak_rss()}
+
+def regressions(results, baseline, tolerance):
+    """(case, stage, old, new) for each stage whose median has grown."""
+    old = dict(((tuple(r['shape']), r['mode']), r) for r in baseline)
+    found = []
+    for r in results:
+        before = old.get((tuple(r['shape']), r['mode']))
+        if before is None:
+            continue
+        for stage, stats in r['stages'].items():
+            if stage not in before['stages']:
+                continue
+            was = before['stages'][stage]['p50']
+            if stats['p50'] > was * (1 + tolerance):
+                found.append(('%dx%d %s' % (tuple(r['shape']) + (r['mode'],)),
+                              stage, was, stats['p50']))
+    return found
+
+def main(args):
+    results = []
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for shape in args.shapes.split(','):
+            nrows, npix = [int(s) for s in shape.split('x')]
+            for mode in args.modes.split(','):
+                results.append(run_case(nrows, npix, mode, args.frames, tmpdir))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        found = regressions(results, baseline, args.tolerance)
+        for case, stage, was, now in found:
+            sys.stderr.write("%s: %s p50 %.3g ms -> %.3g ms\n"
+                             % (case, stage, was * 1e3, now * 1e3))
+        return 1 if found else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(parser.parse_args()))
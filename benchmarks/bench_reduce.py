@@ -0,0 +1,123 @@
+"""Micro-benchmark of the frame reduction step.
+
+Compares the original reduction in ccd_client (``y.sum(axis=0)`` and
+then slicing) with reduce.Reducer writing into reused buffers, for
+a few frame geometries and CCD data types. Reports the time per
+frame and the number of bytes allocated per frame.
+
+Run from the top of the source tree::
+
+    python benchmarks/bench_reduce.py
+
+Allocations are measured with tracemalloc, which numpy reports to,
+as the high-water mark of memory allocated during each call. This
+needs Python 3.9 or later. Python 2.7 has nothing that sees memory
+that is allocated and freed again within a call (the peak RSS from
+the resource module does not move once malloc has the block to
+reuse), so there only the arrays that each call returns are looked
+at: those that are not the input or the output buffers it was given
+are counted as new. That misses numpy's temporaries, so the column
+then gives a lower bound, marked ">=". It still tells the original
+reduction, which returns a new sum for every frame, from a Reducer
+that fills the same buffers. For reference, on Python 3.11 with numpy
+2.4, a Reducer allocates about 1 KB per float64 frame (small Python
+objects), and about 66 KB per uint16 frame: the cast buffer numpy
+uses to sum the integers into float64; on 2.7 both show as >=0.
+"""
+
+import os
+import sys
+from timeit import default_timer as timer
+from argparse import ArgumentParser
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from reduce import Reducer
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+parser = ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--frames', type=int, default=200,
+        help="Number of frames to reduce per case.")
+parser.add_argument('--shapes', default='10x1024,256x1024,256x2048',
+        help="Comma-separated list of ROWSxPIXELS frame shapes.")
+parser.add_argument('--dtypes', default='uint16,float64',
+        help="Comma-separated list of raw frame data types.")
+
+def original(x, grid, out=None):
+    # as in ccd_client.MainFrame.fetch before the Reducer
+    y = grid.sum(axis=0)
+    tr = 3
+    return x[tr:], y[tr:]
+
+def timing(reduce, x, grids):
+    """Seconds per frame."""
+    out = reduce(x, grids[0])  # warm up, and allocate buffers
+    start = timer()
+    for grid in grids:
+        out = reduce(x, grid, out)
+    return (timer() - start) / len(grids)
+
+def root(a):
+    # the array that owns the memory of `a`
+    while isinstance(a.base, numpy.ndarray):
+        a = a.base
+    return a
+
+def returned(reduce, x, grids):
+    """Bytes per frame of new arrays that the frames are returned in."""
+    out = reduce(x, grids[0])
+    total = 0
+    for grid in grids:
+        given = set(id(root(a)) for a in (x, grid) + tuple(out))
+        out = reduce(x, grid, out)
+        new = dict((id(root(a)), root(a)) for a in out)
+        total += sum(a.nbytes for i, a in new.items() if i not in given)
+    return total / float(len(grids))
+
+def allocation(reduce, x, grids):
+    """
+    Bytes allocated per frame, and whether that is only a lower bound
+    (without tracemalloc, see returned).
+    """
+    if tracemalloc is None or not hasattr(tracemalloc, 'reset_peak'):
+        return returned(reduce, x, grids), True
+    out = reduce(x, grids[0])
+    tracemalloc.start()
+    total = 0
+    for grid in grids:
+        # high-water mark of memory allocated during this one call
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        out = reduce(x, grid, out)
+        total += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    return total / float(len(grids)), False
+
+def main(args):
+    print("%-10s %-8s %-12s %12s %14s"
+          % ('shape', 'dtype', 'method', 'us/frame', 'bytes/frame'))
+    for shape in args.shapes.split(','):
+        nrows, npix = [int(s) for s in shape.split('x')]
+        x = numpy.linspace(600, 750, npix)
+        for dtype in args.dtypes.split(','):
+            # a few distinct frames, so caches do not flatter us
+            grids = [(numpy.random.rand(nrows, npix) * 1000).astype(dtype)
+                     for i in range(8)]
+            grids = grids * (args.frames // len(grids))
+            cases = [('original', original),
+                     ('Reducer', Reducer()),
+                     ('Reducer/4', Reducer(pixel_bin=4))]
+            for name, reduce in cases:
+                t = timing(reduce, x, grids)
+                b, partial = allocation(reduce, x, grids)
+                print("%-10s %-8s %-12s %12.1f %14s"
+                      % (shape, dtype, name, t * 1e6,
+                         ('>=' if partial else '') + '%.0f' % b))
+
+if __name__ == '__main__':
+    main(parser.parse_args())
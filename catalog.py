@@ -0,0 +1,265 @@
+"""An index of saved spectra and recorded runs.
+
+Saved files and run files are kept wherever they were written. The
+catalog is a small SQLite database that records, for each of them,
+its full path, format, center wavelength, the times of its first and
+last frames, the number of frames, their shape, and an optional
+label (such as "Ar lamp"), so that they can be found again without
+opening each file::
+
+    python catalog.py add *.ccdrun *.npz --label "Ar lamp"
+    python catalog.py find --wl 790:810 --since 2026-09-01 --label Ar
+
+The GUI adds everything it saves or records, when started with
+``--catalog``. `Catalog.load` opens a
+match lazily: run files and .npy files are memory-mapped, so only
+the frames that are used are read from disk.
+"""
+
+import os
+import json
+import sqlite3
+from time import time, mktime, strptime, strftime, localtime
+from argparse import ArgumentParser
+
+import numpy
+
+from record import open_run
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.ccd_catalog.sqlite')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    format TEXT NOT NULL,      -- file extension, e.g. '.ccdrun'
+    kind TEXT,                 -- 'raw' or 'spectrum' frames
+    center_wl REAL,            -- nm, NULL if unknown
+    start REAL,                -- time of the first frame
+    stop REAL,                 -- time of the last frame
+    frames INTEGER,
+    shape TEXT,                -- JSON list
+    label TEXT,
+    metadata TEXT              -- JSON
+);
+CREATE INDEX IF NOT EXISTS datasets_center_wl ON datasets (center_wl);
+CREATE INDEX IF NOT EXISTS datasets_start ON datasets (start);
+"""
+
+def known(value):
+    # None for missing or NaN values, which SQLite cannot compare
+    if value is None or value != value:
+        return None
+    return float(value)
+
+class Catalog(object):
+    """
+    The catalog in the SQLite database at `path`, created if need be.
+    Use it from one thread only.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def add(self, path, format=None, kind=None, center_wl=None,
+            start=None, stop=None, frames=1, shape=(), label=None,
+            metadata=None):
+        """Record a dataset, replacing what was known about `path`."""
+        path = os.path.abspath(path)
+        if format is None:
+            format = os.path.splitext(path)[1]
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO datasets (path, format, kind, "
+                "center_wl, start, stop, frames, shape, label, metadata) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, format, kind, known(center_wl), known(start),
+                 known(stop), frames, json.dumps(list(shape)), label,
+                 json.dumps(metadata or {}, default=str)))
+
+    def add_run(self, path, label=None):
+        """Record a run file, from its header and time stamps."""
+        header, records = open_run(path)
+        wls = records['center_wl'] if len(records) else numpy.zeros(0)
+        wls = wls[~numpy.isnan(wls)]
+        self.add(path, '.ccdrun', header.get('kind'),
+                 numpy.median(wls) if len(wls) else None,
+                 records['time'][0] if len(records) else header.get('created'),
+                 records['time'][-1] if len(records) else header.get('created'),
+                 len(records), header['shape'],
+                 label or header.get('label'), header)
+
+    def add_export(self, path, columns, metadata=None, label=None):
+        """Record spectra saved with export.ExportThread."""
+        metadata = dict(metadata or {})
+        saved = metadata.get('saved', time())
+        lines = len(columns) // 2
+        npoints = min(len(c) for c in columns) if columns else 0
+        self.add(path, kind='spectrum', center_wl=metadata.get('center_wl'),
+                 start=saved, stop=saved, frames=metadata.get('frames', 1),
+                 shape=(lines, npoints), label=label or metadata.get('label'),
+                 metadata=metadata)
+
+    def add_file(self, path, label=None):
+        """Record a file on disk, reading what it says about itself."""
+        ext = os.path.splitext(path)[1]
+        if ext == '.ccdrun':
+            return self.add_run(path, label)
+        modified = os.path.getmtime(path)
+        metadata = {}
+        if ext == '.npz':
+            with numpy.load(path) as archive:
+                if 'metadata' in archive.files:
+                    metadata = json.loads(str(archive['metadata']))
+                columns = [archive[k] for k in sorted(archive.files)
+                           if k[0] in 'xy' and k[1:].isdigit()]
+            shape = (len(columns) // 2, min(len(c) for c in columns))
+        elif ext == '.npy':
+            # (2, N) or (lines, 2, N), as export.write_npy lays it out
+            raw = numpy.load(path, mmap_mode='r').shape
+            shape = (int(numpy.prod(raw[:-1])) // 2, raw[-1])
+        elif ext == '.csv':
+            shape = ()
+            with open(path) as f:
+                for line in f:
+                    if not line.startswith('#'):
+                        # the first row, then count the others
+                        rows = 1 + sum(1 for rest in f)
+                        shape = ((line.count(',') + 1) // 2, rows)
+                        break
+                    key, _, value = line[1:].partition(':')
+                    metadata[key.strip()] = value.strip()
+            if metadata.get('center_wl') in (None, 'None'):
+                metadata.pop('center_wl', None)
+        else:
+            raise ValueError("%s is not a saved spectrum or a run" % path)
+        saved = float(metadata.get('saved', modified))
+        self.add(path, ext, 'spectrum', metadata.get('center_wl'), saved,
+                 saved, int(metadata.get('frames', 1)), shape,
+                 label or metadata.get('label'), metadata)
+
+    def find(self, wl_min=None, wl_max=None, since=None, until=None,
+             label=None, format=None):
+        """
+        Datasets whose center wavelength is between `wl_min` and
+        `wl_max` nm, that were taken from the time `since` up to
+        (not including) `until`, and whose label contains `label`,
+        oldest first. Any of these may be None, to not select on it.
+        """
+        where, args = [], []
+        for clause, value in (("center_wl >= ?", wl_min),
+                              ("center_wl <= ?", wl_max),
+                              ("stop >= ?", since),
+                              ("start < ?", until),
+                              ("label LIKE ?", None if label is None
+                               else '%' + label + '%'),
+                              ("format = ?", format)):
+            if value is not None:
+                where.append(clause)
+                args.append(value)
+        sql = "SELECT * FROM datasets"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return self.db.execute(sql + " ORDER BY start", args).fetchall()
+
+    def remove_missing(self):
+        """Forget the datasets whose files are gone. Returns how many."""
+        gone = [(row['path'],) for row in
+                self.db.execute("SELECT path FROM datasets")
+                if not os.path.exists(row['path'])]
+        with self.db:
+            self.db.executemany("DELETE FROM datasets WHERE path = ?", gone)
+        return len(gone)
+
+    @staticmethod
+    def load(row):
+        """
+        The data of a dataset found with `find`: the header and the
+        memory-mapped records of a run file (see record.open_run),
+        a memory-mapped array for .npy, the lazily-read archive for
+        .npz, and an array for .csv, which has to be read whole.
+        """
+        path, format = row['path'], row['format']
+        if format == '.ccdrun':
+            return open_run(path)
+        if format == '.npy':
+            return numpy.load(path, mmap_mode='r')
+        if format == '.npz':
+            return numpy.load(path)
+        return numpy.loadtxt(path, delimiter=',')
+
+def parse_time(text, end=False):
+    """
+    Seconds since the epoch, from YYYY-MM-DD[ HH:MM]. A date alone
+    means its midnight; with `end`, the midnight after it, so that
+    the whole day is included in a range that ends there.
+    """
+    try:
+        return mktime(strptime(text, '%Y-%m-%d %H:%M'))
+    except ValueError:
+        pass
+    try:
+        t = strptime(text, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError("not a date: %r" % text)
+    # mktime carries a day past the end of the month over
+    return mktime(t[:2] + (t[2] + end,) + (0, 0, 0, 0, 0, -1))
+
+def format_row(row):
+    when = '' if row['start'] is None else \
+        strftime('%Y-%m-%d %H:%M', localtime(row['start']))
+    wl = '' if row['center_wl'] is None else '%.1f' % row['center_wl']
+    return '%-16s %7s %6d %-12s %-12s %s' % (
+        when, wl, row['frames'] or 0,
+        'x'.join(str(s) for s in json.loads(row['shape'])),
+        row['label'] or '', row['path'])
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', dest='db', default=DEFAULT_PATH,
+            help="Catalog database (default: %(default)s).")
+    commands = parser.add_subparsers(dest='command')
+    add = commands.add_parser('add', help="Add saved files or runs.")
+    add.add_argument('paths', nargs='+', metavar='FILE')
+    add.add_argument('--label', dest='label',
+            help="Label them, e.g. with what was in front of the slit.")
+    find = commands.add_parser('find', help="List matching datasets.")
+    find.add_argument('--wl', dest='wl', metavar='MIN:MAX',
+            help="Range of center wavelengths, in nm.")
+    find.add_argument('--since', dest='since', metavar='DATE',
+            help="Taken on or after this date (YYYY-MM-DD [HH:MM]).")
+    find.add_argument('--until', dest='until', metavar='DATE',
+            help="Taken on or before this date, or before this time.")
+    find.add_argument('--label', dest='label',
+            help="Whose label contains this.")
+    find.add_argument('--format', dest='format',
+            help="Of this format, e.g. .ccdrun.")
+    commands.add_parser('prune', help="Forget files that no longer exist.")
+    args = parser.parse_args()
+
+    catalog = Catalog(args.db)
+    if args.command == 'add':
+        for path in args.paths:
+            try:
+                catalog.add_file(path, args.label)
+            except (ValueError, IOError, KeyError) as e:
+                print("skipped %s: %s" % (path, e))
+    elif args.command == 'find':
+        wl_min = wl_max = None
+        if args.wl is not None:
+            wl_min, wl_max = [float(w) if w else None
+                              for w in args.wl.split(':')]
+        for row in catalog.find(wl_min, wl_max,
+                                args.since and parse_time(args.since),
+                                args.until and parse_time(args.until, True),
+                                args.label, args.format):
+            print(format_row(row))
+    elif args.command == 'prune':
+        print("%d datasets removed" % catalog.remove_missing())
+    catalog.close()
@@ -3,23 +3,102 @@
 Downloads spectra from the LabView CCD program running on another computer.
 """
 
-from wx_mpl_dynamic_graph import GraphFrame
+from time import time, sleep
+started = time()  # for --startup-time
+
+# only what the window needs to appear; the modules for the other
+# windows and options are imported when they are first used
 from save import SpecGraph, sampledata
 from spexgui import Spectrometer
-from wanglib.instruments import spex750m
-from wanglib.ccd import labview_client, InstrumentError
+from motion import MotionController, EVT_MOTION
+from lvclient import LabviewClient, DEFAULT_PORT
+from reduce import Reducer, SpikeFilter
+from darks import DarkLibrary, DarkAverager
 import wx
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
+import multiprocessing
 import numpy
 
+def row_range(text):
+    """(first, stop) from FIRST:STOP, for --rows."""
+    try:
+        first, stop = [int(r) for r in text.split(':')]
+    except ValueError:
+        raise ArgumentTypeError("expected FIRST:STOP, e.g. 20:200, "
+                                "not %r" % text)
+    if not 0 <= first < stop:
+        raise ArgumentTypeError("FIRST must be 0 or more, and less than "
+                                "STOP, in %r" % text)
+    return first, stop
+
 # define command line arguments
 parser = ArgumentParser(description=__doc__)
 parser.add_argument('--ip', dest='ip', metavar='ADDRESS',
         help="IP address of the computer running the LabView program.")
+parser.add_argument('--port', dest='port', type=int, default=DEFAULT_PORT,
+        help="With --lvclient, TCP port of the LabView program "
+             "(default: %(default)s).")
+parser.add_argument('--lvclient', dest='lvclient', action='store_true',
+        help="Use the experimental client in lvclient.py, with timeouts, "
+             "reconnection and pipelining, instead of wanglib's. Its "
+             "requests have not been checked against the LabView program.")
+parser.add_argument('--timeout', dest='timeout', type=float, default=10.,
+        metavar='SECONDS',
+        help="With --lvclient, give up on a frame, and reconnect, after "
+             "this long without a response (default: %(default)s).")
+parser.add_argument('--no-pipelining', dest='pipelined',
+        action='store_false',
+        help="With --lvclient, wait for each frame to be parsed before "
+             "asking for the next.")
+parser.add_argument('--hub', dest='hub', metavar='ADDRESS[:PORT]',
+        help="Get frames from a hub (see hub.py) instead of directly "
+             "from the LabView program, e.g. --hub localhost.")
 parser.add_argument('--spec', dest='spec_addr',  metavar='ADDRESS',
         help="Spectrometer RS232 address")
 parser.add_argument('--wl', dest='wl', type=int,
         help="If --spec is not given, provide the wavelength displayed in Spex750M window, in nm.")
+parser.add_argument('--rows', dest='rows', metavar='FIRST:STOP',
+        type=row_range,
+        help="Only sum this range of CCD rows (default: all rows).")
+parser.add_argument('--pixel-bin', dest='pixel_bin', type=int, default=1,
+        help="Sum groups of this many adjacent pixels.")
+parser.add_argument('--truncate', dest='truncate', type=int,
+        help="Number of leading pixels to discard (default: 3, "
+             "or 0 when replaying reduced spectra).")
+parser.add_argument('--despike', dest='despike', choices=('rows', 'frames'),
+        help="Remove cosmic-ray spikes, by comparing each pixel with "
+             "the rows above and below, or with the previous frames.")
+parser.add_argument('--despike-threshold', dest='despike_threshold',
+        type=float, default=5., metavar='SIGMA',
+        help="Spike rejection threshold, in units of the noise (default: 5).")
+parser.add_argument('--darks', dest='darks', metavar='DIR', default='darks',
+        help="Directory to keep dark frames in (default: %(default)s).")
+parser.add_argument('--settings', dest='settings', default='', metavar='LABEL',
+        help="Label for the CCD settings in use, such as the exposure "
+             "time, to keep apart dark frames taken with different ones.")
+parser.add_argument('--label', dest='label', metavar='TEXT',
+        help="Label for the data saved and recorded, such as what is "
+             "in front of the slit, for finding it in the catalog.")
+parser.add_argument('--catalog', dest='catalog', nargs='?', const='',
+        metavar='FILE',
+        help="Add saved and recorded data to this catalog (without "
+             "FILE: ~/.ccd_catalog.sqlite); see catalog.py.")
+parser.add_argument('--processes', dest='processes', action='store_true',
+        help="Receive and reduce frames in a separate process, so that "
+             "drawing does not hold up the acquisition. Needs fork "
+             "(Linux or macOS); elsewhere, threads are used.")
+parser.add_argument('--stats-log', dest='stats_log', metavar='FILE',
+        help="Write frame rates and stage timings to this CSV file, "
+             "once a second.")
+parser.add_argument('--startup-time', dest='startup_time',
+        action='store_true',
+        help="Print how long the window and the first frame take to appear.")
+parser.add_argument('--replay', dest='replay', metavar='FILE',
+        help="Play back a recorded .ccdrun file instead of using the CCD.")
+parser.add_argument('--speed', dest='speed', type=float, default=1.,
+        help="Replay speed relative to real time; 0 for as fast as possible.")
+parser.add_argument('--loop', dest='loop', action='store_true',
+        help="Start the replay over when it reaches the end.")
 
 class Fake_Client(object):
     """ Imitates a wanglib.ccd.labview_client object """
@@ -35,72 +114,211 @@ class Fake_Client(object):
         return x, numpy.array(grid)
 
 class CalData(wx.Panel):
-    def __init__(self, parent):
+    """ Checkboxes for overlaying the reference lines of each element """
+
+    # line colors for known elements; others take the next from `colors`
+    element_colors = {'Ne': 'r', 'Ar': 'm'}
+    colors = ['g', 'c', 'y', 'b']
+
+    def __init__(self, parent, db=None):
         wx.Panel.__init__(self, parent, -1)
+        if db is None:
+            from linedb import LineDatabase
+            db = LineDatabase()
+        self.db = db
+        self.data = {}
 
         # arrange controls vertically
         self.box = wx.StaticBox(self, -1)
         self.box.SetLabel('Reference lines')
         sizer = wx.StaticBoxSizer(self.box, wx.VERTICAL)
 
-        # add checkboxes
-        self.ne = wx.CheckBox(self, label='Ne')
-        sizer.Add(self.ne, 0, flag=wx.ALIGN_CENTER_VERTICAL)
-        self.ar = wx.CheckBox(self, label='Ar')
-        sizer.Add(self.ar, 0, flag=wx.ALIGN_CENTER_VERTICAL)
-
-        # bind to events
-        self.Bind(wx.EVT_CHECKBOX, self.on_ne, self.ne)
-        self.Bind(wx.EVT_CHECKBOX, self.on_ar, self.ar)
+        # add a checkbox for each element we have a table for
+        self.checkboxes = {}
+        for element in self.db.elements():
+            checkbox = wx.CheckBox(self, label=element)
+            sizer.Add(checkbox, 0, flag=wx.ALIGN_CENTER_VERTICAL)
+            self.Bind(wx.EVT_CHECKBOX, self.on_checkbox, checkbox)
+            self.checkboxes[element] = checkbox
+
+        # automatic calibration against the lines of the lamp
+        self.autocal_button = wx.Button(self, -1, "Auto-calibrate")
+        sizer.Add(self.autocal_button, 0, border=5, flag=wx.TOP)
+        self.autocal_after_move = wx.CheckBox(self, label='after each move')
+        sizer.Add(self.autocal_after_move, 0, flag=wx.ALIGN_CENTER_VERTICAL)
+        self.autocal_label = wx.StaticText(self, -1, "Not calibrated")
+        sizer.Add(self.autocal_label, 0, border=5, flag=wx.TOP)
 
         self.SetSizer(sizer)
         sizer.Fit(self)
 
-    data = None
-
     @staticmethod
     def read_NIST(filename):
-        """
-        ascii data from http://physics.nist.gov/cgi-bin/ASD/lines1.pl
-
-        columns of returned array are observed wl, relative int, and aki (?)
-        """
-        a = numpy.genfromtxt(filename, delimiter='|',
-                skip_header=6, skip_footer=1)
-        data = a[:,1:4] # select location, relative int, and aki (?)
-        mask = numpy.isnan(data[:,0]) # some lines are blank
-        return data[~mask]
-
-    def on_ar(self, event):
+        from linedb import read_NIST
+        return read_NIST(filename)
+
+    def element(self, checkbox):
+        """ Which element's checkbox this is """
+        for element, box in self.checkboxes.items():
+            if box is checkbox:
+                return element
+
+    def color(self, element):
+        if element in self.element_colors:
+            return self.element_colors[element]
+        others = [e for e in sorted(self.checkboxes)
+                  if e not in self.element_colors]
+        return self.colors[others.index(element) % len(self.colors)]
+
+    def on_checkbox(self, event):
         if event.Checked():
             #load up the data
-            wls, rel_int, aki = self.read_NIST('caldata/Ar.txt').T
-            self.data = wls[rel_int > 1e4]
+            element = self.element(event.GetEventObject())
+            self.data[element] = self.db.lines(element)
         event.Skip() # pass it up the chain
 
-    def on_ne(self, event):
-        if event.Checked():
-            #load up the data
-            wls, rel_int, aki = self.read_NIST('caldata/Ne.txt').T
-            self.data = wls[rel_int > 1e4]
-        event.Skip() # pass it up the chain
+    def lamp_lines(self):
+        """
+        Sorted wavelengths of the lines of the elements that are
+        ticked, or of all the elements if none are.
+        """
+        elements = [e for e, box in self.checkboxes.items() if box.IsChecked()]
+        lines = [self.db.lines(e) for e in elements or self.checkboxes]
+        return numpy.sort(numpy.concatenate(lines))
+
+class ScanPanel(wx.Panel):
+    """ Controls for a scan over a range wider than the CCD """
+
+    def __init__(self, parent, center_wl):
+        wx.Panel.__init__(self, parent, -1)
+        self.box = wx.StaticBox(self, -1)
+        self.box.SetLabel('Scan')
+        sizer = wx.StaticBoxSizer(self.box, wx.VERTICAL)
+
+        grid = wx.FlexGridSizer(4, 2, 2, 5)
+        center_wl = center_wl or 700
+        self.start = self.add_field(grid, "From (nm)", center_wl - 100)
+        self.stop = self.add_field(grid, "To (nm)", center_wl + 100)
+        self.overlap = self.add_field(grid, "Overlap (%)", 20)
+        self.frames = self.add_field(grid, "Frames each", 1)
+        sizer.Add(grid, 0)
+
+        self.button = wx.Button(self, -1, "Scan")
+        sizer.Add(self.button, 0, border=5, flag=wx.TOP)
+        self.label = wx.StaticText(self, -1, "")
+        sizer.Add(self.label, 0, border=5, flag=wx.TOP)
+
+        self.SetSizer(sizer)
+        sizer.Fit(self)
+
+    def add_field(self, grid, label, value):
+        field = wx.TextCtrl(self, -1, size=(50,-1), value=str(value))
+        grid.Add(wx.StaticText(self, -1, label), 0,
+                 flag=wx.ALIGN_CENTER_VERTICAL)
+        grid.Add(field, 0)
+        return field
+
+    def settings(self):
+        """ start, stop, overlap (as a fraction) and frames, or None
+        if they do not make a scan; the label then says why """
+        try:
+            start, stop, overlap = [float(field.GetValue()) for field in
+                                    (self.start, self.stop, self.overlap)]
+            frames = int(self.frames.GetValue())
+        except ValueError:
+            self.label.SetLabel("Enter numbers, and a whole number of frames")
+            return None
+        if not start < stop:
+            self.label.SetLabel("From must be below To")
+        elif not 0 <= overlap < 100:
+            self.label.SetLabel("Overlap must be from 0 to under 100%")
+        elif frames < 1:
+            self.label.SetLabel("Take at least one frame each")
+        else:
+            return start, stop, overlap / 100., frames
+        return None
+
+class DarkPanel(wx.Panel):
+    """ Controls for taking and subtracting dark frames """
+
+    def __init__(self, parent):
+        wx.Panel.__init__(self, parent, -1)
+        self.box = wx.StaticBox(self, -1)
+        self.box.SetLabel('Dark frame')
+        sizer = wx.StaticBoxSizer(self.box, wx.VERTICAL)
+
+        row = wx.BoxSizer(wx.HORIZONTAL)
+        self.button = wx.Button(self, -1, "Take dark")
+        row.Add(self.button, 0, flag=wx.ALIGN_CENTER_VERTICAL)
+        self.frames = wx.SpinCtrl(self, -1, size=(60,-1), min=1, max=1000,
+                                  initial=10)
+        row.Add(self.frames, 0, border=5,
+                flag=wx.LEFT|wx.ALIGN_CENTER_VERTICAL)
+        row.Add(wx.StaticText(self, -1, "frames"), 0, border=5,
+                flag=wx.LEFT|wx.ALIGN_CENTER_VERTICAL)
+        sizer.Add(row, 0)
+
+        self.subtract = wx.CheckBox(self, label='Subtract dark')
+        sizer.Add(self.subtract, 0, border=5, flag=wx.TOP)
+        self.label = wx.StaticText(self, -1, "No dark")
+        sizer.Add(self.label, 0, border=5, flag=wx.TOP)
+
+        self.SetSizer(sizer)
+        sizer.Fit(self)
 
 class MainFrame(wx.Frame):
 
-    def __init__(self, clnt, spex=None):
+    # errors from the client after which it should reconnect and try
+    # again; wanglib's InstrumentError, when that client is used
+    reconnect_on = ()
+
+    def __init__(self, clnt, spex=None, reducer=None, stats_log=None,
+                 darks=None, settings=''):
         wx.Frame.__init__(self, None, -1, "CCD Client")
+        if reducer is None:
+            reducer = Reducer()
+        if darks is None:
+            darks = DarkLibrary()
+
+        # the center wavelength, where an acquisition process can see it;
+        # with a spectrometer, that is where the motion controller put it
+        if spex is not None:
+            self.motion = MotionController(spex)
+            self.motion.start()
+            self.center_wl = self.motion.position
+        else:
+            self.motion = None
+            self.center_wl = multiprocessing.Value('d', numpy.nan
+                    if clnt.center_wl is None else clnt.center_wl)
+        moves_seen = [0]
 
         def fetch():
             try:
-                x,y = clnt.get_spectrum()
-            except InstrumentError:
+                return clnt.get_spectrum()
+            except self.reconnect_on:
                 clnt.connect() # try reconnecting
-                x,y = clnt.get_spectrum()
-            y = y.sum(axis=0) # collapse to 1D
-            tr = 3  # truncate point
-            return x[tr:], y[tr:]
-
-        self.disp = SpecGraph(self,fetch)
+                return clnt.get_spectrum()
+
+        def receive():
+            moved = False
+            if self.motion is not None:
+                # wait for the grating to stop
+                while self.motion.moving:
+                    sleep(.02)
+                moved = self.motion.moves.value != moves_seen[0]
+                moves_seen[0] = self.motion.moves.value
+            wl = self.center_wl.value
+            if wl == wl and wl != clnt.center_wl:
+                clnt.center_wl = wl  # moved, as seen from another process
+            if moved:
+                fetch()  # may have been exposed during the move
+            return fetch()
+
+        self.clnt = clnt
+        self.receive = receive
+        self.reducer = reducer
+        self.disp = SpecGraph(self, receive, reducer)
+        self.disp.center_wl = clnt.center_wl
         self.centerline = None
         self.spexlines = {}
 
@@ -109,26 +327,60 @@ class MainFrame(wx.Frame):
         # cal data viewer
         self.caldata = CalData(self)
         self.sidebar.Add(self.caldata, 1, border=5, flag=wx.ALL)
-        self.Bind(wx.EVT_CHECKBOX, self.on_ne_checkbox, self.caldata.ne)
-        self.Bind(wx.EVT_CHECKBOX, self.on_ar_checkbox, self.caldata.ar)
+        for checkbox in self.caldata.checkboxes.values():
+            self.Bind(wx.EVT_CHECKBOX, self.on_ref_checkbox, checkbox)
+        self.Bind(wx.EVT_BUTTON, self.on_autocal_button, self.caldata.autocal_button)
+        # frames to skip before calibrating on the frame after that,
+        # or None for no calibration pending
+        self.autocal_countdown = None
+        self.disp.taps.append(self.autocal_tap)
+
+        # wavelength span of one live frame, for scans; not taken from
+        # the display, which may be showing a whole scan
+        self.frame_width = None
+        self.disp.taps.append(self.width_tap)
+
+        # dark frames, taken from the live frames with the shutter closed
+        self.darks = darks
+        self.settings = settings
+        self.dark_averager = None
+        self.dark_panel = DarkPanel(self)
+        self.sidebar.Add(self.dark_panel, 0, border=5, flag=wx.ALL|wx.EXPAND)
+        self.Bind(wx.EVT_BUTTON, self.on_dark_button, self.dark_panel.button)
+        self.Bind(wx.EVT_CHECKBOX, self.on_dark_checkbox,
+                  self.dark_panel.subtract)
+        # frame shape the dark was last chosen for
+        self.dark_shape = None
+        self.disp.taps.append(self.dark_tap)
+
+        # images of the raw frames and of the recent spectra
+        self.waterfall_button = wx.Button(self, -1, "Waterfall")
+        self.sidebar.Add(self.waterfall_button, 0, border=5, flag=wx.ALL)
+        self.Bind(wx.EVT_BUTTON, self.on_waterfall_button,
+                  self.waterfall_button)
+
+        # peak positions and widths, fitted as the frames come
+        self.peakfit_button = wx.Button(self, -1, "Peak fits")
+        self.sidebar.Add(self.peakfit_button, 0, border=5, flag=wx.ALL)
+        self.Bind(wx.EVT_BUTTON, self.on_peakfit_button, self.peakfit_button)
 
         if spex is not None:
-            self.control = Spectrometer(self,spec)
+            self.control = Spectrometer(self, spec, self.motion)
             self.sidebar.Add(self.control, 1, border=5, flag=wx.ALL|wx.EXPAND)
 
-            # re-bind the buttons to new methods defined below.
-            # this is necessary to inform the ccd program
-            # note: to rebind something, use a "Bind" method
-            # of the same instance from which it was bound before,
-            # (hence self.control.Bind and not self.Bind below)
-            self.control.Bind(wx.EVT_BUTTON, self.on_move_button, self.control.move.button)
-            self.control.Bind(wx.EVT_TEXT_ENTER, self.on_move_button, self.control.move.field)
-            self.control.Bind(wx.EVT_BUTTON, self.on_cal_button, self.control.cal.button)
-            self.control.Bind(wx.EVT_TEXT_ENTER, self.on_cal_button, self.control.cal.field)
+            # moves are made on the motion controller's thread, which
+            # tells the panel, and the panel us, when each is done
+            self.Bind(EVT_MOTION, self.on_motion)
 
             # draw center line
             self.draw_centerline()
 
+            # scans need the spectrometer
+            self.scanner = None
+            self.scan = ScanPanel(self, clnt.center_wl)
+            self.sidebar.Add(self.scan, 0, border=5, flag=wx.ALL|wx.EXPAND)
+            self.Bind(wx.EVT_BUTTON, self.on_scan_button, self.scan.button)
+
         self.sizer = wx.BoxSizer(wx.HORIZONTAL)
         self.sizer.Add(self.disp, 1, flag=wx.LEFT | wx.TOP | wx.GROW)
         self.sizer.Add(self.sidebar, 0, border=5, flag=wx.ALL)
@@ -136,55 +388,282 @@ class MainFrame(wx.Frame):
         self.SetSizer(self.sizer)
         self.sizer.Fit(self)
 
-    def on_move_button(self,event):
-        self.control.on_move_button(event)
-        clnt.center_wl = spec.wavelength
+        # frame rates and timings, refreshed once a second
+        self.statusbar = self.CreateStatusBar()
+        if stats_log is not None:
+            from stats import StatsLog
+            stats_log = StatsLog(stats_log)
+        self.stats_log = stats_log
+        self.stats_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_stats_timer, self.stats_timer)
+        self.stats_timer.Start(1000)
+
+    def counters(self):
+        """ Frame and spike counts, and reconnections if known """
+        box = self.disp.mailbox
+        counters = dict(produced=box.produced, displayed=box.displayed,
+                        coalesced=box.coalesced, dropped=box.dropped)
+        spikes = [f.total for f in self.reducer.filters
+                  if isinstance(f, SpikeFilter)]
+        if spikes:
+            counters['spikes'] = sum(spikes)
+        if hasattr(self.clnt, 'reconnects'):
+            counters['reconnects'] = self.clnt.reconnects
+        return counters
+
+    def on_stats_timer(self, event):
+        if self.disp.paused:
+            if self.disp.error is not None:
+                self.statusbar.SetStatusText("Stopped: %s" % self.disp.error)
+            return
+        stats = self.disp.stats
+        counters = self.counters()
+        self.statusbar.SetStatusText("%s | %s" % (stats.status_text(),
+            ", ".join("%s %d" % kv for kv in sorted(counters.items()))))
+        if self.stats_log is not None:
+            self.stats_log.write(stats, **counters)
+
+    def on_motion(self, event):
+        # the acquisition picks up the new center wavelength by itself,
+        # and skips the frame that may have been exposed during the move
+        if event.kind != 'done':
+            return
+        self.disp.center_wl = self.center_wl.value
         self.draw_centerline()
-
-    def on_cal_button(self,event):
-        self.control.on_cal_button(event)
-        clnt.center_wl = spec.wavelength
+        self.apply_dark()
+        if event.action == 'move' \
+                and self.caldata.autocal_after_move.IsChecked():
+            self.autocal_countdown = 0
+
+    def on_dark_button(self, event):
+        if self.disp.processes:
+            self.dark_panel.label.SetLabel("Raw frames are not available\n"
+                                           "with --processes")
+            return
+        if self.disp.paused:
+            self.dark_panel.label.SetLabel("Start the display first")
+            return
+        if self.dark_averager in self.disp.taps:
+            self.disp.taps.remove(self.dark_averager)
+        count = self.dark_panel.frames.GetValue()
+        center_wl = self.center_wl.value
+        def done(frame):
+            wx.CallAfter(self.on_dark_taken, frame, center_wl, count)
+        self.dark_averager = DarkAverager(count, done)
+        self.disp.taps.append(self.dark_averager)
+        self.dark_panel.label.SetLabel("Taking %d frames..." % count)
+
+    def on_dark_taken(self, frame, center_wl, count):
+        if self.dark_averager in self.disp.taps:
+            self.disp.taps.remove(self.dark_averager)
+        self.dark_averager = None
+        self.darks.add(frame, center_wl, self.settings, count)
+        self.apply_dark()
+
+    def on_dark_checkbox(self, event):
+        self.apply_dark()
+
+    def apply_dark(self):
+        """
+        Subtract the dark for the current center wavelength and
+        settings from the frames that follow, if that is ticked.
+        """
+        shape = self.dark_shape = self.reducer.shape
+        key, dark = self.darks.find(self.center_wl.value, shape,
+                                    self.settings)
+        if key is not None:
+            self.dark_panel.label.SetLabel(key)
+        elif shape is None:
+            self.dark_panel.label.SetLabel("No frame yet")
+        else:
+            self.dark_panel.label.SetLabel("No dark for %dx%d frames here"
+                                           % shape)
+        if not self.dark_panel.subtract.IsChecked():
+            dark = None
+        if dark is not self.reducer.dark:
+            self.reducer.dark = dark
+            self.disp.reduce_changed()
+
+    def on_waterfall_button(self, event):
+        from waterfall import WaterfallFrame
+        WaterfallFrame(self, self.disp).Show()
+
+    def on_peakfit_button(self, event):
+        from peakfit import PeakFrame
+        PeakFrame(self, self.disp).Show()
+
+    def on_scan_button(self, event):
+        if self.scanner is not None:
+            self.scanner.abort()
+            return
+        settings = self.scan.settings()
+        if settings is None:
+            return
+        start, stop, overlap, frames = settings
+        if self.frame_width is None:
+            # no live frame has been through the taps yet, so no scan
+            # has been shown either: the display has the first frame
+            x = self.disp.data()[0]
+            if len(x) < 2:
+                self.scan.label.SetLabel("No frame yet to take the width from")
+                return
+            self.frame_width = abs(x[-1] - x[0])
+        # the scan takes over the CCD from the live display, once the
+        # display has stopped using it
+        from scan import positions
+        centers = positions(start, stop, self.frame_width, overlap)
+        self.disp.pause_button.Disable()
+        self.scan.button.Disable()
+        self.scan.label.SetLabel("Stopping the display...")
+        self.disp.stop_worker(lambda: self.start_scan(centers, frames))
+
+    def start_scan(self, centers, frames):
+        self.scan.button.Enable()
+        self.scan.label.SetLabel("0 of %d positions" % len(centers))
+        self.scan.button.SetLabel("Stop scan")
+        def on_segment(i, x, y):
+            wx.CallAfter(self.scan.label.SetLabel,
+                         "%d of %d positions" % (i + 1, len(centers)))
+        def on_done(x, y):
+            wx.CallAfter(self.on_scan_done, x, y)
+        from scan import Scan
+        # receive() already drops the frame exposed during each move
+        self.scanner = Scan(centers, self.scan_move, self.scan_acquire,
+                            frames, settle=0, on_segment=on_segment,
+                            on_done=on_done)
+        self.scanner.start()
+
+    def scan_move(self, wl):
+        # on the scan thread; the rest follows from the MotionEvents
+        command = self.motion.move(wl, wait=True)
+        # stop rather than scan the wrong place
+        if command.error is not None:
+            raise command.error
+        if not command.ok:
+            self.scanner.abort()  # cancelled
+
+    def scan_acquire(self):
+        # on the scan thread, while the live display is paused
+        return self.reducer(*self.receive())
+
+    def on_scan_done(self, x, y):
+        scanner, self.scanner = self.scanner, None
+        self.scan.button.SetLabel("Scan")
+        self.disp.pause_button.Enable()
         self.draw_centerline()
+        if scanner.error is not None:
+            self.scan.label.SetLabel("Failed: %s" % scanner.error)
+            return
+        if x is None:
+            self.scan.label.SetLabel("Stopped")
+            return
+        self.scan.label.SetLabel("Done: %.1f to %.1f nm" % (x[0], x[-1]))
+        self.disp.show(x, y)
+
+    def on_autocal_button(self, event):
+        x, y = self.disp.data()
+        self.autocalibrate(x, y)
+
+    def width_tap(self, raw, reduced):
+        # runs on the pipeline, with every live frame
+        x = reduced[0]
+        if len(x) > 1:
+            self.frame_width = abs(x[-1] - x[0])
+
+    def dark_tap(self, raw, reduced):
+        # runs on the pipeline; choose the dark again when the frames
+        # (first) come in at a different size
+        if self.reducer.shape != self.dark_shape:
+            self.dark_shape = self.reducer.shape
+            wx.CallAfter(self.apply_dark)
+
+    def autocal_tap(self, raw, reduced):
+        # runs on the pipeline, with every frame
+        if self.autocal_countdown is None:
+            return
+        if self.autocal_countdown > 0:
+            self.autocal_countdown -= 1
+            return
+        self.autocal_countdown = None
+        x, y = reduced
+        wx.CallAfter(self.autocalibrate, x.copy(), y.copy())
+
+    def autocalibrate(self, x, y):
+        """
+        Calibrate the wavelength axis against a lamp spectrum (x, y),
+        and apply the calibration to all the frames that follow.
+        """
+        cal = self.reducer.calibration
+        if cal is not None and cal.corrected is not None \
+                and numpy.array_equal(cal.corrected, x):
+            # x has been corrected already, so go back to the original
+            x = cal.nominal
+        from autocal import calibrate
+        try:
+            cal = calibrate(x, y, self.caldata.lamp_lines())
+        except ValueError as e:
+            self.caldata.autocal_label.SetLabel("Failed: %s" % e)
+            return
+        self.reducer.calibration = cal
+        self.disp.reduce_changed()
+        self.caldata.autocal_label.SetLabel(str(cal).replace(', ', '\n'))
+        self.caldata.Layout()
 
     def draw_centerline(self):
         if self.centerline is not None:
             self.centerline.remove()
-        self.centerline = self.disp.axes.axvline(spec.wl, c='k', ls='--')
-
-    def on_ne_checkbox(self, event):
-        if event.Checked():
-            self.spexlines['Ne'] = self.draw_spexlines(self.caldata.data, 'r')
-        else:
-            for line in self.spexlines['Ne']:
-                line.remove()
+        self.centerline = self.disp.axes.axvline(self.center_wl.value,
+                                                 c='k', ls='--')
+        self.disp.redraw()
 
-    def on_ar_checkbox(self, event):
+    def on_ref_checkbox(self, event):
+        element = self.caldata.element(event.GetEventObject())
         if event.Checked():
-            self.spexlines['Ar'] = self.draw_spexlines(self.caldata.data, 'm')
+            self.spexlines[element] = self.draw_spexlines(
+                    element, self.caldata.color(element))
         else:
-            for line in self.spexlines['Ar']:
-                line.remove()
+            self.spexlines.pop(element).remove()
+        self.disp.redraw()
 
-    def draw_spexlines(self, locs, color):
+    def draw_spexlines(self, element, color):
         wlmin, wlmax = self.disp.axes.get_xlim()
-        nearlocs = [wl for wl in locs if (wl > wlmin and wl < wlmax)]
-        return [self.disp.axes.axvline(wl, c=color, ls=':') for wl in nearlocs]
+        from linedb import line_collection
+        nearlocs = self.caldata.db.lines(element, wlmin, wlmax)
+        return line_collection(self.disp.axes, nearlocs, colors=color,
+                               linestyles=':')
 
 
 if __name__ == "__main__":
+    imported = time()
     # get command line args
     args = parser.parse_args()
 
     # if --spec is provided, open connection to spex
     if args.spec_addr is not None:
+        from wanglib.instruments import spex750m
         spec = spex750m(args.spec_addr)
         initial_wl = spec.get_wl()
     else:
         spec = None
         initial_wl = args.wl
 
-    if args.ip is not None:
+    truncate = args.truncate
+    if args.replay is not None:
+        from record import Replay
+        clnt = Replay(args.replay, speed=args.speed, loop=args.loop)
+        if truncate is None and clnt.kind == 'spectrum':
+            truncate = 0  # already truncated when recorded
+    elif args.hub is not None:
+        from hub import HubClient, HUB_PORT
+        host, _, port = args.hub.partition(':')
+        clnt = HubClient(host, int(port or HUB_PORT), center_wl=initial_wl)
+    elif args.ip is not None and args.lvclient:
+        clnt = LabviewClient(initial_wl, args.ip, args.port,
+                             timeout=args.timeout, pipelined=args.pipelined)
+    elif args.ip is not None:
+        from wanglib.ccd import labview_client, InstrumentError
         clnt = labview_client(center_wl=initial_wl, host=args.ip)
+        MainFrame.reconnect_on = (InstrumentError,)
     else:
         print 'No IP address provided'
         print 'proceeding with FAKE DATA'
@@ -192,7 +671,38 @@ if __name__ == "__main__":
         if spec is not None:
             clnt.center_wl = spec.wl
 
+    if truncate is None:
+        truncate = 3
+    filters = []
+    if args.despike is not None:
+        filters.append(SpikeFilter(args.despike, args.despike_threshold))
+    reducer = Reducer(rows=args.rows, pixel_bin=args.pixel_bin,
+                      truncate=truncate, filters=filters)
+
+    if args.processes:
+        from shmring import can_fork
+        if not can_fork:
+            print '--processes needs fork, which this system does not have;'
+            print 'acquiring in threads instead'
+        SpecGraph.processes = can_fork
+    SpecGraph.label = args.label
+    if args.catalog is not None:
+        from catalog import Catalog, DEFAULT_PATH
+        SpecGraph.catalog = Catalog(args.catalog or DEFAULT_PATH)
+        print 'cataloguing saved data in', SpecGraph.catalog.path
     app = wx.App(False)
-    app.frame = MainFrame(clnt, spec)
+    app.frame = MainFrame(clnt, spec, reducer, args.stats_log,
+                          DarkLibrary(args.darks), args.settings)
     app.frame.Show()
+    if args.startup_time:
+        def report(event):
+            print("%s after %.2f s" % (event, time() - started))
+        def poll_first_frame():
+            if len(app.frame.disp.lines[0].get_xdata()):
+                report("first frame shown")
+            else:
+                wx.CallLater(10, poll_first_frame)
+        print("imports took %.2f s" % (imported - started))
+        wx.CallAfter(report, "window shown")
+        wx.CallAfter(poll_first_frame)
     app.MainLoop()
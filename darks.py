@@ -0,0 +1,121 @@
+"""Dark and background frames, for subtracting from live frames.
+
+A DarkLibrary keeps averaged frames taken with the shutter closed (or
+of the background), one for each center wavelength and set of CCD
+settings, as .npy files in a directory, with an index of what each
+one is. DarkAverager averages N raw frames from the live stream into
+a new one. To subtract a dark, set it as the `dark` of the Reducer;
+see reduce.Reducer for how that is done at almost no cost per frame.
+"""
+
+import os
+import json
+from time import time
+
+import numpy
+
+def unknown(center_wl):
+    # None, or NaN from a recording made without a spectrometer
+    return center_wl is None or center_wl != center_wl
+
+class DarkLibrary(object):
+    """
+    Dark frames in `directory`, by center wavelength, frame shape,
+    and `settings`: a free-form label, such as the exposure time, for
+    telling apart darks taken with the same geometry.
+
+    `find` gives the dark taken nearest to a center wavelength, if it
+    is within `tolerance` nm, with the same shape and settings.
+    Frames are loaded from disk when first needed, and kept.
+    """
+
+    index_name = 'index.json'
+
+    def __init__(self, directory='darks', tolerance=1.):
+        self.directory = directory
+        self.tolerance = tolerance
+        self.frames = {}
+        try:
+            with open(os.path.join(directory, self.index_name)) as f:
+                self.index = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.index = {}
+
+    @staticmethod
+    def key(center_wl, shape, settings=''):
+        wl = 'none' if unknown(center_wl) else '%.2f' % center_wl
+        key = '%s_%dx%d' % ((wl,) + tuple(shape))
+        return key + '_' + settings if settings else key
+
+    def add(self, frame, center_wl, settings='', frames=1):
+        """Keep `frame`, the average of `frames` frames, and save it."""
+        key = self.key(center_wl, frame.shape, settings)
+        if unknown(center_wl):
+            center_wl = None
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        numpy.save(os.path.join(self.directory, key + '.npy'), frame)
+        self.frames[key] = frame
+        self.index[key] = {'center_wl': center_wl,
+                           'shape': list(frame.shape),
+                           'settings': settings,
+                           'frames': frames,
+                           'taken': time()}
+        with open(os.path.join(self.directory, self.index_name), 'w') as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+        return key
+
+    def find(self, center_wl, shape=None, settings=''):
+        """(key, frame) of the best dark, or (None, None)."""
+        best, distance = None, None
+        if unknown(center_wl):
+            center_wl = None
+        for key, entry in self.index.items():
+            if entry['settings'] != settings:
+                continue
+            if shape is not None and tuple(entry['shape']) != tuple(shape):
+                continue
+            wl = entry['center_wl']
+            if wl is None or center_wl is None:
+                d = 0. if wl == center_wl else None
+            else:
+                d = abs(wl - center_wl)
+            if d is None or d > self.tolerance:
+                continue
+            if distance is None or d < distance or \
+                    (d == distance and entry['taken'] > self.index[best]['taken']):
+                best, distance = key, d
+        if best is None:
+            return None, None
+        return best, self.load(best)
+
+    def load(self, key):
+        if key not in self.frames:
+            self.frames[key] = numpy.load(
+                os.path.join(self.directory, key + '.npy'))
+        return self.frames[key]
+
+class DarkAverager(object):
+    """
+    A tap that averages the next `count` raw frames, then calls
+    ``done(mean)`` with the mean frame, from the acquisition thread.
+    """
+
+    def __init__(self, count, done):
+        self.count = count
+        self.done = done
+        self.sum = None
+        self.taken = 0
+
+    def __call__(self, raw, reduced):
+        if raw is None or self.taken >= self.count:
+            return
+        grid = raw[1]
+        if self.sum is None or self.sum.shape != grid.shape:
+            self.sum = numpy.zeros(grid.shape)
+            self.taken = 0
+        self.sum += grid
+        self.taken += 1
+        if self.taken == self.count:
+            self.sum *= 1. / self.count
+            self.done(self.sum)
@@ -0,0 +1,107 @@
+"""Writing displayed spectra to disk.
+
+The functions here take a list of 1D columns (x1, y1, x2, y2, ...)
+and a dict of metadata, and write them as CSV text, a .npy array, or
+a compressed .npz archive. ExportThread runs one of them in the
+background, so that the GUI is not held up by large files.
+"""
+
+import json
+import threading
+
+import numpy
+
+def write_csv(path, columns, metadata=None, progress=None, chunk=20000):
+    """
+    Comma-separated text, one row per point, preceded by the
+    metadata as ``# key: value`` comment lines (which numpy.loadtxt
+    and most spreadsheets skip). Columns of unequal length are
+    cut to the shortest.
+
+    The rows are formatted `chunk` at a time with a single string
+    operation, and `progress` (if given) is called with the
+    fraction done after each chunk.
+    """
+    nrows = min(len(c) for c in columns)
+    table = numpy.column_stack([c[:nrows] for c in columns])
+    row = ','.join(['%r'] * table.shape[1]) + '\n'
+    with open(path, 'w') as f:
+        for key, value in sorted((metadata or {}).items()):
+            f.write('# %s: %s\n' % (key, value))
+        for start in range(0, nrows, chunk):
+            block = table[start:start + chunk]
+            # tolist gives python floats, whose repr is the
+            # shortest string that reads back to the same value
+            f.write((row * len(block)) % tuple(block.ravel().tolist()))
+            if progress is not None:
+                progress(min(start + chunk, nrows) / float(nrows))
+
+def write_npy(path, columns, metadata=None, progress=None):
+    """
+    A .npy array of shape (2, N) for a single line, or
+    (lines, 2, N) for several. The .npy format has no room for
+    metadata, which is therefore not written.
+    """
+    pairs = [columns[i:i + 2] for i in range(0, len(columns), 2)]
+    if len(pairs) == 1:
+        numpy.save(path, numpy.array(pairs[0]))
+    else:
+        numpy.save(path, numpy.array(pairs))
+    if progress is not None:
+        progress(1.)
+
+def write_npz(path, columns, metadata=None, progress=None):
+    """
+    A compressed .npz archive, with arrays x0, y0, x1, y1, ... for
+    each line, one array per metadata item, and all the metadata
+    together as a JSON string under 'metadata'.
+    """
+    arrays = {}
+    for i in range(0, len(columns), 2):
+        arrays['x%d' % (i // 2)] = columns[i]
+        arrays['y%d' % (i // 2)] = columns[i + 1]
+    metadata = dict(metadata or {})
+    for key, value in metadata.items():
+        if value is not None:
+            arrays[key] = numpy.asarray(value)
+    arrays['metadata'] = numpy.array(json.dumps(metadata))
+    numpy.savez_compressed(path, **arrays)
+    if progress is not None:
+        progress(1.)
+
+writers = {
+    '.csv': write_csv,
+    '.npy': write_npy,
+    '.npz': write_npz,
+}
+
+class ExportThread(threading.Thread):
+    """
+    Writes `columns` to `path` in the background, in the format
+    given by the extension `ext` (a key of `writers`).
+
+    `progress` is called with the fraction done as the export goes
+    along, and `done` with the path and the exception raised, or
+    None, when it is finished. Both are called from this thread.
+    The columns must not be modified until it is finished.
+    """
+
+    def __init__(self, path, ext, columns, metadata=None,
+                 progress=None, done=None):
+        threading.Thread.__init__(self)
+        self.path = path
+        self.writer = writers[ext]
+        self.columns = columns
+        self.metadata = metadata
+        self.progress = progress
+        self.done = done
+
+    def run(self):
+        error = None
+        try:
+            self.writer(self.path, self.columns, self.metadata,
+                        self.progress)
+        except Exception as e:
+            error = e
+        if self.done is not None:
+            self.done(self.path, error)
@@ -0,0 +1,192 @@
+"""Stand-in for the LabView CCD server, for testing without the lab machine.
+
+Listens on localhost and answers requests with the protocol in
+lvclient, using synthetic frames: a few Gaussian lines on a noisy
+background, positioned according to the requested center wavelength.
+For example, to load-test the client with full frames::
+
+    python fake_server.py --rows 256 --cols 1024 --exposure .1 &
+    python ccd_client.py --ip 127.0.0.1 --lvclient
+
+That protocol has not been checked against the LabView program or
+wanglib's client, so a test with wanglib's client (ccd_client.py
+without --lvclient) only shows whether the two agree. To that end a
+request is read leniently: ``Q``, then the digits of 100 times the
+center wavelength, ended by a line end, any other character, or a
+pause. A client that sends nothing for `--idle-timeout` seconds is
+disconnected.
+
+The server can also be made to misbehave, to check that the client
+recovers: it can close the connection every so many frames, stop
+answering, or send its responses slowly.
+"""
+
+import socket
+import random
+from time import sleep, time
+from SocketServer import ThreadingTCPServer, StreamRequestHandler
+from argparse import ArgumentParser
+
+import numpy
+
+from lvclient import DEFAULT_PORT, encode_response
+
+parser = ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+        help="TCP port to listen on (default: %(default)s).")
+parser.add_argument('--rows', type=int, default=10,
+        help="Rows of the simulated CCD (default: %(default)s).")
+parser.add_argument('--cols', type=int, default=1024,
+        help="Pixels per row (default: %(default)s).")
+parser.add_argument('--exposure', type=float, default=.2, metavar='SECONDS',
+        help="Time taken to acquire each frame (default: %(default)s).")
+parser.add_argument('--jitter', type=float, default=0., metavar='SECONDS',
+        help="Random extra delay of up to this long per frame.")
+parser.add_argument('--drop-every', type=int, default=0, metavar='N',
+        help="Close the connection after every N frames.")
+parser.add_argument('--stall-every', type=int, default=0, metavar='N',
+        help="Stop answering (but keep the connection) after every "
+             "N frames, until the client gives up.")
+parser.add_argument('--bandwidth', type=float, default=0., metavar='BYTES',
+        help="Send responses at this many bytes per second, "
+             "to imitate a slow link.")
+parser.add_argument('--idle-timeout', type=float, default=60.,
+        metavar='SECONDS',
+        help="Disconnect a client that sends no request for this long "
+             "(default: %(default)s).")
+parser.add_argument('--distinct', type=int, default=8, metavar='N',
+        help="Number of different frames generated for each center "
+             "wavelength, and then sent in turn (default: %(default)s).")
+
+class FrameSource(object):
+    """
+    Encoded responses for a CCD of `rows` x `cols` pixels.
+
+    Formatting a large frame as text takes longer than sending it,
+    so `distinct` frames are made for each center wavelength, and
+    then reused.
+    """
+
+    peak_locs = range(600, 1000, 100)
+
+    def __init__(self, rows, cols, distinct=8):
+        self.rows = rows
+        self.cols = cols
+        self.distinct = distinct
+        self.responses = {}
+
+    def frame(self, center_wl):
+        x = center_wl + (numpy.arange(self.cols) - self.cols // 2) * 150. / 512
+        lines = numpy.zeros(self.cols)
+        for loc in self.peak_locs:
+            lines += 10 * numpy.exp(-(x - loc) ** 2 / 100)
+        grid = 100 + lines + numpy.random.randn(self.rows, self.cols)
+        return x, numpy.round(grid, 2)
+
+    def response(self, center_wl, n):
+        if center_wl not in self.responses:
+            self.responses[center_wl] = [encode_response(*self.frame(center_wl))
+                                         for i in range(self.distinct)]
+        return self.responses[center_wl][n % self.distinct]
+
+class Handler(StreamRequestHandler):
+
+    # seconds to wait for a request, and for the rest of one that
+    # has begun without a line end
+    timeout = 60.
+    gap = .2
+
+    def read_request(self):
+        """
+        The center wavelength asked for, or None when the client has
+        hung up. Raises socket.timeout if it asks for nothing.
+        """
+        sock = self.connection
+        c = sock.recv(1)
+        while c and c != b'Q':
+            c = sock.recv(1)  # the line end of the last request
+        if not c:
+            return None
+        digits = b''
+        sock.settimeout(self.gap)
+        try:
+            while True:
+                c = sock.recv(1)
+                if not c.isdigit():
+                    break
+                digits += c
+        except socket.timeout:
+            pass  # a request without a line end
+        finally:
+            sock.settimeout(self.timeout)
+        if not digits:
+            raise ValueError("request without a wavelength")
+        return int(digits) / 100.
+
+    def handle(self):
+        opts = self.server.options
+        source = self.server.source
+        start = time()
+        nbytes = 0
+        n = 0
+        print("connection from %s:%d" % self.client_address)
+        try:
+            while True:
+                center_wl = self.read_request()
+                if center_wl is None:
+                    break
+                sleep(opts.exposure + random.uniform(0, opts.jitter))
+                response = source.response(center_wl, n)
+                self.send(response, opts.bandwidth)
+                n += 1
+                nbytes += len(response)
+                if opts.drop_every and n % opts.drop_every == 0:
+                    print("dropping the connection")
+                    break
+                if opts.stall_every and n % opts.stall_every == 0:
+                    print("stalling")
+                    self.connection.settimeout(None)
+                    while self.connection.recv(1):
+                        pass  # until the client hangs up
+                    break
+        except socket.timeout:
+            print("no request for %g s; disconnecting" % self.timeout)
+        except socket.error as e:
+            print("client went away: %s" % e)
+        except ValueError as e:
+            print("bad request: %s" % e)
+        elapsed = time() - start
+        print("%d frames (%.1f MB) in %.1f s, %.1f frames/s"
+              % (n, nbytes / 1e6, elapsed, n / max(elapsed, 1e-9)))
+
+    def finish(self):
+        try:
+            StreamRequestHandler.finish(self)
+        except socket.error:
+            pass  # the client has already gone
+
+    def send(self, data, bandwidth):
+        if not bandwidth:
+            self.wfile.write(data)
+            return
+        chunk = max(int(bandwidth / 20), 1)
+        for start in range(0, len(data), chunk):
+            self.wfile.write(data[start:start + chunk])
+            self.wfile.flush()
+            sleep(chunk / bandwidth)
+
+class Server(ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    Handler.timeout = args.idle_timeout
+    server = Server(('127.0.0.1', args.port), Handler)
+    server.options = args
+    server.source = FrameSource(args.rows, args.cols, args.distinct)
+    print("serving %dx%d frames on port %d" % (args.rows, args.cols, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,341 @@
+"""Sharing one CCD stream between several programs.
+
+Only one client can talk to the LabView program at a time. A Hub is
+that client: it asks for frames in a single thread, and sends each
+frame to every program subscribed to it over a local socket. The GUI
+can subscribe with a HubClient, which has the same get_spectrum() and
+center_wl as the usual clients, and so can loggers or notebooks::
+
+    python hub.py --ip 128.223.xxx.xxx &
+    python ccd_client.py --hub localhost
+
+    >>> from hub import HubClient
+    >>> x, grid = HubClient().get_spectrum()
+
+Each subscriber has its own bounded queue of frames, so a slow one
+loses frames instead of holding up the acquisition or the others.
+It chooses the length of its queue, and whether to drop the oldest
+frames or the newest when it is full.
+
+A frame is sent as a fixed-size header (see HEADER) followed by the
+raw bytes of the x axis and of the grid. A subscriber sends lines of
+text: first ``SUB <queue length> <oldest|newest>``, then
+``WL <nm>`` whenever it moves the spectrometer, which sets the
+center wavelength the hub asks the CCD program for.
+"""
+
+import socket
+import struct
+import threading
+from collections import deque
+from time import time, sleep
+from argparse import ArgumentParser
+
+import numpy
+
+from lvclient import LabviewClient, LinkError, DEFAULT_PORT
+
+HUB_PORT = 3664
+
+# magic, frame number, time, center wavelength (NaN if unknown),
+# dtypes of x and of the grid, length of x, rows and columns of grid
+HEADER = struct.Struct('<4sQdd8s8sIII')
+MAGIC = b'CCDF'
+
+def encode_header(seq, timestamp, center_wl, x, grid):
+    wl = numpy.nan if center_wl is None else center_wl
+    rows, cols = grid.shape
+    return HEADER.pack(MAGIC, seq, timestamp, wl,
+                       x.dtype.str.encode('ascii'),
+                       grid.dtype.str.encode('ascii'), len(x), rows, cols)
+
+def decode_header(data):
+    """(seq, time, center_wl, x dtype, grid dtype, npix, rows, cols)"""
+    fields = HEADER.unpack(data)
+    if fields[0] != MAGIC:
+        raise LinkError("not a frame from the hub")
+    seq, timestamp, wl, xdt, gdt, npix, rows, cols = fields[1:]
+    return (seq, timestamp, wl, numpy.dtype(xdt.rstrip(b'\0').decode()),
+            numpy.dtype(gdt.rstrip(b'\0').decode()), npix, rows, cols)
+
+class Subscriber(object):
+    """
+    One connection to the hub, with its queue of frames to send.
+
+    `policy` is 'oldest' to drop the oldest waiting frame when the
+    queue is full, or 'newest' to drop the frame that has just come.
+    """
+
+    def __init__(self, hub, sock, maxlen=4, policy='oldest'):
+        if policy not in ('oldest', 'newest'):
+            raise ValueError("unknown policy %r" % policy)
+        if maxlen < 1:
+            raise ValueError("queue length must be at least 1")
+        self.hub = hub
+        self.sock = sock
+        self.policy = policy
+        self.queue = deque(maxlen=maxlen if policy == 'oldest' else None)
+        self.maxlen = maxlen
+        self.cond = threading.Condition()
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+
+    def offer(self, frame):
+        """Queue a frame; called from the hub's acquisition thread."""
+        with self.cond:
+            if len(self.queue) >= self.maxlen:
+                self.dropped += 1
+                if self.policy == 'newest':
+                    return
+            self.queue.append(frame)
+            self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def run_sender(self):
+        try:
+            while True:
+                with self.cond:
+                    while not self.queue and not self.closed:
+                        self.cond.wait()
+                    if self.closed:
+                        return
+                    header, x, grid = self.queue.popleft()
+                self.sock.sendall(header)
+                self.sock.sendall(x.data)
+                self.sock.sendall(grid.data)
+                self.sent += 1
+        except socket.error:
+            pass
+        finally:
+            self.hub.remove(self)
+
+    def run_reader(self, rfile):
+        # requests from the subscriber, such as moves
+        try:
+            while True:
+                line = rfile.readline()
+                if not line:
+                    break
+                words = line.split()
+                if len(words) == 2 and words[0] == b'WL':
+                    self.hub.set_center_wl(float(words[1]))
+        except (socket.error, ValueError):
+            pass
+        self.close()
+
+class Hub(object):
+    """
+    Gets frames from `source` (an object with get_spectrum and
+    center_wl, such as an LabviewClient) and sends them to everyone
+    who connects to `port`.
+
+    If `source` raises one of `link_errors` (IOError covers LinkError
+    and socket errors), the hub says so, and tries again
+    `retry_wait` seconds later; meanwhile the subscribers get no
+    frames. A new subscriber has `handshake_timeout` seconds to send
+    its SUB line.
+    """
+
+    link_errors = (IOError,)
+    retry_wait = 5.
+    handshake_timeout = 5.
+
+    def __init__(self, source, port=HUB_PORT, host='127.0.0.1'):
+        self.source = source
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(5)
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.seq = 0
+        self._want_abort = False
+
+    def set_center_wl(self, wl):
+        self.source.center_wl = wl
+
+    def remove(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+                print("subscriber left: %d frames sent, %d dropped"
+                      % (subscriber.sent, subscriber.dropped))
+        subscriber.close()
+
+    def run_acquisition(self):
+        failed = False
+        while not self._want_abort:
+            try:
+                x, grid = self.source.get_spectrum()
+            except EOFError:
+                break
+            except self.link_errors as e:
+                if not failed:
+                    print("no frames from the CCD (%s); retrying every "
+                          "%g s" % (e, self.retry_wait))
+                failed = True
+                sleep(self.retry_wait)
+                continue
+            if failed:
+                print("frames from the CCD again")
+                failed = False
+            x = numpy.ascontiguousarray(x)
+            grid = numpy.ascontiguousarray(grid)
+            header = encode_header(self.seq, time(), self.source.center_wl,
+                                   x, grid)
+            self.seq += 1
+            with self.lock:
+                subscribers = list(self.subscribers)
+            for subscriber in subscribers:
+                subscriber.offer((header, x, grid))
+
+    def accept(self, sock):
+        """Take on a new connection, on a thread of its own."""
+        thread = threading.Thread(target=self.handshake, args=(sock,))
+        thread.daemon = True
+        thread.start()
+
+    def handshake(self, sock):
+        sock.settimeout(self.handshake_timeout)
+        try:
+            rfile = sock.makefile('rb')
+            words = rfile.readline().split()
+            if len(words) != 3 or words[0] != b'SUB':
+                raise ValueError("expected SUB <queue length> "
+                                 "<oldest|newest>")
+            subscriber = Subscriber(self, sock, int(words[1]),
+                                    words[2].decode('ascii'))
+        except (socket.error, ValueError) as e:
+            print("subscriber refused: %s" % e)
+            sock.close()
+            return
+        sock.settimeout(None)
+        with self.lock:
+            self.subscribers.append(subscriber)
+        threads = [threading.Thread(target=subscriber.run_sender),
+                   threading.Thread(target=subscriber.run_reader,
+                                    args=(rfile,))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+    def serve_forever(self):
+        acquisition = threading.Thread(target=self.run_acquisition)
+        acquisition.daemon = True
+        acquisition.start()
+        while not self._want_abort:
+            sock, address = self.server.accept()
+            print("subscriber from %s:%d" % address)
+            self.accept(sock)
+
+class HubClient(object):
+    """
+    Frames from a Hub, with the interface of the LabView clients.
+
+    Setting `center_wl` asks the hub to use that center wavelength;
+    frames taken before the change are skipped.
+    """
+
+    def __init__(self, host='127.0.0.1', port=HUB_PORT, queue=4,
+                 policy='oldest', timeout=10., center_wl=None):
+        self.host = host
+        self.port = port
+        self.queue = queue
+        self.policy = policy
+        self.timeout = timeout
+        self._center_wl = center_wl
+        self.sock = None
+        self.connect()
+
+    def connect(self):
+        self.close()
+        self.sock = socket.create_connection((self.host, self.port),
+                                             self.timeout)
+        self.sock.sendall(('SUB %d %s\n' % (self.queue, self.policy))
+                          .encode('ascii'))
+        if self._center_wl is not None:
+            self.send_center_wl()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+
+    @property
+    def center_wl(self):
+        return self._center_wl
+
+    @center_wl.setter
+    def center_wl(self, wl):
+        self._center_wl = wl
+        if self.sock is not None:
+            self.send_center_wl()
+
+    def send_center_wl(self):
+        self.sock.sendall(('WL %r\n' % float(self._center_wl))
+                          .encode('ascii'))
+
+    def recv_into(self, buf):
+        view = memoryview(buf)
+        while len(view):
+            n = self.sock.recv_into(view)
+            if not n:
+                raise LinkError("the hub has closed the connection")
+            view = view[n:]
+
+    def get_spectrum(self):
+        if self.sock is None:
+            self.connect()
+        header = bytearray(HEADER.size)
+        try:
+            while True:
+                self.recv_into(header)
+                fields = decode_header(bytes(header))
+                seq, timestamp, wl, xdtype, gdtype, npix, rows, cols = fields
+                # new arrays each time, since a Pipeline may still be
+                # reducing the last frame; read straight into them
+                x = numpy.empty(npix, xdtype)
+                grid = numpy.empty((rows, cols), gdtype)
+                self.recv_into(x.view(numpy.uint8))
+                self.recv_into(grid.reshape(-1).view(numpy.uint8))
+                if self._center_wl is None or wl != wl \
+                        or abs(wl - self._center_wl) < 1e-6:
+                    return x, grid
+        except (socket.error, socket.timeout):
+            self.close()
+            raise LinkError("lost the connection to the hub")
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ip', dest='ip', metavar='ADDRESS', required=True,
+            help="IP address of the computer running the LabView program.")
+    parser.add_argument('--port', dest='port', type=int, default=DEFAULT_PORT,
+            help="With --lvclient, TCP port of the LabView program "
+                 "(default: %(default)s).")
+    parser.add_argument('--wl', dest='wl', type=float, required=True,
+            help="Center wavelength to start with, in nm.")
+    parser.add_argument('--listen', dest='listen', type=int, default=HUB_PORT,
+            help="Port for subscribers to connect to (default: %(default)s).")
+    parser.add_argument('--lvclient', dest='lvclient', action='store_true',
+            help="Use the experimental client in lvclient.py instead of "
+                 "wanglib's (see ccd_client.py --lvclient).")
+    args = parser.parse_args()
+
+    if args.lvclient:
+        hub = Hub(LabviewClient(args.wl, args.ip, args.port), args.listen)
+    else:
+        from wanglib.ccd import labview_client, InstrumentError
+        hub = Hub(labview_client(center_wl=args.wl, host=args.ip),
+                  args.listen)
+        hub.link_errors = (IOError, InstrumentError)
+    print("hub for %s:%d listening on port %d"
+          % (args.ip, args.port, args.listen))
+    try:
+        hub.serve_forever()
+    except KeyboardInterrupt:
+        pass
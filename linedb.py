@@ -0,0 +1,94 @@
+"""Reference emission lines, for checking the wavelength axis.
+
+The line lists are ASCII tables from the NIST Atomic Spectra Database
+(http://physics.nist.gov/cgi-bin/ASD/lines1.pl), one file per element,
+in the caldata directory. A LineDatabase parses each one only once,
+and also keeps the parsed table in a cache file next to it, which is
+used instead of the table until the table is changed.
+"""
+
+import os
+import glob
+
+import numpy
+from matplotlib.collections import LineCollection
+
+CALDATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'caldata')
+
+def read_NIST(filename):
+    """
+    ascii data from http://physics.nist.gov/cgi-bin/ASD/lines1.pl
+
+    columns of returned array are observed wl, relative int, and aki (?)
+    """
+    a = numpy.genfromtxt(filename, delimiter='|',
+            skip_header=6, skip_footer=1)
+    data = a[:,1:4] # select location, relative int, and aki (?)
+    mask = numpy.isnan(data[:,0]) # some lines are blank
+    return data[~mask]
+
+class LineDatabase(object):
+    """
+    The line lists of every element with a table in `directory`.
+
+    Tables are kept as (3, N) arrays of wavelength, relative
+    intensity and Aki, sorted by wavelength, so that the lines in
+    a window of wavelengths can be found by bisection.
+    """
+
+    def __init__(self, directory=CALDATA):
+        self.directory = directory
+        self.tables = {}
+
+    def elements(self):
+        """Names of the elements we have tables for, e.g. 'Ar'."""
+        paths = glob.glob(os.path.join(self.directory, '*.txt'))
+        return sorted(os.path.splitext(os.path.basename(p))[0]
+                      for p in paths)
+
+    def table(self, element):
+        if element not in self.tables:
+            self.tables[element] = self.load(element)
+        return self.tables[element]
+
+    def load(self, element):
+        source = os.path.join(self.directory, element + '.txt')
+        cache = os.path.join(self.directory, '.cache', element + '.npy')
+        try:
+            if os.path.getmtime(cache) >= os.path.getmtime(source):
+                return numpy.load(cache)
+        except (OSError, IOError, ValueError):
+            pass  # no cache yet, or it is unreadable
+        data = read_NIST(source)
+        data = numpy.ascontiguousarray(data[numpy.argsort(data[:,0])].T)
+        try:
+            if not os.path.isdir(os.path.dirname(cache)):
+                os.makedirs(os.path.dirname(cache))
+            numpy.save(cache, data)
+        except (OSError, IOError):
+            pass  # can't write there; we'll parse it again next time
+        return data
+
+    def lines(self, element, wlmin=-numpy.inf, wlmax=numpy.inf,
+              min_intensity=1e4):
+        """
+        Wavelengths of the lines of `element` between `wlmin` and
+        `wlmax` with a relative intensity above `min_intensity`.
+        """
+        wl, rel_int, aki = self.table(element)
+        i, j = numpy.searchsorted(wl, [wlmin, wlmax])
+        return wl[i:j][rel_int[i:j] > min_intensity]
+
+def line_collection(axes, wls, **kwargs):
+    """
+    A single artist with a vertical line, the full height of `axes`,
+    at each of the wavelengths `wls`. It is added to `axes`, and
+    removing it removes all of the lines.
+    """
+    segments = numpy.zeros((len(wls), 2, 2))
+    segments[:, :, 0] = numpy.asarray(wls)[:, numpy.newaxis]
+    segments[:, 1, 1] = 1  # from the bottom of the axes to the top
+    lines = LineCollection(segments, transform=axes.get_xaxis_transform(),
+                           **kwargs)
+    axes.add_collection(lines, autolim=False)
+    return lines
@@ -0,0 +1,79 @@
+"""Drawing long spectra quickly, by drawing fewer points.
+
+A line with hundreds of thousands of points (a stitched scan, say)
+is slow to draw, yet only a thousand or so columns of pixels show it.
+A Pyramid keeps, for bins of `factor`, `factor`**2, ... points, the
+minimum and maximum of y in each bin. To draw a range of x on so many
+pixels, `decimate` picks the level whose bins are just finer than a
+pixel, and returns the minimum and maximum of each bin in that range,
+one after the other. Drawn as a line, these go up and down within
+each column of pixels, so that peaks look exactly as they would with
+every point drawn, for the cost of a few points per pixel.
+"""
+
+import numpy
+
+class Pyramid(object):
+    """
+    Min/max envelopes of y(x) at coarser and coarser resolutions.
+    x must be sorted, increasing or decreasing.
+    """
+
+    def __init__(self, x, y, factor=4):
+        self.x = numpy.asarray(x)
+        self.y = numpy.asarray(y)
+        self.factor = factor
+        self.reversed = len(x) > 1 and self.x[0] > self.x[-1]
+        xs, ys = (self.x[::-1], self.y[::-1]) if self.reversed \
+            else (self.x, self.y)
+        # levels[k] = (x at the start of each bin, min, max),
+        # for bins of factor**(k+1) points
+        self.levels = []
+        lo = hi = ys
+        starts = xs
+        while len(lo) >= 2 * factor:
+            n = len(lo) // factor * factor
+            if n < len(lo):
+                # the leftover points make a last, smaller bin
+                lo = numpy.concatenate([lo, numpy.repeat(lo[-1:],
+                                         factor - len(lo) + n)])
+                hi = numpy.concatenate([hi, numpy.repeat(hi[-1:],
+                                         factor - len(hi) + n)])
+                starts = numpy.concatenate([starts, numpy.repeat(
+                    starts[-1:], factor - len(starts) + n)])
+            lo = lo.reshape(-1, factor).min(axis=1)
+            hi = hi.reshape(-1, factor).max(axis=1)
+            starts = starts[::factor]
+            self.levels.append((starts, lo, hi))
+        self.xs = xs
+        self.ys = ys
+
+    def decimate(self, xmin, xmax, pixels):
+        """
+        (x, y) to draw for the range xmin to xmax on `pixels`
+        columns of pixels: the points themselves, if there are few
+        enough, or else the envelope from the coarsest level that
+        still has at least one bin per pixel. Takes time in
+        proportion to the number of pixels, not of points.
+        """
+        i0, i1 = numpy.searchsorted(self.xs, [xmin, xmax])
+        # one point either side, so the line runs off the edges
+        i0, i1 = max(i0 - 1, 0), min(i1 + 1, len(self.xs))
+        npoints = i1 - i0
+        if npoints <= 2 * pixels or not self.levels:
+            return self.xs[i0:i1], self.ys[i0:i1]
+        # the coarsest level that still has a bin for every pixel
+        level, size = 0, self.factor
+        if npoints // size < pixels:
+            return self.xs[i0:i1], self.ys[i0:i1]
+        while level + 1 < len(self.levels) and \
+                npoints // (size * self.factor) >= pixels:
+            level += 1
+            size *= self.factor
+        starts, lo, hi = self.levels[level]
+        j0, j1 = i0 // size, -(-i1 // size)
+        x = numpy.repeat(starts[j0:j1], 2)
+        y = numpy.empty(len(x))
+        y[0::2] = lo[j0:j1]
+        y[1::2] = hi[j0:j1]
+        return x, y
@@ -0,0 +1,159 @@
+"""Client for the LabView CCD server, with timeouts and reconnection.
+
+This has the same ``get_spectrum()``/``center_wl`` interface as
+``wanglib.ccd.labview_client``, so that ccd_client can use either.
+The requests it sends are its own (see below), and have not been
+checked against those of wanglib's client or against the LabView
+program, so wanglib's client stays the default, and this one is
+only used when asked for (``ccd_client.py --lvclient``). It adds:
+
+- every network operation has a timeout, so a dead link raises an
+  error instead of hanging the acquisition thread;
+- after a failure it reconnects by itself, waiting longer after each
+  failed attempt (exponential backoff);
+- optionally, the request for the next frame is sent as soon as a
+  response has arrived, so the LabView program starts on frame N+1
+  while we are still parsing frame N.
+
+The protocol, as implemented by encode_request and parse_response:
+the client sends ``Q`` followed by 100 times the center wavelength
+in nm, as an ASCII integer, and a CRLF. The server answers with the
+length of the payload as 7 ASCII digits, then the payload: ASCII
+numbers separated by tabs, one row per line; the first row is the
+wavelength axis, and the rest are the rows of the CCD.
+
+Python 2 has no asyncio, so the pipelining is done with a blocking
+socket and the ordering of sends and receives.
+"""
+
+import socket
+import random
+from time import sleep
+
+import numpy
+
+DEFAULT_PORT = 3663
+HEADER_LENGTH = 7
+
+class LinkError(IOError):
+    """The connection to the LabView program has failed."""
+
+def encode_request(center_wl):
+    return ('Q%d\r\n' % round(100 * center_wl)).encode('ascii')
+
+def encode_response(x, grid):
+    """The server's side of the exchange, for testing (see fake_server)."""
+    data = numpy.vstack([x, grid])
+    row = '\t'.join(['%g'] * data.shape[1]) + '\n'
+    payload = ((row * data.shape[0]) % tuple(data.ravel().tolist()))
+    payload = payload.encode('ascii')
+    header = ('%0*d' % (HEADER_LENGTH, len(payload))).encode('ascii')
+    return header + payload
+
+def parse_response(payload):
+    """(x, grid) from a response payload."""
+    nrows = payload.count(b'\n')
+    data = numpy.fromstring(payload, sep=' ')
+    data = data.reshape(nrows, -1)
+    return data[0], data[1:]
+
+class LabviewClient(object):
+    """
+    Client with the interface of ``wanglib.ccd.labview_client``.
+
+    `timeout` is the longest to wait for a connection, or for any
+    part of a response, in seconds. A request is tried up to
+    `retries` times, reconnecting in between after a wait that
+    starts at `backoff` seconds and doubles each time, up to
+    `max_backoff`. Then LinkError is raised.
+
+    With `pipelined`, the next request is sent as soon as each
+    response has been received. If `center_wl` has changed by the
+    time its response is collected, that response is thrown away.
+
+    """
+
+    def __init__(self, center_wl, host, port=DEFAULT_PORT, timeout=10.,
+                 pipelined=True, retries=5, backoff=.5, max_backoff=30.):
+        self.center_wl = center_wl
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.pipelined = pipelined
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sock = None
+        self.in_flight = None  # center_wl of the request sent, if any
+        self.reconnects = 0
+        self.connect()
+
+    def connect(self):
+        self.close()
+        self.sock = socket.create_connection((self.host, self.port),
+                                             self.timeout)
+        self.sock.settimeout(self.timeout)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+        self.in_flight = None
+
+    def reconnect(self, attempt):
+        # wait 1, 2, 4... times the backoff, with a little jitter so
+        # that several clients don't all come back at once
+        wait = min(self.backoff * 2 ** attempt, self.max_backoff)
+        sleep(wait * random.uniform(.8, 1.2))
+        self.reconnects += 1
+        try:
+            self.connect()
+        except (socket.error, socket.timeout):
+            self.close()
+
+    def send_request(self):
+        center_wl = self.center_wl
+        self.sock.sendall(encode_request(center_wl))
+        self.in_flight = center_wl
+
+    def recv_exactly(self, n):
+        chunks = []
+        while n > 0:
+            chunk = self.sock.recv(min(n, 1 << 20))
+            if not chunk:
+                raise LinkError("connection closed by the LabView program")
+            chunks.append(chunk)
+            n -= len(chunk)
+        return b''.join(chunks)
+
+    def recv_response(self):
+        length = int(self.recv_exactly(HEADER_LENGTH))
+        payload = self.recv_exactly(length)
+        requested, self.in_flight = self.in_flight, None
+        return requested, payload
+
+    def exchange(self):
+        """Raw payload of the next frame taken at the current center_wl."""
+        while True:
+            if self.in_flight is None:
+                self.send_request()
+            requested, payload = self.recv_response()
+            if self.pipelined:
+                self.send_request()
+            if requested == self.center_wl:
+                return payload
+            # taken before a move; the next one will be right
+
+    def get_spectrum(self):
+        for attempt in range(self.retries):
+            try:
+                if self.sock is None:
+                    self.connect()
+                payload = self.exchange()
+                return parse_response(payload)
+            except (socket.error, socket.timeout, LinkError, ValueError):
+                self.close()
+                if attempt + 1 < self.retries:
+                    self.reconnect(attempt)
+        raise LinkError("no response from %s:%d after %d attempts"
+                        % (self.host, self.port, self.retries))
@@ -0,0 +1,148 @@
+"""Moving the spectrometer without holding up the GUI.
+
+A grating move over RS-232 takes seconds. A MotionController owns
+the spectrometer (a wanglib spex750m, or anything with the same
+set_wavelength, calibrate and get_wl) and runs the commands given to
+it, one after another, on its own thread, so that nothing else talks
+to the serial port while a move is under way. When a command starts
+and when it is done, it posts a MotionEvent to `notify_window`.
+
+The last known wavelength, and whether a move is under way, are kept
+in multiprocessing Values (`position` and `moves`), so that an
+acquisition loop can read them even from another process, and wait
+for the grating to stop before it takes a frame.
+"""
+
+import threading
+import multiprocessing
+from Queue import Queue, Empty
+
+import wx
+import wx.lib.newevent
+
+# a command event, so that it goes up from the panel to its parents;
+# kind is 'started', 'done', 'failed', 'cancelled' or 'position'
+MotionEvent, EVT_MOTION = wx.lib.newevent.NewCommandEvent()
+
+class Command(object):
+    """
+    One command for a MotionController; `done` is set after it.
+    Then either `cancelled` is True, `error` is what it raised, or
+    it succeeded.
+    """
+
+    def __init__(self, action, wavelength=None, generation=0):
+        self.action = action
+        self.wavelength = wavelength
+        self.generation = generation
+        self.done = threading.Event()
+        self.cancelled = False
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.done.is_set() and not self.cancelled \
+            and self.error is None
+
+class MotionController(threading.Thread):
+    """
+    Runs the commands for the spectrometer `spec` on a thread.
+
+    `move` and `calibrate` queue a command, and return at once
+    unless `wait` is given. `cancel` drops the commands that have not
+    started; a move that has started runs to the end, since the
+    serial link cannot be interrupted. If `poll` is a number of
+    seconds, the position is also read back that often while idle.
+
+    `moves` counts the commands that have started and finished, so
+    it is odd while one is running.
+    """
+
+    def __init__(self, spec, notify_window=None, poll=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.spec = spec
+        self.notify_window = notify_window
+        self.poll = poll
+        self.commands = Queue()
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.position = multiprocessing.Value('d', spec.get_wl())
+        self.moves = multiprocessing.Value('i', 0)
+
+    @property
+    def moving(self):
+        return self.moves.value % 2 == 1
+
+    def put(self, action, wavelength=None, wait=False):
+        with self.lock:
+            command = Command(action, wavelength, self.generation)
+        self.commands.put(command)
+        if wait:
+            command.done.wait()
+        return command
+
+    def move(self, wavelength, wait=False):
+        return self.put('move', wavelength, wait)
+
+    def calibrate(self, wavelength, wait=False):
+        return self.put('calibrate', wavelength, wait)
+
+    def read_position(self, wait=False):
+        return self.put('position', None, wait)
+
+    def cancel(self):
+        with self.lock:
+            self.generation += 1
+
+    def stop(self):
+        """Finish the command under way, then end the thread."""
+        self.cancel()
+        self.commands.put(None)
+
+    def notify(self, kind, command=None):
+        if self.notify_window is None:
+            return
+        wx.PostEvent(self.notify_window, MotionEvent(
+            self.notify_window.GetId(), kind=kind,
+            action=None if command is None else command.action,
+            wavelength=self.position.value,
+            error=None if command is None else command.error))
+
+    def run(self):
+        while True:
+            try:
+                command = self.commands.get(timeout=self.poll)
+            except Empty:
+                command = Command('position', generation=self.generation)
+            if command is None:
+                break
+            if command.generation != self.generation:
+                command.cancelled = True
+                command.done.set()
+                self.notify('cancelled', command)
+                continue
+            if command.action == 'position':
+                self.execute(command)
+                self.notify('position', command)
+                continue
+            with self.moves.get_lock():
+                self.moves.value += 1
+            self.notify('started', command)
+            self.execute(command)
+            with self.moves.get_lock():
+                self.moves.value += 1
+            self.notify('done' if command.error is None else 'failed',
+                        command)
+
+    def execute(self, command):
+        try:
+            if command.action == 'move':
+                self.spec.set_wavelength(command.wavelength)
+            elif command.action == 'calibrate':
+                self.spec.calibrate(command.wavelength)
+            self.position.value = self.spec.get_wl()
+        except Exception as e:
+            command.error = e
+        finally:
+            command.done.set()
@@ -0,0 +1,356 @@
+"""Fitting peaks in the live spectrum, as the frames come in.
+
+A PeakFitter is a tap on a Graph. For each of its FitWindows, a range
+of wavelengths with a given number of Gaussian or Lorentzian peaks on
+a flat background, it fits every frame it can on a pool of threads,
+with `levenberg_marquardt`. Each fit starts from the parameters of
+the last good one, so it takes only a few iterations. If the last fit
+of a window has not finished when a frame comes, that frame is
+skipped for that window, so the fits never hold up the acquisition
+or fall behind it.
+
+The results go into a fixed-size ring for each window (see Series),
+which a PeakFrame plots against time, and `PeakFitter.write_csv`
+exports.
+"""
+
+import threading
+from multiprocessing.pool import ThreadPool
+from time import time
+
+import wx
+import matplotlib
+matplotlib.use('WXAgg',warn=False)
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_wxagg import \
+        FigureCanvasWxAgg as FigCanvas
+import numpy
+
+from export import write_csv
+
+FOUR_LN2 = 4 * numpy.log(2)
+
+def peaks(x, params, shape='gaussian'):
+    """
+    A background plus peaks, and its derivatives with respect to
+    the parameters: (y, jacobian). `params` is the background
+    followed by the height, center and full width at half maximum
+    of each peak.
+    """
+    h, c, w = params[1:].reshape(-1, 3).T[:, :, numpy.newaxis]
+    u = (x - c) / w
+    if shape == 'gaussian':
+        g = numpy.exp(-FOUR_LN2 * u * u)
+        dg = -2 * FOUR_LN2 * u * g
+    else:
+        g = 1. / (1 + 4 * u * u)
+        dg = -8 * u * g * g
+    jac = numpy.empty((len(x), len(params)))
+    jac[:, 0] = 1
+    jac[:, 1::3] = g.T
+    jac[:, 2::3] = (-h * dg / w).T
+    jac[:, 3::3] = (-h * dg * u / w).T
+    return params[0] + numpy.dot(h[:, 0], g), jac
+
+def levenberg_marquardt(model, p0, x, y, max_iter=50, tol=1e-6):
+    """
+    Least-squares fit of ``model(x, p)``, which returns the model
+    and its jacobian, to y. Returns the parameters, the sum of the
+    squared residuals, and whether the fit converged.
+    """
+    p = numpy.array(p0, dtype=float)
+    f, jac = model(x, p)
+    r = y - f
+    cost = numpy.dot(r, r)
+    lam = 1e-3
+    for i in range(max_iter):
+        jtj = numpy.dot(jac.T, jac)
+        grad = numpy.dot(jac.T, r)
+        scale = numpy.diag(jtj) + 1e-12 * numpy.max(numpy.diag(jtj))
+        while True:
+            try:
+                step = numpy.linalg.solve(jtj + lam * numpy.diag(scale), grad)
+            except numpy.linalg.LinAlgError:
+                step = None
+            if step is not None:
+                trial = p + step
+                f, trial_jac = model(x, trial)
+                r_trial = y - f
+                trial_cost = numpy.dot(r_trial, r_trial)
+                if trial_cost < cost:
+                    break
+            lam *= 10
+            if lam > 1e10:
+                # no step makes it better: at the minimum already
+                return p, cost, True
+        done = cost - trial_cost <= tol * cost
+        p, jac, r, cost = trial, trial_jac, r_trial, trial_cost
+        lam = max(lam / 10, 1e-12)
+        if done:
+            return p, cost, True
+    return p, cost, False
+
+def guess(x, y, npeaks, shape='gaussian'):
+    """
+    Starting parameters for `npeaks` peaks in (x, y): the highest
+    point, with the width at half its height, then the highest point
+    once that peak is taken off, and so on.
+    """
+    background = numpy.percentile(y, 10)
+    rest = y - background
+    step = abs(x[-1] - x[0]) / (len(x) - 1)
+    p = [background]
+    for k in range(npeaks):
+        j = numpy.argmax(rest)
+        height = rest[j]
+        below = rest < .5 * height
+        left = numpy.nonzero(below[:j])[0]
+        right = numpy.nonzero(below[j:])[0]
+        lo = left[-1] if len(left) else 0
+        hi = j + right[0] if len(right) else len(x) - 1
+        peak = [height, x[j], max(hi - lo, 2) * step]
+        rest = rest - peaks(x, numpy.array([0.] + peak), shape)[0]
+        p.extend(peak)
+    return numpy.array(p)
+
+class Series(object):
+    """
+    The last `length` rows of `width` values, with their times, in a
+    ring written twice like waterfall.History, so that `get` is
+    always a slice.
+    """
+
+    def __init__(self, length, width):
+        self.length = length
+        self.times = numpy.zeros(2 * length)
+        self.values = numpy.zeros((2 * length, width))
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def append(self, t, values):
+        with self.lock:
+            i = self.count % self.length
+            self.times[i] = self.times[i + self.length] = t
+            self.values[i] = self.values[i + self.length] = values
+            self.count += 1
+
+    def get(self):
+        """Copies of the times and values, oldest first."""
+        with self.lock:
+            n = min(self.count, self.length)
+            stop = self.count % self.length + self.length
+            return (self.times[stop - n:stop].copy(),
+                    self.values[stop - n:stop].copy())
+
+class FitWindow(object):
+    """
+    `npeaks` peaks of `shape` ('gaussian' or 'lorentzian') between
+    `xmin` and `xmax`, and the history of their fits. Each row of
+    the series is the fitted parameters (see `peaks`) and the rms
+    residual.
+    """
+
+    def __init__(self, xmin, xmax, npeaks=1, shape='gaussian', length=2000):
+        self.xmin, self.xmax = min(xmin, xmax), max(xmin, xmax)
+        self.npeaks = npeaks
+        self.shape = shape
+        self.series = Series(length, 3 * npeaks + 2)
+        self.params = None  # of the last good fit, to start the next
+        self.busy = False
+        self.fits = self.skipped = self.failed = 0
+
+    def __str__(self):
+        return "%d %s %.1f-%.1f nm" % (self.npeaks, self.shape,
+                                       self.xmin, self.xmax)
+
+    def select(self, x):
+        return numpy.nonzero((x >= self.xmin) & (x <= self.xmax))[0]
+
+    def model(self, x, p):
+        return peaks(x, p, self.shape)
+
+    def fit(self, t, x, y):
+        # on a thread of the pool
+        try:
+            p0 = self.params
+            if p0 is None:
+                p0 = guess(x, y, self.npeaks, self.shape)
+            p, cost, converged = levenberg_marquardt(self.model, p0, x, y)
+            h, c, w = p[1:].reshape(-1, 3).T
+            if converged and numpy.all(numpy.isfinite(p)) \
+                    and numpy.all((c >= self.xmin) & (c <= self.xmax)) \
+                    and numpy.all((w > 0) & (w < self.xmax - self.xmin)):
+                self.params = p
+                self.series.append(t, numpy.append(
+                    p, numpy.sqrt(cost / len(x))))
+                self.fits += 1
+            else:
+                # start over from a guess next time
+                self.params = None
+                self.failed += 1
+        finally:
+            self.busy = False
+
+class PeakFitter(object):
+    """
+    Fits the FitWindows in `windows` to the frames passed to `tap`,
+    on `workers` threads.
+    """
+
+    def __init__(self, workers=2):
+        self.windows = []
+        self.pool = ThreadPool(workers)
+
+    def tap(self, raw, reduced):
+        # on the acquisition thread, with every frame
+        x, y = reduced
+        t = time()
+        for window in list(self.windows):
+            if window.busy:
+                window.skipped += 1
+                continue
+            i = window.select(x)
+            if len(i) < 3 * window.npeaks + 2:
+                continue
+            window.busy = True
+            # copies, since the frame buffers are reused
+            self.pool.apply_async(window.fit, (t, x[i], y[i].astype(float)))
+
+    def close(self):
+        self.windows = []
+        self.pool.terminate()
+
+    def write_csv(self, path):
+        """
+        All the fits, one row per peak: time, window, peak, height,
+        center, fwhm, background and rms residual.
+        """
+        rows = []
+        for k, window in enumerate(self.windows):
+            times, values = window.series.get()
+            for j in range(window.npeaks):
+                rows.append(numpy.column_stack([
+                    times, numpy.repeat(k, len(times)),
+                    numpy.repeat(j, len(times)),
+                    values[:, 1 + 3 * j:4 + 3 * j], values[:, 0], values[:, -1]]))
+        table = numpy.concatenate(rows) if rows else numpy.zeros((0, 8))
+        table = table[numpy.argsort(table[:, 0], kind='mergesort')]
+        metadata = dict(('window %d' % k, str(w))
+                        for k, w in enumerate(self.windows))
+        metadata['columns'] = ('time, window, peak, height, center, fwhm, '
+                               'background, rms')
+        write_csv(path, list(table.T), metadata)
+
+class PeakFrame(wx.Frame):
+    """
+    A window for fitting peaks in the spectrum of a Graph: the
+    centers and widths of the fitted peaks against time, and
+    controls to fit the peaks in the part of the spectrum shown.
+    """
+
+    title = "Peak fits"
+    shapes = ('gaussian', 'lorentzian')
+
+    def __init__(self, parent, graph, workers=2):
+        wx.Frame.__init__(self, parent, -1, self.title)
+        self.graph = graph
+        self.fitter = PeakFitter(workers)
+        self.started = time()
+        self.lines = []
+
+        self.fig = Figure((6.0, 5.0))
+        self.center_axes = self.fig.add_subplot(211)
+        self.center_axes.set_ylabel('center (nm)')
+        self.width_axes = self.fig.add_subplot(212, sharex=self.center_axes)
+        self.width_axes.set_ylabel('fwhm (nm)')
+        self.width_axes.set_xlabel('time (s)')
+        self.canvas = FigCanvas(self, -1, self.fig)
+
+        self.npeaks = wx.SpinCtrl(self, -1, size=(50,-1), min=1, max=10,
+                                  initial=1)
+        self.shape = wx.Choice(self, -1, choices=[s.capitalize()
+                                                  for s in self.shapes])
+        self.shape.SetSelection(0)
+        self.add_button = wx.Button(self, -1, "Fit peaks in view")
+        self.clear_button = wx.Button(self, -1, "Clear")
+        self.export_button = wx.Button(self, -1, "Export...")
+        self.label = wx.StaticText(self, -1, "Zoom in on the peaks, "
+                                   "then press \"Fit peaks in view\"")
+        self.Bind(wx.EVT_BUTTON, self.on_add_button, self.add_button)
+        self.Bind(wx.EVT_BUTTON, self.on_clear_button, self.clear_button)
+        self.Bind(wx.EVT_BUTTON, self.on_export_button, self.export_button)
+
+        controls = wx.BoxSizer(wx.HORIZONTAL)
+        controls.Add(self.npeaks, 0, border=5,
+                     flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL)
+        controls.Add(self.shape, 0, border=5,
+                     flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL)
+        for button in (self.add_button, self.clear_button,
+                       self.export_button):
+            controls.Add(button, 0, border=5,
+                         flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL)
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(self.canvas, 1, wx.EXPAND)
+        sizer.Add(controls, 0)
+        sizer.Add(self.label, 0, border=5, flag=wx.ALL)
+        self.SetSizer(sizer)
+        sizer.Fit(self)
+
+        # the plot is redrawn twice a second, however fast the fits
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_timer, self.timer)
+        self.timer.Start(500)
+        self.Bind(wx.EVT_CLOSE, self.on_close)
+        graph.taps.append(self.fitter.tap)
+
+    def on_add_button(self, event):
+        xmin, xmax = self.graph.axes.get_xlim()
+        window = FitWindow(xmin, xmax, self.npeaks.GetValue(),
+                           self.shapes[self.shape.GetSelection()])
+        self.fitter.windows.append(window)
+        color = 'C%d' % ((len(self.fitter.windows) - 1) % 10)
+        for j in range(window.npeaks):
+            center, = self.center_axes.plot([], [], color=color)
+            width, = self.width_axes.plot([], [], color=color)
+            self.lines.append((window, j, center, width))
+
+    def on_clear_button(self, event):
+        self.fitter.windows = []
+        for window, j, center, width in self.lines:
+            center.remove()
+            width.remove()
+        self.lines = []
+        self.canvas.draw()
+
+    def on_export_button(self, event):
+        dlg = wx.FileDialog(self, message="Export peak fits as...",
+                            defaultFile="peaks.csv", wildcard="*.csv",
+                            style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
+        if dlg.ShowModal() == wx.ID_OK:
+            self.fitter.write_csv(dlg.GetPath())
+        dlg.Destroy()
+
+    def on_timer(self, event):
+        if not self.lines:
+            return
+        series = {}
+        for window, j, center, width in self.lines:
+            if window not in series:
+                series[window] = window.series.get()
+            times, values = series[window]
+            center.set_data(times - self.started, values[:, 2 + 3 * j])
+            width.set_data(times - self.started, values[:, 3 + 3 * j])
+        for axes in (self.center_axes, self.width_axes):
+            axes.relim()
+            axes.autoscale_view()
+        self.canvas.draw()
+        self.label.SetLabel("; ".join(
+            "%s: %d fits, %d skipped, %d failed"
+            % (w, w.fits, w.skipped, w.failed) for w in self.fitter.windows))
+
+    def on_close(self, event):
+        self.timer.Stop()
+        if self.fitter.tap in self.graph.taps:
+            self.graph.taps.remove(self.fitter.tap)
+        self.fitter.close()
+        event.Skip()
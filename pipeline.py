@@ -0,0 +1,145 @@
+"""Pipelined acquisition for the live display.
+
+A plain WorkerThread fetches a frame, reduces it, hands it over,
+and only then asks for the next one, so the frame period is the
+sum of all those steps. Here the network receive and the reduction
+run on separate threads, so that frame N+1 is already arriving
+while frame N is reduced and frame N-1 is being drawn, and the
+frame period is set by the slowest stage instead.
+"""
+
+import threading
+from timeit import default_timer as timer
+from Queue import Queue, Empty, Full
+
+class Pipeline(object):
+    """
+    Two threads, connected by a one-frame queue:
+
+    receive stage: calls ``receive()``, which returns ``(x, grid)``
+    straight from the instrument (e.g. ``clnt.get_spectrum``).
+
+    reduce stage: calls ``reduce(x, grid, out)``, which returns the
+    reduced ``(x, y)``, and passes that to ``publish``.
+
+    Reduced frames are written into a ring of `nbuffers` output
+    slots that are reused round-robin: ``out`` is whatever `reduce`
+    returned the last time that slot came round (None the first
+    time), so that it can write into the same arrays again instead
+    of allocating new ones. The consumer hands each published frame
+    back with `release` when it is done with it, and a slot is not
+    written again until its frame has been released; if the consumer
+    holds on to all `nbuffers` frames, the reduce stage waits.
+
+    `publish` should return quickly (e.g. ``Mailbox.put``), since it
+    runs on the reduce thread. Pause with `abort`, like WorkerThread.
+
+    Each function in the list `taps` is also called on the reduce
+    thread, as ``tap((x, grid), (x, y))``, with every frame, whether
+    or not it is ever displayed. Taps may be added and removed while
+    the pipeline is running.
+
+    A `receive` function that has no more data to give may raise
+    EOFError. The pipeline then stops, and calls `on_finish`. So it
+    does if `receive` raises anything else, such as a
+    lvclient.LinkError once the link cannot be restored, or if
+    `reduce` raises; the exception is then kept as `error`.
+
+    If a stats.Stats is given as `stats`, the time taken by each
+    call to `receive` and `reduce` is recorded there, as the 'fetch'
+    and 'reduce' stages.
+
+    """
+
+    on_finish = None
+
+    def __init__(self, receive, reduce, publish, nbuffers=3, taps=None,
+                 stats=None):
+        self.receive = receive
+        self.reduce = reduce
+        self.publish = publish
+        self.taps = [] if taps is None else taps
+        self.stats = stats
+        self.slots = [None] * nbuffers
+        self.lent = [False] * nbuffers  # published, not yet released
+        self.cond = threading.Condition()
+        self.received = Queue(maxsize=1)
+        self._want_abort = False
+        self.error = None
+        self.threads = [threading.Thread(target=self.run_receive),
+                        threading.Thread(target=self.run_reduce)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def abort(self):
+        """Stop both stages after their current frame."""
+        self._want_abort = True
+
+    def join(self, timeout=None):
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def is_alive(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    def run_receive(self):
+        while not self._want_abort:
+            start = timer()
+            try:
+                frame = self.receive()
+            except Exception as e:
+                self.fail(e)
+                return
+            if self.stats is not None:
+                self.stats.add('fetch', start)
+            # wait for the reduce stage, but keep an eye on abort
+            while not self._want_abort:
+                try:
+                    self.received.put(frame, timeout=.1)
+                    break
+                except Full:
+                    continue
+
+    def fail(self, e):
+        # stop, for lack of data (EOFError) or because of an error
+        if not isinstance(e, EOFError):
+            self.error = e
+        self.abort()
+        if self.on_finish is not None:
+            self.on_finish()
+
+    def release(self, frame):
+        """Let the slot of a published frame be written again."""
+        with self.cond:
+            for i, slot in enumerate(self.slots):
+                if slot is frame:
+                    self.lent[i] = False
+                    self.cond.notify()
+                    return
+
+    def run_reduce(self):
+        i = 0
+        while not self._want_abort:
+            with self.cond:
+                while self.lent[i] and not self._want_abort:
+                    self.cond.wait(.1)
+            try:
+                x, grid = self.received.get(timeout=.1)
+            except Empty:
+                continue
+            start = timer()
+            try:
+                self.slots[i] = self.reduce(x, grid, out=self.slots[i])
+            except Exception as e:
+                self.fail(e)
+                return
+            if self.stats is not None:
+                self.stats.add('reduce', start)
+            for tap in list(self.taps):
+                tap((x, grid), self.slots[i])
+            with self.cond:
+                self.lent[i] = True
+            self.publish(self.slots[i])
+            i = (i + 1) % len(self.slots)
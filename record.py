@@ -0,0 +1,274 @@
+"""Recording of every acquired frame to disk.
+
+A run file holds a short header followed by fixed-size records, one
+per frame, each with the time it arrived, the center wavelength, the
+x axis and the frame itself (a raw 2D grid or a reduced spectrum).
+Since all records have the same size, a run can be appended to
+indefinitely, and read back by memory-mapping it (see Replay).
+
+Layout::
+
+    MAGIC                  8 bytes
+    header length          4 bytes, little-endian unsigned
+    header                 JSON, padded with spaces so that the
+                           first record starts on a 64-byte boundary
+    records                numpy structured array, see record_dtype
+"""
+
+import os
+import json
+import struct
+import threading
+from time import time, sleep
+
+import numpy
+
+MAGIC = b'CCDRUN\x01\n'
+ALIGN = 64
+
+def record_dtype(npix, dtype, shape):
+    """
+    The numpy dtype of one record, for frames of the given
+    data type and shape with an x axis of `npix` points.
+    """
+    return numpy.dtype([('time', '<f8'),
+                        ('center_wl', '<f8'),
+                        ('x', '<f8', (npix,)),
+                        ('data', numpy.dtype(dtype).str, tuple(shape))])
+
+def write_header(f, header):
+    """Write MAGIC and `header` (a dict) to the start of a run file."""
+    text = json.dumps(header).encode('ascii')
+    used = len(MAGIC) + 4 + len(text)
+    text += b' ' * (-used % ALIGN)
+    f.write(MAGIC)
+    f.write(struct.pack('<I', len(text)))
+    f.write(text)
+
+class RunRecorder(object):
+    """
+    Streams frames to a run file from a background thread.
+
+    `kind` is 'raw' for (x, grid) frames straight from the CCD, or
+    'spectrum' for reduced (x, y) frames; it is just recorded in the
+    header. Any extra keyword arguments are recorded there too.
+
+    Frames given to `put` are copied into a ring of `queue_size`
+    preallocated records, which the writer thread empties to disk
+    `chunk` records at a time. `put` never blocks: if the writer
+    falls a whole ring behind, new frames are counted in `dropped`
+    and discarded. Frames whose shape differs from the first frame
+    cannot go in the same file, and are counted in `rejected`, as
+    are frames given to `tap` without one of our kind (a raw
+    recording needs a Pipeline, which passes raw frames to its taps).
+
+    Call `close` when finished, to flush the ring and close the file.
+    It waits for the writer thread, so a GUI should call it from
+    another thread. Frames put after `close` are ignored.
+
+    """
+
+    def __init__(self, path, kind='spectrum', queue_size=256, chunk=16,
+                 **metadata):
+        self.path = path
+        self.kind = kind
+        self.metadata = metadata
+        self.queue_size = queue_size
+        self.chunk = chunk
+        self.ring = None
+        self.head = 0     # total frames put into the ring
+        self.tail = 0     # total frames written out of it
+        self.written = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.closing = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, x, data, center_wl=None, timestamp=None):
+        """Queue one frame for writing."""
+        if timestamp is None:
+            timestamp = time()
+        data = numpy.asarray(data)
+        with self.cond:
+            if self.closing:
+                return False
+            if self.ring is None:
+                dtype = record_dtype(len(x), data.dtype, data.shape)
+                self.ring = numpy.zeros(self.queue_size, dtype)
+            elif (self.ring['x'].shape[1:] != (len(x),)
+                    or self.ring['data'].shape[1:] != data.shape):
+                self.rejected += 1
+                return False
+            if self.head - self.tail == self.queue_size:
+                self.dropped += 1
+                return False
+            i = self.head % self.queue_size
+            self.ring['time'][i] = timestamp
+            self.ring['center_wl'][i] = (numpy.nan if center_wl is None
+                                         else center_wl)
+            self.ring['x'][i] = x
+            self.ring['data'][i] = data
+            self.head += 1
+            if self.head - self.tail >= self.chunk:
+                self.cond.notify()
+        return True
+
+    def tap(self, raw, reduced, center_wl=None):
+        """Record the frame of our kind, given both (see Pipeline)."""
+        frame = raw if self.kind == 'raw' else reduced
+        if frame is None:
+            with self.cond:
+                self.rejected += 1
+            return
+        self.put(frame[0], frame[1], center_wl)
+
+    def run(self):
+        f = None
+        while True:
+            with self.cond:
+                if self.head - self.tail < self.chunk and not self.closing:
+                    # wait for a whole chunk, but not for too long
+                    self.cond.wait(.5)
+                start, stop = self.tail, self.head
+                finished = self.closing and start == stop
+            if finished:
+                break
+            if start == stop:
+                continue
+            if f is None:
+                f = open(self.path, 'wb')
+                write_header(f, self.header())
+            # write the pending records, in at most two slices
+            # since they may wrap around the end of the ring
+            i, j = start % self.queue_size, stop % self.queue_size
+            if i < j:
+                self.ring[i:j].tofile(f)
+            else:
+                self.ring[i:].tofile(f)
+                self.ring[:j].tofile(f)
+            f.flush()
+            with self.cond:
+                self.tail = stop
+                self.written += stop - start
+                self.cond.notify_all()
+        if f is not None:
+            f.close()
+
+    def header(self):
+        header = dict(self.metadata)
+        header.update(version=1, kind=self.kind, created=time(),
+                      npix=self.ring['x'].shape[1],
+                      dtype=self.ring['data'].dtype.str,
+                      shape=self.ring['data'].shape[1:])
+        return header
+
+    def close(self):
+        """Write out everything queued, and close the file."""
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        self.thread.join()
+
+    def __str__(self):
+        return ("%d frames written to %s, %d dropped"
+                % (self.written, self.path, self.dropped + self.rejected))
+
+def read_header(path):
+    """
+    The header of a run file, as a dict, and the offset
+    in bytes of the first record.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a run file" % path)
+        length, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(length).decode('ascii'))
+    return header, len(MAGIC) + 4 + length
+
+def open_run(path):
+    """
+    Memory-map the records of a run file.
+
+    Returns the header and a structured array of the records that
+    were complete when it was opened (see `record_dtype`). The map
+    is copy-on-write: the arrays may be modified in memory, but
+    the file is never changed.
+    """
+    header, offset = read_header(path)
+    dtype = record_dtype(header['npix'], header['dtype'], header['shape'])
+    size = os.path.getsize(path) - offset
+    count = size // dtype.itemsize
+    if count == 0:
+        return header, numpy.zeros(0, dtype)
+    return header, numpy.memmap(path, dtype, mode='c',
+                                offset=offset, shape=(count,))
+
+class Replay(object):
+    """
+    Plays back a recorded run, as a data source for Graph or as a
+    stand-in for the labview_client.
+
+    Calling it returns the next (x, frame) pair, as copies read from
+    the memory-mapped file, so that a consumer may keep or modify
+    them, also when the run loops. `get_spectrum` returns the same,
+    except that
+    reduced spectra are given as one-row grids, so that a run of
+    either kind can go through a Reducer. `center_wl` follows the
+    recorded value.
+
+    `speed` sets the pacing: 1 replays in real time, using the
+    recorded timestamps, 2 at twice that, and so on. With a speed
+    of 0 frames are returned as fast as they are asked for. If a
+    frame is asked for more than `max_lag` seconds after it was due,
+    as after a pause, the clock is set back so that it is due now,
+    instead of the frames that follow being rushed out to catch up.
+    With `loop`, the run starts over at the end; otherwise,
+    EOFError is raised, which stops a WorkerThread or Pipeline.
+
+    """
+
+    max_lag = 1.
+
+    def __init__(self, path, speed=1., loop=False):
+        self.path = path
+        self.header, self.records = open_run(path)
+        if len(self.records) == 0:
+            raise ValueError("%s has no frames" % path)
+        self.kind = self.header['kind']
+        self.speed = speed
+        self.loop = loop
+        self.index = 0
+        self.start = None
+        self.center_wl = self.records['center_wl'][0]
+
+    def __len__(self):
+        return len(self.records)
+
+    def __call__(self):
+        if self.index == len(self.records):
+            if not self.loop:
+                raise EOFError("end of %s" % self.path)
+            self.index = 0
+            self.start = None
+        rec = self.records[self.index]
+        if self.speed:
+            if self.start is None:
+                # wall-clock time at which the recording started
+                self.start = time() - rec['time'] / self.speed
+            wait = self.start + rec['time'] / self.speed - time()
+            if wait > 0:
+                sleep(wait)
+            elif wait < -self.max_lag:
+                self.start -= wait
+        self.index += 1
+        self.center_wl = rec['center_wl']
+        return rec['x'].copy(), rec['data'].copy()
+
+    def get_spectrum(self):
+        x, data = self()
+        if data.ndim == 1:
+            data = data[numpy.newaxis, :]
+        return x, data
@@ -0,0 +1,298 @@
+"""Reduction of raw CCD frames to spectra.
+
+The LabView program sends a full 2D grid (rows x pixels) for every
+exposure. The live display only wants a spectrum, so each grid is
+summed down the rows. Doing that with ``grid.sum(axis=0)`` followed
+by slicing allocates new arrays on every frame; the Reducer here
+writes into output buffers that are allocated once and then reused.
+"""
+
+import numpy
+
+class Reducer(object):
+    """
+    Collapses (x, grid) frames from ``get_spectrum`` to (x, y).
+
+    Options:
+
+    rows -- (first, stop) range of CCD rows to use. Default: all.
+        A range that ends past the last row is cut short there; one
+        that starts past it raises ValueError.
+
+    row_bin -- None to sum all the rows into a single spectrum,
+        otherwise sum groups of this many rows, so that y is 2D
+        with one row per group. Rows left over are ignored.
+
+    pixel_bin -- sum groups of this many adjacent pixels.
+        The x value of each group is the mean of its members.
+
+    truncate -- number of leading pixels to discard. The first
+        few pixels of the CCD-2000 are junk.
+
+    dtype -- accumulator type. The grid is summed in its native
+        type straight into an accumulator of this type, so it is
+        never converted as a whole; numpy does convert it in blocks,
+        though, through a cast buffer of its own (about 64 KB) that
+        it allocates on every call. Use int64 for exact integer
+        sums, float32 to save time at the expense of precision.
+
+    filters -- functions to apply to each frame before it is summed,
+        such as a SpikeFilter. The rows and pixels in use are first
+        copied to a work buffer of the accumulator type, and each
+        filter is called with that buffer, which it may modify in
+        place. (With no filters, nothing is copied.)
+
+    The x axis is passed through, unless `calibration` is set to an
+    autocal.Calibration, which then corrects it.
+
+    If `dark` is set to a raw frame (e.g. from a darks.DarkLibrary)
+    of the same shape as the grids, it is subtracted from each one.
+    With filters, that is done as the grid is copied to the work
+    buffer; without, the dark is reduced once, and subtracted from
+    each spectrum, which is the same thing since the reduction is a
+    sum. Either way it costs next to nothing per frame. `shape` is
+    that of the last grid reduced, to choose a dark for.
+
+    Call as ``reducer(x, grid, out)``. If `out` is an (x, y) pair
+    returned by an earlier call for frames of the same shape, it is
+    filled in and returned again; otherwise new buffers are made.
+    This is the signature a Pipeline expects of its reduce stage.
+    A Reducer keeps scratch space of its own, so it should only be
+    called from one thread at a time.
+
+    """
+
+    def __init__(self, rows=None, row_bin=None, pixel_bin=1,
+                 truncate=3, dtype=numpy.float64, filters=()):
+        self.rows = rows
+        self.row_bin = row_bin
+        self.pixel_bin = pixel_bin
+        self.truncate = truncate
+        self.dtype = numpy.dtype(dtype)
+        self.filters = list(filters)
+        self.calibration = None
+        self.dark = None
+        self._reduced_dark = None  # (dark, its reduction)
+        self.scratch = None
+        self.work = None
+        self.shape = None  # of the last grid reduced
+
+    def geometry(self, shape):
+        """
+        For a grid of the given shape, returns the row range and
+        pixel range that are used, the number of row groups
+        (None for a 1D spectrum), and the number of output pixels.
+        """
+        nrows, ncols = shape
+        r0, r1 = (0, nrows) if self.rows is None else self.rows
+        if r0 >= nrows:
+            raise ValueError("rows %d:%d are outside the %d rows of the "
+                             "frame" % (r0, r1, nrows))
+        r1 = min(r1, nrows)
+        npix = (ncols - self.truncate) // self.pixel_bin
+        p0 = self.truncate
+        p1 = p0 + npix * self.pixel_bin
+        if self.row_bin is None:
+            ngroups = None
+        else:
+            ngroups = (r1 - r0) // self.row_bin
+            r1 = r0 + ngroups * self.row_bin
+        return (r0, r1), (p0, p1), ngroups, npix
+
+    def allocate(self, shape):
+        """New (x, y) output buffers for grids of the given shape."""
+        rows, pixels, ngroups, npix = self.geometry(shape)
+        yshape = (npix,) if ngroups is None else (ngroups, npix)
+        return numpy.empty(npix), numpy.empty(yshape, self.dtype)
+
+    def __call__(self, x, grid, out=None):
+        (r0, r1), (p0, p1), ngroups, npix = self.geometry(grid.shape)
+        self.shape = grid.shape
+        yshape = (npix,) if ngroups is None else (ngroups, npix)
+        if (out is None or out[1].shape != yshape
+                or out[1].dtype != self.dtype):
+            out = self.allocate(grid.shape)
+        xout, yout = out
+        dark = self.dark
+        if dark is not None and dark.shape != grid.shape:
+            dark = None  # taken with other settings
+
+        data = grid[r0:r1, p0:p1]
+        if self.filters:
+            if self.work is None or self.work.shape != data.shape:
+                self.work = numpy.empty(data.shape, self.dtype)
+            if dark is None:
+                numpy.copyto(self.work, data)
+            else:
+                numpy.subtract(data, dark[r0:r1, p0:p1], out=self.work,
+                               casting='unsafe')
+            for f in self.filters:
+                f(self.work)
+            data = self.work
+
+        # sum down the rows first: (groups, rows, pixels) -> (groups, pixels)
+        nrows = r1 - r0
+        rb = nrows if ngroups is None else self.row_bin
+        data = data.reshape(nrows // rb, rb, p1 - p0)
+        if self.pixel_bin == 1:
+            numpy.add.reduce(data, axis=1, dtype=self.dtype,
+                             out=yout.reshape(-1, npix))
+        else:
+            # then across pixels, via a scratch buffer of our own
+            shape = data.shape[0], data.shape[2]
+            if self.scratch is None or self.scratch.shape != shape:
+                self.scratch = numpy.empty(shape, self.dtype)
+            numpy.add.reduce(data, axis=1, dtype=self.dtype,
+                             out=self.scratch)
+            numpy.add.reduce(
+                self.scratch.reshape(shape[0], npix, self.pixel_bin),
+                axis=2, out=yout.reshape(-1, npix))
+        if dark is not None and not self.filters:
+            numpy.subtract(yout, self.reduced_dark(dark), out=yout,
+                           casting='unsafe')
+
+        if self.pixel_bin == 1:
+            xout[:] = x[p0:p1]
+        else:
+            numpy.add.reduce(x[p0:p1].reshape(npix, self.pixel_bin),
+                             axis=1, out=xout)
+            xout *= 1. / self.pixel_bin
+        calibration = self.calibration
+        if calibration is not None:
+            calibration.apply(xout)
+        return xout, yout
+
+    def reduced_dark(self, dark):
+        """`dark` reduced as the grids are, computed once per dark."""
+        if self._reduced_dark is None or self._reduced_dark[0] is not dark:
+            plain = Reducer(self.rows, self.row_bin, self.pixel_bin,
+                            self.truncate, numpy.float64)
+            y = plain(numpy.zeros(dark.shape[1]), dark)[1]
+            self._reduced_dark = dark, y
+        return self._reduced_dark[1]
+
+def median3(a, b, c, out, scratch):
+    """Elementwise median of three arrays, without temporaries."""
+    numpy.minimum(a, b, out=out)
+    numpy.maximum(a, b, out=scratch)
+    numpy.minimum(scratch, c, out=scratch)
+    numpy.maximum(out, scratch, out=out)
+    return out
+
+class SpikeFilter(object):
+    """
+    Removes cosmic-ray spikes from raw frames, for Reducer.filters.
+
+    Each pixel is compared with a median:
+
+    'rows' mode -- of the same pixel in the rows above and below.
+        Works on single frames, but needs three rows or more.
+    'frames' mode -- of the same pixel in the last two frames.
+        Works with any number of rows, but misses the first two
+        frames, and is suspended when the whole picture changes
+        (e.g. the grating moves).
+
+    Pixels above the median by more than `threshold` times the
+    noise are replaced by the median. The noise is estimated for
+    every frame from the median absolute difference between a
+    sample of pixels and their neighbours in the next row (or the
+    previous frame), which a few spikes hardly affect.
+
+    `rejected` is the number of pixels replaced in the last frame,
+    and `total` the number replaced since the filter was made.
+    All the work is vectorized over the frame, in buffers of the
+    filter's own, which are allocated again only when the shape of
+    the frames changes. (numpy.median still makes a few small
+    arrays of its own for each frame, to select the median of the
+    noise sample in place.)
+
+    """
+
+    # if more than this fraction of a frame is flagged in frames
+    # mode, assume that the scene has changed instead
+    scene_change = 0.01
+
+    def __init__(self, mode='rows', threshold=5.):
+        if mode not in ('rows', 'frames'):
+            raise ValueError("mode must be 'rows' or 'frames'")
+        self.mode = mode
+        self.threshold = threshold
+        self.shape = None
+        self.rejected = 0
+        self.total = 0
+
+    def allocate(self, shape):
+        self.shape = shape
+        self.median = numpy.empty(shape)
+        self.resid = numpy.empty(shape)
+        self.mask = numpy.empty(shape, bool)
+        # contiguous copies of the pixels that the noise is taken from,
+        # which numpy subtracts without buffering
+        self.sample = numpy.empty_like(self.sample_of(self.median))
+        self.neighbours = numpy.empty_like(self.sample)
+        self.history = []  # previous frames, for frames mode
+
+    def sample_of(self, frame, previous=False):
+        # the pixels that the noise is estimated from, or with
+        # `previous` their neighbours in the row above (rows mode)
+        if self.mode == 'rows':
+            return frame[:-1:4, ::8] if previous else frame[1::4, ::8]
+        return frame[::4, ::8]
+
+    def __call__(self, frame):
+        if frame.shape != self.shape:
+            self.allocate(frame.shape)
+        self.rejected = 0
+        if self.mode == 'rows':
+            if frame.shape[0] < 3:
+                return
+            median3(frame[:-2], frame[1:-1], frame[2:],
+                    self.median[1:-1], self.resid[1:-1])
+            # edge rows are compared with their inside neighbour's median
+            self.median[0] = self.median[1]
+            self.median[-1] = self.median[-2]
+        else:
+            if len(self.history) < 2:
+                self.remember(frame)
+                return
+            median3(frame, self.history[0], self.history[1],
+                    self.median, self.resid)
+
+        sigma = self.noise(frame)
+        numpy.subtract(frame, self.median, out=self.resid)
+        numpy.greater(self.resid, self.threshold * sigma, out=self.mask)
+        rejected = numpy.count_nonzero(self.mask)
+        if self.mode == 'frames' and rejected > self.scene_change * frame.size:
+            # start over, from this frame
+            self.history = []
+            self.remember(frame)
+            return
+        # the median of integer frames is a whole number, so it is
+        # cast back to an integer work buffer exactly
+        numpy.copyto(frame, self.median, where=self.mask, casting='unsafe')
+        self.rejected = rejected
+        self.total += rejected
+        if self.mode == 'frames':
+            self.remember(frame)
+
+    def noise(self, frame):
+        # the difference of two pixels has sqrt(2) times their noise
+        if self.mode == 'rows':
+            other = self.sample_of(frame, previous=True)
+        else:
+            other = self.sample_of(self.history[-1])
+        numpy.copyto(self.sample, self.sample_of(frame))
+        numpy.copyto(self.neighbours, other)
+        diff = numpy.subtract(self.sample, self.neighbours, out=self.sample)
+        numpy.abs(diff, out=diff)
+        return 1.4826 / numpy.sqrt(2) * \
+            numpy.median(diff, axis=None, overwrite_input=True) or 1.
+
+    def remember(self, frame):
+        # keep the last two (cleaned) frames, reusing their buffers
+        if len(self.history) < 2:
+            self.history.append(frame.astype(float))
+        else:
+            old = self.history.pop(0)
+            old[...] = frame
+            self.history.append(old)
@@ -2,7 +2,6 @@
 
 import wx
 import os
-import csv
 from math import floor, ceil
 #from wx_mpl_dynamic_graph import GraphFrame
 import matplotlib
@@ -10,9 +9,16 @@ matplotlib.use('WXAgg',warn=False)
 from matplotlib.backends.backend_wxagg import \
         FigureCanvasWxAgg as FigCanvas
 from wx_mpl_dynamic_graph import BoundControlBox
+from pipeline import Pipeline
+from export import ExportThread, write_csv, write_npy
+from accumulate import Accumulator
+from stats import Stats
+from lod import Pyramid
 import numpy as n
-from time import sleep
+from time import sleep, time
+from timeit import default_timer as timer
 import threading
+from collections import deque
 
 def sampledata(around=680, with_peaks_at=(680,), lag=.2):
     x = n.arange(1024) - 512
@@ -28,16 +34,97 @@ def sampledata(around=680, with_peaks_at=(680,), lag=.2):
 # Define notification event for thread completion
 import wx.lib.newevent
 ResultEvent, EVT_RESULT = wx.lib.newevent.NewEvent()
+# ...and one to say that frames are waiting in a Mailbox
+FrameEvent, EVT_FRAME = wx.lib.newevent.NewEvent()
+
+class Mailbox(object):
+    """
+    Bounded handoff of frames from a worker thread to the GUI.
+
+    Holds at most `maxlen` frames. When it is full, the oldest
+    frame is dropped to make room, so the display never falls
+    more than `maxlen` frames behind the acquisition.
+
+    `put` returns True only when the box was empty, so the worker
+    posts at most one FrameEvent per batch and the wx event queue
+    cannot pile up. The GUI takes everything waiting with `drain`.
+
+    Frames that are dropped are passed to `release`, if given, so
+    that a Pipeline can reuse their buffers.
+
+    """
+    def __init__(self, maxlen=1, release=None):
+        self.frames = deque(maxlen=maxlen)
+        self.release = release
+        self.lock = threading.Lock()
+        self.produced = 0   # frames handed in by the worker
+        self.displayed = 0  # frames drawn by the GUI
+        self.coalesced = 0  # frames folded into an integrated sum
+        self.dropped = 0    # frames nobody ever looked at
+
+    def put(self, data):
+        dropped = None
+        with self.lock:
+            was_empty = not self.frames
+            if len(self.frames) == self.frames.maxlen:
+                self.dropped += 1
+                dropped = self.frames[0]
+            self.frames.append(data)
+            self.produced += 1
+        if dropped is not None and self.release is not None:
+            self.release(dropped)
+        return was_empty
+
+    def drain(self):
+        """Remove and return all waiting frames, oldest first."""
+        with self.lock:
+            frames = list(self.frames)
+            self.frames.clear()
+        return frames
+
+    def count(self, displayed=0, coalesced=0, dropped=0):
+        with self.lock:
+            self.displayed += displayed
+            self.coalesced += coalesced
+            self.dropped += dropped
+
+    def __str__(self):
+        return ("%d produced, %d displayed, %d coalesced, %d dropped"
+                % (self.produced, self.displayed,
+                   self.coalesced, self.dropped))
 
 # Thread class that executes processing
 class WorkerThread(threading.Thread):
     """Worker Thread Class."""
-    def __init__(self, notify_window, func):
-        """Init Worker Thread Class."""
+    def __init__(self, notify_window, func, mailbox=None, taps=None,
+                 stats=None, frames=None):
+        """Init Worker Thread Class.
+
+        If a Mailbox is given, results are left there, and the
+        window is only sent a FrameEvent when the box was empty.
+        Otherwise every result is posted as a ResultEvent.
+
+        Functions in `taps` are called with every result, as
+        ``tap(None, data)``; see Pipeline.
+
+        The time taken by `func` is recorded in `stats` (a
+        stats.Stats), if given, as the 'fetch' stage.
+
+        With `frames` = N, the thread stops by itself after N frames.
+
+        If `func` raises EOFError, or anything else, the thread stops
+        as if aborted; any other exception is kept as `error`, and
+        sent along with the final ResultEvent.
+        """
         threading.Thread.__init__(self)
         self.func = func
+        self.mailbox = mailbox
+        self.taps = [] if taps is None else taps
+        self.stats = stats
+        self.frames = frames
         self._notify_window = notify_window
         self._want_abort = 0
+        self.error = None
 
     def run(self):
         """Run Worker Thread."""
@@ -46,11 +133,32 @@ class WorkerThread(threading.Thread):
         while True:
             if self._want_abort:
                 # Use a result of None to acknowledge the abort
-                wx.PostEvent(self._notify_window, ResultEvent(data=None))
+                wx.PostEvent(self._notify_window,
+                             ResultEvent(data=None, error=self.error,
+                                         worker=self))
                 return
             # Send data to the parent thread
-            data = self.func()
-            wx.PostEvent(self._notify_window, ResultEvent(data=data))
+            start = timer()
+            try:
+                data = self.func()
+            except Exception as e:
+                # the data source has run out, or failed
+                if not isinstance(e, EOFError):
+                    self.error = e
+                self._want_abort = 1
+                continue
+            if self.stats is not None:
+                self.stats.add('fetch', start)
+            for tap in list(self.taps):
+                tap(None, data)
+            if self.mailbox is None:
+                wx.PostEvent(self._notify_window, ResultEvent(data=data))
+            elif self.mailbox.put(data):
+                wx.PostEvent(self._notify_window, FrameEvent())
+            if self.frames is not None:
+                self.frames -= 1
+                if self.frames <= 0:
+                    return  # quietly; the window was not waiting on us
 
     def abort(self):
         """abort worker thread."""
@@ -59,27 +167,185 @@ class WorkerThread(threading.Thread):
 
 class Graph(wx.Panel):
 
-    def __init__(self,parent,datasource):
+    # when blitting, only the line artists are redrawn on each frame,
+    # over a cached copy of the static background (axes, ticks,
+    # reference lines). the full figure is redrawn only when the
+    # view limits change.
+    blit = True
+
+    # upper limit on display refresh rate, in frames per second.
+    # None means draw every frame that arrives.
+    max_fps = None
+
+    # autoscale hysteresis: the view is only rescaled when the data
+    # leave it, or shrink to fill less than (1 - hysteresis) of it.
+    hysteresis = 0.2
+    margin = 0.05
+
+    # what to do with frames that arrive faster than they can be
+    # drawn. 'drop' keeps only the latest one; 'coalesce' keeps up
+    # to `mailbox_size` of them, for take_frames to fold together.
+    drop_policy = 'drop'
+    mailbox_size = 64
+
+    # with a reduce function, acquire and reduce frames in a separate
+    # process (see shmring) instead of in threads of this one
+    processes = False
+
+    # lines with more points than this are drawn decimated to the
+    # resolution of the screen, from a lod.Pyramid
+    lod_points = 20000
+
+    # center wavelength of the spectrometer, if known,
+    # for recording alongside the data
+    center_wl = None
+
+    # a catalog.Catalog to add saved and recorded data to, and
+    # a label to add them with, such as what is in front of the slit
+    catalog = None
+    label = None
+
+    def __init__(self,parent,datasource,reduce=None):
+        """
+        `datasource` is called for each new frame, and returns (x, y).
+
+        If a `reduce` function is also given, frames are acquired with
+        a Pipeline instead: `datasource` then returns raw (x, grid)
+        frames and ``reduce(x, grid, out)`` turns them into (x, y).
+        """
         wx.Panel.__init__(self, parent, -1) 
 
-        self.datagen = datasource
+        self.init_state(datasource, reduce)
         self.create_main_panel()
 
-        self.paused = True
-        #self.start_worker()
-
         self.Bind(EVT_RESULT, self.on_result)
+        self.Bind(EVT_FRAME, self.on_frames)
+        self.fetch_first_frame()
+
+    def init_state(self, datasource, reduce=None):
+        """ Set up everything but the window and its controls. """
+        self.datagen = datasource
+        self.reduce = reduce
+        self.taps = []
+        self.recorder = None
+        self.stats = Stats()
+        self.pyramid = None
+        self.background = None
+        self.datalim = None
+        self._last_render = 0
+        self._render_pending = False
+        if self.drop_policy == 'coalesce':
+            self.mailbox = Mailbox(self.mailbox_size, self.release)
+        else:
+            self.mailbox = Mailbox(1, self.release)
+        self.shown = None  # our copy of the frame on display
+        self.paused = True
+        self.worker = None
+        self.retiring = None  # a worker start_worker is waiting out
+        self.error = None  # why the worker last stopped by itself
+
+    def fetch_first_frame(self):
+        """ Get one frame to show, on a thread, so that the window
+        can appear before it arrives. """
+        func = self.datagen
+        if self.reduce is not None:
+            func = lambda: self.reduce(*self.datagen())
+        self.worker = WorkerThread(self, func, self.mailbox,
+                                   stats=self.stats, frames=1)
+        self.worker.start()
 
     def start_worker(self):
-        self.worker = WorkerThread(self, self.datagen)
+        old = self.worker
+        if old is not None and old.is_alive():
+            # the data source can only serve one thread at a time, so
+            # wait for the old one to finish its frame, but not here
+            def start_after():
+                old.join()
+                wx.CallAfter(self.resume_worker)
+            self.worker = None
+            self.retiring = old
+            waiter = threading.Thread(target=start_after)
+            waiter.daemon = True
+            waiter.start()
+            return
+        if self.reduce is None:
+            self.worker = WorkerThread(self, self.datagen, self.mailbox,
+                                       self.taps, self.stats)
+        else:
+            # enough output buffers for a full mailbox, plus as many
+            # frames again being taken by on_frames, so that the
+            # pipeline does not have to wait for their release
+            nbuffers = 2 * self.mailbox.frames.maxlen + 2
+            if self.processes:
+                from shmring import ProcessPipeline
+                capacity = max(n.size(self.data()[1]), 1 << 14)
+                self.worker = ProcessPipeline(self.datagen, self.reduce,
+                                              self.publish, nbuffers,
+                                              self.taps, self.stats,
+                                              capacity)
+            else:
+                self.worker = Pipeline(self.datagen, self.reduce,
+                                       self.publish, nbuffers, self.taps,
+                                       self.stats)
+            worker = self.worker
+            self.worker.on_finish = lambda: wx.PostEvent(
+                self, ResultEvent(data=None, error=worker.error,
+                                  worker=worker))
+        self.error = None
         self.worker.start()
 
+    def resume_worker(self):
+        # start_worker, once the old worker has gone; unless the
+        # display was paused again, or another worker started since
+        self.retiring = None
+        if not self.paused and self.worker is None:
+            self.start_worker()
+
+    def stop_worker(self, then=None):
+        """ Pause, and once no worker is using the data source any
+        more, call `then` (on this thread), for instance to use the
+        data source for something else. """
+        self.paused = True
+        workers = [w for w in (self.worker, self.retiring) if w is not None]
+        for worker in workers:
+            worker.abort()
+        if then is None:
+            return
+        def call_after():
+            for worker in workers:
+                worker.join()
+            wx.CallAfter(then)
+        waiter = threading.Thread(target=call_after)
+        waiter.daemon = True
+        waiter.start()
+
+    def reduce_changed(self):
+        """ Call after changing the reduce function (for instance its
+        calibration), for a worker in another process to pick it up. """
+        set_reduce = getattr(self.worker, 'set_reduce', None)
+        if set_reduce is not None:
+            set_reduce(self.reduce)
+
+    def release(self, frame):
+        """ Hand a frame back to the pipeline that published it. """
+        release = getattr(self.worker, 'release', None)
+        if release is not None:
+            release(frame)
+
+    def publish(self, data):
+        # called from the pipeline's reduce thread
+        if self.mailbox.put(data):
+            wx.PostEvent(self, FrameEvent())
+
     def create_control_bar(self):
         self.pause_button = wx.Button(self, -1, "Pause")
         self.Bind(wx.EVT_BUTTON, self.on_pause_button, self.pause_button)
         self.Bind(wx.EVT_UPDATE_UI, self.on_update_pause_button, self.pause_button)
         self.save_button = wx.Button(self, -1, "Save data")
         self.Bind(wx.EVT_BUTTON, self.on_save_button, self.save_button)
+        self.record_button = wx.Button(self, -1, "Record")
+        self.Bind(wx.EVT_BUTTON, self.on_record_button, self.record_button)
+        self.Bind(wx.EVT_UPDATE_UI, self.on_update_record_button, self.record_button)
 
         self.hbox1 = wx.BoxSizer(wx.HORIZONTAL)
         self.hbox1.Add(self.pause_button, border=5, flag=wx.ALL |
@@ -87,11 +353,14 @@ class Graph(wx.Panel):
         self.hbox1.AddSpacer(20)
         self.hbox1.Add(self.save_button, border=5, flag=wx.ALL |
                        wx.ALIGN_CENTER_VERTICAL)
+        self.hbox1.Add(self.record_button, border=5, flag=wx.ALL |
+                       wx.ALIGN_CENTER_VERTICAL)
 
     def create_main_panel(self):
         # define the displays and controls
         self.init_plot()
         self.canvas = FigCanvas(self, -1, self.fig)
+        self.canvas.mpl_connect('draw_event', self.on_draw)
 
         self.create_control_bar()
 
@@ -103,6 +372,13 @@ class Graph(wx.Panel):
         self.ymin_control.radio_auto.SetValue(True)
         self.ymax_control = BoundControlBox(self, -1, "Y max", 100)
         self.ymax_control.radio_auto.SetValue(True)
+        # apply changes of the bounds straight away, even when paused
+        for control in (self.xmin_control, self.xmax_control,
+                        self.ymin_control, self.ymax_control):
+            self.Bind(wx.EVT_TEXT_ENTER, self.on_bounds_changed,
+                      control.manual_text)
+            for radio in (control.radio_auto, control.radio_manual):
+                self.Bind(wx.EVT_RADIOBUTTON, self.on_bounds_changed, radio)
         
         # lay displays and controls out on the page
         self.hbox2 = wx.BoxSizer(wx.HORIZONTAL)
@@ -122,44 +398,216 @@ class Graph(wx.Panel):
     def init_plot(self):
         self.fig = matplotlib.figure.Figure()
         self.axes = self.fig.add_subplot(111)
-        
-        x,y = self.datagen()
-        self.lines = self.axes.plot(x,y)
+        # empty until the first frame arrives (see fetch_first_frame)
+        self.lines = self.axes.plot([], [], animated=self.blit)
+
+    def show(self, x, y):
+        """ Display (x, y) from outside the live stream, such as a
+        finished scan, without adding it to any integration. """
+        Graph.update_plot(self, x, y)
+        self.render()
 
     def on_result(self, event):
         if event.data is None:
-            pass
+            if getattr(event, 'worker', self.worker) is not self.worker:
+                return  # from a worker that was replaced
+            # worker has stopped, perhaps by itself
+            self.paused = True
+            self.error = getattr(event, 'error', None)
         else:
             x,y = event.data
+            start = timer()
             self.update_plot(x,y)
-            self.set_bounds()
+            self.stats.add('update_plot', start)
+            self.render()
+
+    def on_frames(self, event):
+        frames = self.mailbox.drain()
+        if not frames:
+            return
+        x,y = self.keep(*self.take_frames(frames))
+        for frame in frames:
+            self.release(frame)
+        start = timer()
+        self.update_plot(x,y)
+        self.stats.add('update_plot', start)
+        self.mailbox.count(displayed=1)
+        self.render()
+
+    def keep(self, x, y):
+        """ Copies of a frame, in buffers of our own that the lines
+        can hold on to, so that the pipeline can reuse its own. """
+        if self.shown is None or self.shown[0].shape != n.shape(x) \
+                or self.shown[1].shape != n.shape(y):
+            self.shown = n.empty(n.shape(x)), n.empty(n.shape(y))
+        n.copyto(self.shown[0], x)
+        n.copyto(self.shown[1], y)
+        return self.shown
+
+    def take_frames(self, frames):
+        """
+        Given the frames waiting in the mailbox (oldest first),
+        return the one to display. By default that is the latest;
+        the rest are counted as dropped.
+
+        """
+        self.mailbox.count(dropped=len(frames) - 1)
+        return frames[-1]
 
     def update_plot(self, x, y):
-        self.lines[0].set_data(x,y)
-        self.axes.relim()
-        self.axes.autoscale_view()
+        if len(x) > self.lod_points:
+            self.pyramid = Pyramid(x, y)
+            if self.blit:
+                self.decimate()
+            else:
+                # all of it, coarsely, for autoscale_view
+                self.decimate(-n.inf, n.inf)
+        else:
+            self.pyramid = None
+            self.lines[0].set_data(x,y)
+        if self.blit:
+            self.datalim = self.data_limits(x, y)
+        else:
+            self.axes.relim()
+            self.axes.autoscale_view()
+
+    def decimate(self, xmin=None, xmax=None):
+        """ Show the points of the pyramid needed for the view, or
+        for xmin to xmax, at the resolution of the screen. """
+        if xmin is None:
+            xmin, xmax = sorted(self.axes.get_xlim())
+        pixels = max(int(self.axes.bbox.width), 1)
+        self.lines[0].set_data(*self.pyramid.decimate(xmin, xmax, pixels))
+
+    def data(self):
+        """ (x, y) of the first line, in full even if decimated """
+        if self.pyramid is not None:
+            return self.pyramid.x, self.pyramid.y
+        return self.lines[0].get_data()
+
+    @staticmethod
+    def data_limits(x, y):
+        """ (xmin, xmax, ymin, ymax) of the data, ignoring NaNs """
+        return (n.nanmin(x), n.nanmax(x), n.nanmin(y), n.nanmax(y))
+
+    def render(self):
+        """ Draw the current data, no more often than max_fps. """
+        if self.max_fps:
+            wait = self._last_render + 1. / self.max_fps - time()
+            if wait > 0:
+                # draw later, with whatever data is current by then
+                if not self._render_pending:
+                    self._render_pending = True
+                    wx.CallLater(int(wait * 1000) + 1, self.on_render_timer)
+                return
+        self._last_render = time()
+        start = timer()
+        self.set_bounds()
+        self.stats.add('render', start)
+
+    def on_bounds_changed(self, event):
+        self.render()
+
+    def on_render_timer(self):
+        self._render_pending = False
+        self.render()
+
+    def manual_bounds(self):
+        """ (xmin, xmax, ymin, ymax) from the bound controls.
+
+        Bounds that are set to auto are None.
+        """
+        controls = (self.xmin_control, self.xmax_control,
+                    self.ymin_control, self.ymax_control)
+        return tuple(None if c.is_auto() else float(c.manual_value())
+                     for c in controls)
 
     def set_bounds(self):
-        if not self.xmax_control.is_auto():
-            xmax = float(self.xmax_control.manual_value())
-            self.axes.set_xbound(upper = xmax)
-        if not self.xmin_control.is_auto():
-            xmin = float(self.xmin_control.manual_value())
-            self.axes.set_xbound(lower = xmin)
-
-        if not self.ymax_control.is_auto():
-            ymax = float(self.ymax_control.manual_value())
-            self.axes.set_ybound(upper = ymax)
-        if not self.ymin_control.is_auto():
-            ymin = float(self.ymin_control.manual_value())
-            self.axes.set_ybound(lower = ymin)
+        xmin, xmax, ymin, ymax = self.manual_bounds()
+
+        if not self.blit:
+            if xmax is not None:
+                self.axes.set_xbound(upper = xmax)
+            if xmin is not None:
+                self.axes.set_xbound(lower = xmin)
+            if ymax is not None:
+                self.axes.set_ybound(upper = ymax)
+            if ymin is not None:
+                self.axes.set_ybound(lower = ymin)
+            self.draw()
+            return
+
+        xlim, ylim = self.axes.get_xlim(), self.axes.get_ylim()
+        if self.datalim is not None:
+            xlim = self.autoscale(xlim, self.datalim[0:2], xmin, xmax)
+            ylim = self.autoscale(ylim, self.datalim[2:4], ymin, ymax)
+
+        if (xlim != self.axes.get_xlim() or ylim != self.axes.get_ylim()
+                or self.background is None):
+            # view has changed; redraw everything (see on_draw)
+            self.axes.set_xlim(xlim)
+            self.axes.set_ylim(ylim)
+            self.draw()
+        else:
+            self.blit_lines()
 
+    def draw(self):
+        """ Full draw of the figure, timed as the 'full_draw' stage. """
+        start = timer()
+        if self.pyramid is not None:
+            self.decimate()  # for the new view
         self.canvas.draw()
+        self.stats.add('full_draw', start)
+
+    def autoscale(self, current, datalim, lower=None, upper=None):
+        """
+        New view limits for one axis, given the data limits and
+        any manual bounds. Returns `current` itself if the view
+        may stay as it is.
+
+        """
+        lo, hi = datalim
+        if not (n.isfinite(lo) and n.isfinite(hi)):
+            return current
+        pad = self.margin * (hi - lo) if hi > lo else 0.5
+        want = (lo - pad if lower is None else lower,
+                hi + pad if upper is None else upper)
+        vlo, vhi = current
+        if lower is not None and vlo != lower:
+            return want
+        if upper is not None and vhi != upper:
+            return want
+        if lo < vlo or hi > vhi:
+            return want  # data have left the view
+        if (vhi - vlo) * (1 - self.hysteresis) > want[1] - want[0]:
+            return want  # data only fill a small part of the view
+        return current
+
+    def on_draw(self, event):
+        # a full draw has just happened: cache the background,
+        # then put the (animated) lines back on top of it.
+        if not self.blit:
+            return
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        for line in self.lines:
+            self.axes.draw_artist(line)
+
+    def blit_lines(self):
+        """ Redraw only the lines, over the cached background. """
+        self.canvas.restore_region(self.background)
+        for line in self.lines:
+            self.axes.draw_artist(line)
+        self.canvas.blit(self.axes.bbox)
+
+    def redraw(self):
+        """ Full redraw. Call after adding or removing static artists. """
+        self.draw()
 
     # define event handlers
 
     def on_save_button(self, event):
-        file_choices = "CSV (*.csv)|*.csv|Numpy (*.npy)|*.npy"
+        file_choices = ("CSV (*.csv)|*.csv|Numpy (*.npy)|*.npy|"
+                        "Compressed Numpy archive (*.npz)|*.npz")
         dlg = wx.FileDialog(
             self,
             message="Save data as...",
@@ -171,64 +619,186 @@ class Graph(wx.Panel):
         if dlg.ShowModal() == wx.ID_OK:
             path = dlg.GetPath()
             # verify extension
-            extensions = ('.csv', '.npy')
+            extensions = ('.csv', '.npy', '.npz')
             ext = extensions[dlg.GetFilterIndex()]
             if type(path) is unicode:
                 ext = unicode(ext)
             base, userext = os.path.splitext(path)
             if not userext == ext:
                 path += ext
-            if str(ext) == '.csv':
-                self.save_csv(path)
-            elif str(ext) == '.npy':
-                self.save_npy(path)
+            self.export(path, str(ext))
+
+    def columns(self):
+        """ Copies of the displayed data, as [x1, y1, x2, y2, ...] """
+        cols = []
+        for i, line in enumerate(self.lines):
+            x, y = self.data() if i == 0 else line.get_data()
+            cols.append(n.array(x, dtype=float))
+            cols.append(n.array(y, dtype=float))
+        return cols
+
+    def metadata(self):
+        """ Acquisition context to store along with saved data """
+        meta = {'center_wl': self.center_wl, 'saved': time()}
+        if self.label:
+            meta['label'] = self.label
+        return meta
+
+    def export(self, path, ext):
+        """ Save the displayed data in the background. """
+        self.save_button.Disable()
+        def progress(fraction):
+            wx.CallAfter(self.save_button.SetLabel,
+                         "Saving %d%%" % (100 * fraction))
+        def done(path, error):
+            wx.CallAfter(self.on_export_done, path, error)
+        self.exporter = ExportThread(path, ext, self.columns(),
+                                     self.metadata(), progress, done)
+        self.exporter.start()
+
+    def on_export_done(self, path, error):
+        self.save_button.SetLabel("Save data")
+        self.save_button.Enable()
+        if error is not None:
+            wx.MessageBox("Could not save %s:\n%s" % (path, error),
+                          "Save data", wx.OK | wx.ICON_ERROR, self)
+        elif self.catalog is not None:
+            self.catalog.add_export(path, self.exporter.columns,
+                                    self.exporter.metadata)
 
     def save_csv(self, path):
-        wrt = csv.writer(open(path,'w'))
-        def cols(lines):
-            for line in lines:
-                yield line.get_xdata()
-                yield line.get_ydata()
-        for row in zip(*cols(self.lines)):
-            wrt.writerow(row)
+        write_csv(path, self.columns(), self.metadata())
 
     def save_npy(self, path):
-        lines = self.lines
-        if len(lines) == 1:
-            n.save(path, lines[0].get_data())
-        else:
-            n.save(path, [l.get_data() for l in lines])
+        write_npy(path, self.columns())
+
+    def on_record_button(self, event):
+        if self.recorder is not None:
+            # stop recording; the frames still queued are written
+            # out in the background
+            self.taps.remove(self.record_tap)
+            recorder, self.recorder = self.recorder, None
+            self.record_button.Disable()
+            def close():
+                recorder.close()
+                wx.CallAfter(self.on_record_done, recorder)
+            threading.Thread(target=close).start()
+            return
+
+        file_choices = ("Raw CCD frames (*.ccdrun)|*.ccdrun|"
+                        "Spectra (*.ccdrun)|*.ccdrun")
+        dlg = wx.FileDialog(
+            self,
+            message="Record run as...",
+            defaultDir = os.getcwd(),
+            defaultFile = "run.ccdrun",
+            wildcard=file_choices,
+            style=wx.SAVE|wx.OVERWRITE_PROMPT)
+
+        if dlg.ShowModal() == wx.ID_OK:
+            path = dlg.GetPath()
+            if not path.endswith('.ccdrun'):
+                path += '.ccdrun'
+            # raw frames are only seen when there is a reduce stage
+            kind = ('raw', 'spectrum')[dlg.GetFilterIndex()]
+            if kind == 'raw' and (self.reduce is None or self.processes):
+                wx.MessageBox("Raw frames can only be recorded when they "
+                              "are reduced in a pipeline, and not with "
+                              "--processes. Record spectra instead.",
+                              "Record", wx.OK | wx.ICON_ERROR, self)
+                return
+            extra = {'label': self.label} if self.label else {}
+            from record import RunRecorder
+            self.recorder = recorder = RunRecorder(path, kind, **extra)
+            def record_tap(raw, reduced):
+                recorder.tap(raw, reduced, self.center_wl)
+            self.record_tap = record_tap
+            self.taps.append(record_tap)
+
+    def on_record_done(self, recorder):
+        self.record_button.Enable()
+        if self.catalog is not None and recorder.written:
+            self.catalog.add_run(recorder.path)
+
+    def on_update_record_button(self, event):
+        label = "Stop recording" if self.recorder is not None else "Record"
+        self.record_button.SetLabel(label)
 
     def on_pause_button(self,event):
         self.paused = not self.paused
         if not self.paused:
             self.start_worker()
-        else:
-            self.worker._want_abort = True
+        elif self.worker is not None:
+            self.worker.abort()
 
     def on_update_pause_button(self,event):
         label = "Resume" if self.paused else "Pause"
         self.pause_button.SetLabel(label)
 
 class IntGraph(Graph):
-    def __init__(self, parent, datasource):
-        Graph.__init__(self,parent,datasource)
+
+    # frames that arrive while drawing still go into the sum
+    drop_policy = 'coalesce'
+
+    def init_state(self, datasource, reduce=None):
+        Graph.init_state(self, datasource, reduce)
+        self.accumulator = Accumulator()
         self.integrating = False
+        self.started = time()
 
     def update_plot(self, x, y):
         if self.integrating:
-            y+= self.lines[0].get_ydata()
+            # display the running sum, which the accumulator owns
+            self.accumulator.add(y)
+            y = self.accumulator.sum
         super(IntGraph, self).update_plot(x, y)
 
+    def metadata(self):
+        meta = Graph.metadata(self)
+        meta.update(integrating=self.integrating,
+                    frames=self.accumulator.count if self.integrating else 1,
+                    window=self.accumulator.window,
+                    started=self.started)
+        return meta
+
+    def take_frames(self, frames):
+        if not self.integrating:
+            return Graph.take_frames(self, frames)
+        # the older frames go straight into the sum, and the
+        # newest one gets added by update_plot
+        for x, older in frames[:-1]:
+            self.accumulator.add(older)
+        self.mailbox.count(coalesced=len(frames) - 1)
+        return frames[-1]
+
     def create_control_bar(self):
         Graph.create_control_bar(self)
         self.int_button= wx.Button(self, -1, "Integration")
         self.Bind(wx.EVT_BUTTON, self.on_int_button, self.int_button)
+        self.window_label = wx.StaticText(self, -1, "over last")
+        self.window_ctrl = wx.SpinCtrl(self, -1, size=(70,-1),
+                                       min=0, max=100000, initial=0)
+        self.window_ctrl.SetToolTip(wx.ToolTip(
+            "Number of frames in a sliding sum (0 for all frames)"))
+        self.Bind(wx.EVT_SPINCTRL, self.on_window_ctrl, self.window_ctrl)
         self.hbox1.AddSpacer(20)
         self.hbox1.Add(self.int_button, border=5, flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL)
+        self.hbox1.Add(self.window_label, border=5, flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL)
+        self.hbox1.Add(self.window_ctrl, border=5, flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL)
 
     def on_int_button(self,event):
         self.integrating = not self.integrating
+        if self.integrating:
+            # the frame on display is the first of the sum
+            self.accumulator.reset()
+            self.accumulator.add(self.data()[1])
+            self.started = time()
+
+    def on_window_ctrl(self, event):
+        # start a new sum, of the new length, with the next frame
+        self.accumulator.window = self.window_ctrl.GetValue() or None
+        self.accumulator.reset()
+        self.started = time()
 
 class SpecGraph(IntGraph):
 
@@ -237,16 +807,18 @@ class SpecGraph(IntGraph):
         self.add_dualtick()
 
     def add_dualtick(self):
-        # add a second x axis enumerated in eV
-        xconv = lambda wl: 1240. / wl
+        # add a second x axis enumerated in eV.
+        # it is created once, and follows the wavelength axis
+        # whenever its limits change.
         self.axes2 = self.axes.twiny()
-        self.axes2.set_xlim(xconv(x) for x in self.axes.get_xlim())
-        self.axes2.set_ylim(self.axes.get_ylim())
+        self.update_dualtick(self.axes)
+        self.axes.callbacks.connect('xlim_changed', self.update_dualtick)
 
-    def update_plot(self, x, y):
-        self.axes.figure.delaxes(self.axes2)
-        super(SpecGraph, self).update_plot(x, y)
-        self.add_dualtick()
+    def update_dualtick(self, axes):
+        if min(axes.get_xlim()) <= 0:
+            return  # no wavelengths on the axis yet
+        xconv = lambda wl: 1240. / wl
+        self.axes2.set_xlim([xconv(x) for x in axes.get_xlim()])
 
 
 class MainFrame(wx.Frame):
@@ -0,0 +1,181 @@
+"""Spectra wider than the CCD, by stepping the grating and gluing.
+
+A Scan moves the spectrometer to each of a series of center
+wavelengths (see `positions`), takes a number of frames at each, and
+glues the averaged segments together with `stitch`. Averaging and
+resampling a segment is done on a second thread, so that the grating
+is already moving to the next position while the last segment is
+being processed.
+"""
+
+import threading
+from Queue import Queue
+
+import numpy
+
+def positions(start, stop, width, overlap=.2):
+    """
+    Center wavelengths at which windows `width` nm wide cover the
+    range from `start` to `stop`, with neighbouring windows sharing
+    at least the fraction `overlap` of their width. Raises
+    ValueError unless start < stop, width > 0 and 0 <= overlap < 1.
+    """
+    if not start < stop:
+        raise ValueError("the scan must start below where it stops")
+    if not width > 0:
+        raise ValueError("the frames must have a width")
+    if not 0 <= overlap < 1:
+        raise ValueError("the overlap must be at least 0% and under 100%")
+    span = stop - start
+    if span <= width:
+        return numpy.array([.5 * (start + stop)])
+    step = width * (1 - overlap)
+    n = int(numpy.ceil((span - width) / step)) + 1
+    return numpy.linspace(start + .5 * width, stop - .5 * width, n)
+
+def resample(segments, grid):
+    """
+    The segments (x, y) interpolated onto `grid`, as an array of
+    shape (segments, grid), with NaN outside each segment.
+    """
+    out = numpy.empty((len(segments), len(grid)))
+    for i, (x, y) in enumerate(segments):
+        order = numpy.argsort(x)
+        out[i] = numpy.interp(grid, x[order], y[order],
+                              left=numpy.nan, right=numpy.nan)
+    return out
+
+def stitch(segments, step=None, scale=True):
+    """
+    Glue spectra (x, y) that overlap, in order of wavelength, into
+    one, on a grid of spacing `step` (by default, the mean pixel
+    spacing of the first segment).
+
+    If `scale`, each segment is multiplied by a factor that makes its
+    integral over the overlap with the previous one equal to that of
+    the previous one (itself already scaled), to take out changes
+    of throughput between positions. Where segments overlap, they
+    are blended with weights that fall off linearly towards the edge
+    of each segment, so that there are no steps at the joins.
+    """
+    if step is None:
+        x0 = segments[0][0]
+        step = abs(x0[-1] - x0[0]) / (len(x0) - 1)
+    lo = min(numpy.min(x) for x, y in segments)
+    hi = max(numpy.max(x) for x, y in segments)
+    grid = numpy.arange(lo, hi + .5 * step, step)
+
+    values = resample(segments, grid)
+    valid = ~numpy.isnan(values)
+    values[~valid] = 0
+
+    if scale and len(segments) > 1:
+        shared = valid[:-1] & valid[1:]
+        before = (values[:-1] * shared).sum(axis=1)
+        after = (values[1:] * shared).sum(axis=1)
+        ratio = numpy.where((before > 0) & (after > 0),
+                            before / numpy.where(after > 0, after, 1), 1.)
+        factors = numpy.concatenate([[1.], numpy.cumprod(ratio)])
+        values *= factors[:, numpy.newaxis]
+
+    # weights rise from zero at each edge of a segment, over the
+    # width of its overlap with the neighbouring segments
+    starts = numpy.array([numpy.min(x) for x, y in segments])
+    stops = numpy.array([numpy.max(x) for x, y in segments])
+    ramp = numpy.maximum(stops[:-1] - starts[1:], step) \
+        if len(segments) > 1 else numpy.array([step])
+    left = numpy.concatenate([[step], ramp])[:, numpy.newaxis]
+    right = numpy.concatenate([ramp, [step]])[:, numpy.newaxis]
+    weights = numpy.minimum((grid - starts[:, numpy.newaxis]) / left,
+                            (stops[:, numpy.newaxis] - grid) / right)
+    weights = numpy.clip(weights, 1e-6, 1) * valid
+
+    total = weights.sum(axis=0)
+    y = (weights * values).sum(axis=0) / numpy.where(total > 0, total, 1)
+    y[total == 0] = numpy.nan
+    return grid, y
+
+class Scan(threading.Thread):
+    """
+    Takes a scan over the center wavelengths `centers`.
+
+    `move(wl)` moves the spectrometer (and tells the CCD program),
+    returning when the move is done. `acquire()` returns a reduced
+    frame (x, y). At each position the first `settle` frames are
+    thrown away, since they may have been exposed during the move,
+    and the next `frames` are averaged.
+
+    `on_segment(i, x, y)` is called with each averaged segment, and
+    `on_done(x, y)` with the stitched spectrum, or with None, None if
+    the scan was stopped, or failed because `move` or `acquire`
+    raised; `error` is then that exception. Both are called from the
+    processing thread.
+    """
+
+    def __init__(self, centers, move, acquire, frames=1, settle=1,
+                 on_segment=None, on_done=None, scale=True):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.centers = centers
+        self.move = move
+        self.acquire = acquire
+        self.frames = frames
+        self.settle = settle
+        self.on_segment = on_segment
+        self.on_done = on_done
+        self.scale = scale
+        self.segments = []
+        self.queue = Queue()
+        self.error = None
+        self._want_abort = False
+
+    def abort(self):
+        """Stop after the current frame."""
+        self._want_abort = True
+
+    def run(self):
+        processor = threading.Thread(target=self.process)
+        processor.start()
+        try:
+            for i, wl in enumerate(self.centers):
+                if self._want_abort:
+                    break
+                self.move(wl)
+                for k in range(self.settle):
+                    self.acquire()
+                x = None
+                for k in range(self.frames):
+                    if self._want_abort:
+                        break
+                    fx, fy = self.acquire()
+                    if x is None:
+                        # copies, since the frames may reuse buffers
+                        x, ys = numpy.array(fx), numpy.empty(
+                            (self.frames,) + numpy.shape(fy))
+                    ys[k] = fy
+                if x is not None and not self._want_abort:
+                    self.queue.put((i, x, ys))
+        except Exception as e:
+            # a part of the range is missing, so do not stitch the rest
+            self.error = e
+        finally:
+            self.queue.put(None)
+            processor.join()
+
+    def process(self):
+        # runs while the grating moves on to the next position
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            i, x, ys = item
+            y = ys.mean(axis=0)
+            self.segments.append((x, y))
+            if self.on_segment is not None:
+                self.on_segment(i, x, y)
+        if self.on_done is None:
+            return
+        if self._want_abort or self.error is not None or not self.segments:
+            self.on_done(None, None)
+        else:
+            self.on_done(*stitch(self.segments, scale=self.scale))
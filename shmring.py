@@ -0,0 +1,279 @@
+"""Acquisition in a separate process, handing frames over in shared memory.
+
+In a Pipeline, the receive and reduce threads share the interpreter
+lock with the GUI, so a slow redraw delays the next request to the
+CCD. A ProcessPipeline runs them in a child process instead, which
+writes each reduced frame into a FrameRing: a ring of slots in
+shared memory. The GUI process only gets a short message saying
+which slot is ready, and reads the frame where it lies, without
+copying it.
+
+The child works on copies of `receive` and `reduce`, made when it
+is forked. This needs a system with fork (not Windows, where child
+processes are spawned and their arguments pickled, which the bound
+methods of a GUI cannot be); see `can_fork`. Changes made to them
+afterwards in the GUI process are not seen by the child; use ProcessPipeline.set_reduce to send it a new
+reducer, and shared values (multiprocessing.Value) for anything else
+that changes, such as the center wavelength.
+
+The one exception is the wavelength calibration of a reduce.Reducer.
+The child never applies it. The reader thread in the GUI process
+corrects each x axis with the `calibration` of its own reducer, so
+the correction takes effect at once, and the GUI process keeps the
+nominal axis that it was applied to (see autocal.Calibration).
+"""
+
+import os
+import threading
+import multiprocessing
+from collections import deque
+from timeit import default_timer as timer
+from Queue import Empty
+
+import numpy
+
+# whether a ProcessPipeline can run here
+can_fork = hasattr(os, 'fork')
+
+class FrameRing(object):
+    """
+    `nslots` slots in shared memory, each holding an x axis and a
+    spectrum of up to `capacity` values.
+
+    Each slot has a header of its sequence number (the number of the
+    frame in it, or -1 while it is being written), the length of x,
+    and the shape of y. A reader checks the sequence number before
+    using a slot, and can check it again afterwards to see whether
+    the frame has been overwritten in the meantime.
+    """
+
+    def __init__(self, nslots, capacity):
+        self.nslots = nslots
+        self.capacity = capacity
+        self._x = multiprocessing.RawArray('d', nslots * capacity)
+        self._y = multiprocessing.RawArray('d', nslots * capacity)
+        self._header = multiprocessing.RawArray('l', nslots * 4)
+        self.attach()
+
+    def attach(self):
+        # numpy views of the shared arrays
+        as_array = numpy.ctypeslib.as_array
+        self.x = as_array(self._x).reshape(self.nslots, self.capacity)
+        self.y = as_array(self._y).reshape(self.nslots, self.capacity)
+        self.header = as_array(self._header).reshape(self.nslots, 4)
+        self.header[:, 0] = -1
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('x', 'y', 'header'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.attach()
+
+    def views(self, slot, npix, yshape):
+        """The (x, y) arrays of a slot, for frames of the given size."""
+        ny = int(numpy.prod(yshape))
+        if npix > self.capacity or ny > self.capacity:
+            raise ValueError("frame of %d values does not fit in slots "
+                             "of %d" % (max(npix, ny), self.capacity))
+        return self.x[slot, :npix], self.y[slot, :ny].reshape(yshape)
+
+    def begin(self, slot):
+        """Mark a slot as being written."""
+        self.header[slot, 0] = -1
+
+    def store(self, slot, seq, x, y):
+        """
+        Finish writing frame number `seq` to `slot`. x and y are
+        copied in, unless they are the slot's views already.
+        """
+        xv, yv = self.views(slot, len(x), y.shape)
+        if x.ctypes.data != xv.ctypes.data:
+            numpy.copyto(xv, x)
+        if y.ctypes.data != yv.ctypes.data:
+            numpy.copyto(yv, y)
+        rows = y.shape[0] if y.ndim == 2 else 0
+        self.header[slot, 1:] = len(x), y.ndim, rows
+        self.header[slot, 0] = seq
+
+    def read(self, slot, seq):
+        """(x, y) of frame `seq`, or None if the slot has moved on."""
+        if self.header[slot, 0] != seq:
+            return None
+        npix, ndim, rows = self.header[slot, 1:]
+        yshape = (npix,) if ndim == 1 else (rows, npix)
+        return self.views(slot, npix, yshape)
+
+    def valid(self, slot, seq):
+        return self.header[slot, 0] == seq
+
+def uncalibrated(reduce):
+    # the child's copy of a Reducer, made to leave x nominal
+    if getattr(reduce, 'calibration', None) is not None:
+        reduce.calibration = None
+    return reduce
+
+def acquire(receive, reduce, ring, free, conn, stop, control):
+    """
+    The child process: receive, reduce and store frames until `stop`
+    is set, telling the parent about each one through `conn`.
+    """
+    seq = 0
+    shape = None  # of the last reduced frame
+    reduce = uncalibrated(reduce)
+    try:
+        while not stop.is_set():
+            try:
+                reduce = uncalibrated(control.get_nowait())
+            except Empty:
+                pass
+            start = timer()
+            try:
+                x, grid = receive()
+            except EOFError:
+                conn.send('eof')
+                return
+            received = timer()
+            # wait until the frame last in this slot has been released
+            while not free.acquire(True, .1):
+                if stop.is_set():
+                    return
+            slot = seq % ring.nslots
+            ring.begin(slot)
+            out = None if shape is None else ring.views(slot, *shape)
+            xout, y = reduce(x, grid, out=out)
+            ring.store(slot, seq, xout, y)
+            shape = len(xout), y.shape
+            conn.send((seq, received - start, timer() - received))
+            seq += 1
+    except Exception as e:
+        # from receive or reduce; the exception itself may not pickle
+        conn.send(('error', '%s: %s' % (type(e).__name__, e)))
+    finally:
+        conn.send(None)
+
+class ProcessPipeline(object):
+    """
+    Like Pipeline, but with receive and reduce in a child process.
+
+    Frames are published from a reader thread in this process. As
+    with Pipeline, the consumer hands each published frame back with
+    `release`. The ring has ``nbuffers + lead`` slots, used in turn,
+    and the child waits before writing a slot until the frame in it
+    has been released, so `lead` is how many frames the child can
+    have ready beyond the `nbuffers` that the consumer may hold.
+    Each slot holds up to `capacity` values of x and of y.
+
+    Taps are called on the reader thread, as ``tap(None, (x, y))``;
+    the raw frames stay in the child. `on_finish` is called if the
+    child stops by itself, when `receive` raises EOFError or fails.
+    If `receive` or `reduce` raised anything but EOFError, `error` is
+    then its description.
+    """
+
+    on_finish = None
+
+    def __init__(self, receive, reduce, publish, nbuffers=3, taps=None,
+                 stats=None, capacity=1 << 14, lead=4):
+        self.publish = publish
+        self.reduce = reduce  # for its calibration
+        self.taps = [] if taps is None else taps
+        self.stats = stats
+        self.ring = FrameRing(nbuffers + lead, capacity)
+        # slots the child may write; see release
+        self.free = multiprocessing.Semaphore(nbuffers + lead)
+        self.lent = deque()  # [frame, released] of each unfreed slot
+        self.lent_lock = threading.Lock()
+        self.stop = multiprocessing.Event()
+        self.control = multiprocessing.Queue()
+        self.conn, child_conn = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(target=acquire,
+                args=(receive, reduce, self.ring, self.free, child_conn,
+                      self.stop, self.control))
+        self.process.daemon = True
+        self.reader = threading.Thread(target=self.run_reader)
+        self.reader.daemon = True
+        self.dropped = 0  # frames overwritten before they were read
+        self.error = None
+
+    def start(self):
+        self.process.start()
+        self.reader.start()
+
+    def abort(self):
+        """Stop the child after its current frame."""
+        self.stop.set()
+
+    def join(self, timeout=None):
+        self.reader.join(timeout)
+        self.process.join(timeout)
+
+    def is_alive(self):
+        return self.reader.is_alive() or self.process.is_alive()
+
+    def set_reduce(self, reduce):
+        """Have the child use a copy of `reduce` from the next frame on."""
+        self.reduce = reduce
+        self.control.put(reduce)
+
+    def lend(self, frame):
+        with self.lent_lock:
+            self.lent.append([frame, frame is None])
+        self.release(None)
+
+    def release(self, frame):
+        """
+        Let the slot of a published frame be written again. Slots are
+        written in turn, so they are freed for the child in the order
+        they were lent, as soon as all the older ones are released too.
+        """
+        with self.lent_lock:
+            for entry in self.lent:
+                if frame is not None and entry[0] is frame:
+                    entry[1] = True
+                    break
+            while self.lent and self.lent[0][1]:
+                self.lent.popleft()
+                self.free.release()
+
+    def run_reader(self):
+        finished = False
+        while True:
+            if not self.conn.poll(.1):
+                if not self.process.is_alive():
+                    break
+                continue
+            msg = self.conn.recv()
+            if msg is None:
+                break
+            if msg == 'eof':
+                finished = True
+                continue
+            if msg[0] == 'error':
+                self.error = msg[1]
+                finished = True
+                continue
+            seq, receive_time, reduce_time = msg
+            now = timer()
+            if self.stats is not None:
+                self.stats.add('fetch', now - receive_time, now)
+                self.stats.add('reduce', now - reduce_time, now)
+            slot = seq % self.ring.nslots
+            data = self.ring.read(slot, seq)
+            if data is not None:
+                calibration = getattr(self.reduce, 'calibration', None)
+                if calibration is not None:
+                    calibration.apply(data[0])
+                for tap in list(self.taps):
+                    tap(None, data)
+                if self.ring.valid(slot, seq):
+                    self.lend(data)
+                    self.publish(data)
+                    continue
+            self.dropped += 1
+            self.lend(None)  # nothing to wait for
+        if (finished or not self.stop.is_set()) and self.on_finish is not None:
+            self.on_finish()
@@ -1,5 +1,6 @@
 import wx
-from wanglib.instruments import spex750m
+
+from motion import MotionController, EVT_MOTION
 
 class SingleChoice(wx.Panel):
     def __init__(self, parent, initval, buttontext):
@@ -22,13 +23,24 @@ class SingleChoice(wx.Panel):
 class Spectrometer(wx.Panel):
     """A WX panel providing controls for moving a spectrometer.
     pass the spectrometer instance to this when instantiating.
+
+    The spectrometer is driven by a motion.MotionController, so that
+    the GUI carries on during moves; pass one to share it, or one is
+    started. Its MotionEvents come to this panel, and go on up to the
+    parent windows.
     """
 
-    def __init__(self, parent, spectrometer_instance):
+    def __init__(self, parent, spectrometer_instance, motion=None):
         wx.Panel.__init__(self, parent, -1) 
 
         # interface to the instrument.
         self.spec = spectrometer_instance
+        if motion is None:
+            motion = MotionController(self.spec)
+            motion.start()
+        self.motion = motion
+        self.motion.notify_window = self
+        self.Bind(EVT_MOTION, self.on_motion)
 
         # arrange controls vertically
         self.box = wx.StaticBox(self, -1)
@@ -36,33 +48,55 @@ class Spectrometer(wx.Panel):
         self.update_label()
 
         # the most basic control: change the wavelength
-        self.move = SingleChoice(self, self.spec.wavelength, "Move to")
+        wavelength = self.motion.position.value
+        self.move = SingleChoice(self, wavelength, "Move to")
         self.Bind(wx.EVT_BUTTON, self.on_move_button, self.move.button)
         self.Bind(wx.EVT_TEXT_ENTER, self.on_move_button, self.move.field)
         sizer.Add(self.move, 0, wx.ALL|wx.EXPAND, 10)
 
         # if there is a calibration method, provide a control for it
         if hasattr(self.spec,"calibrate"):
-            self.cal = SingleChoice(self, self.spec.wavelength, "Calibrate")
+            self.cal = SingleChoice(self, wavelength, "Calibrate")
             self.Bind(wx.EVT_BUTTON, self.on_cal_button, self.cal.button)
             self.Bind(wx.EVT_TEXT_ENTER, self.on_cal_button, self.cal.field)
             sizer.Add(self.cal, 0, wx.ALL|wx.EXPAND, 10)
 
+        # drops moves that are queued but not started
+        self.cancel_button = wx.Button(self, -1, "Cancel moves")
+        self.Bind(wx.EVT_BUTTON, self.on_cancel_button, self.cancel_button)
+        sizer.Add(self.cancel_button, 0, wx.LEFT|wx.BOTTOM, 10)
+
         self.SetSizer(sizer)
         sizer.Fit(self)
 
-    def update_label(self):
-        self.box.SetLabel("%s at %.1fnm" % (self.spec, self.spec.wavelength))
+    def update_label(self, doing=None):
+        label = "%s at %.1fnm" % (self.spec, self.motion.position.value)
+        if doing is not None:
+            label += ", " + doing
+        self.box.SetLabel(label)
 
     def on_move_button(self, event):
         self.wavelength = float(self.move.field.GetValue())
-        self.spec.set_wavelength(self.wavelength)
-        self.update_label()
+        self.motion.move(self.wavelength)
+        self.update_label("moving to %.1fnm" % self.wavelength)
 
     def on_cal_button(self, event):
         self.wavelength = float(self.cal.field.GetValue())
-        self.spec.calibrate(self.wavelength)
-        self.update_label()
+        self.motion.calibrate(self.wavelength)
+        self.update_label("calibrating")
+
+    def on_cancel_button(self, event):
+        self.motion.cancel()
+
+    def on_motion(self, event):
+        if event.kind == 'started':
+            self.update_label("moving" if event.action == 'move'
+                              else "calibrating")
+        elif event.kind == 'failed':
+            self.update_label("%s failed: %s" % (event.action, event.error))
+        elif not self.motion.moving:
+            self.update_label()
+        event.Skip()  # for the parent windows
 
 class MainFrame(wx.Frame):
 
@@ -79,6 +113,7 @@ class MainFrame(wx.Frame):
 
 if __name__ == "__main__":
     import sys
+    from wanglib.instruments import spex750m
     if len(sys.argv) < 2:
         print("supply spex address as positional argument")
         sys.exit()
@@ -0,0 +1,154 @@
+"""Timing of each stage of the live display, for finding stutters.
+
+Each stage (receiving a frame, reducing it, updating the plot,
+drawing it...) records how long it took, and when, in a StageTimer:
+a ring of the last few hundred durations, from which we get the
+rate at which the stage runs and percentiles of its duration.
+Stats holds the timers of all the stages, by name, and formats them
+for a status bar or a CSV log.
+
+A timer is cheap enough to leave on all the time: recording a
+duration is two array stores. Each timer should only be written to
+by one thread; reading it from another thread at the same time may
+see one entry out of date, which is fine for a readout.
+"""
+
+import threading
+from time import time
+from timeit import default_timer as timer
+
+import numpy
+
+class StageTimer(object):
+    """
+    The durations of the last `size` runs of one stage, and the
+    times at which they ended.
+    """
+
+    def __init__(self, size=256):
+        self.durations = numpy.zeros(size)
+        self.ends = numpy.zeros(size)
+        self.count = 0
+
+    def add(self, start, end=None):
+        """Record a run from `start` to `end` (default: now)."""
+        if end is None:
+            end = timer()
+        i = self.count % len(self.durations)
+        self.durations[i] = end - start
+        self.ends[i] = end
+        self.count += 1
+
+    def recent(self):
+        """Durations of the runs still in the ring."""
+        return self.durations[:min(self.count, len(self.durations))]
+
+    def rate(self):
+        """
+        Runs per second, over the runs in the ring. This falls
+        towards zero when the stage stops running.
+        """
+        n = min(self.count, len(self.ends))
+        if n < 2:
+            return 0.
+        oldest = self.ends[self.count % len(self.ends)] \
+            if n == len(self.ends) else self.ends[0]
+        elapsed = timer() - oldest
+        return (n - 1) / elapsed if elapsed > 0 else 0.
+
+    def percentile(self, q):
+        """The q-th percentile of the recent durations, in seconds."""
+        recent = self.recent()
+        return numpy.percentile(recent, q) if len(recent) else numpy.nan
+
+    def histogram(self, bins=20):
+        """Counts and bin edges (in seconds) of the recent durations."""
+        return numpy.histogram(self.recent(), bins)
+
+class Stats(object):
+    """
+    StageTimers by name. Those of the usual `stages` exist from the
+    start; any others are created as they are first used.
+
+    The stages timed by save.Graph and its workers are:
+
+    fetch       getting a frame from the data source (network)
+    reduce      turning a raw frame into a spectrum (Pipeline only)
+    update_plot giving the spectrum to the plot (and the integration)
+    render      redrawing the plot: a blit, or else a full draw
+    full_draw   the renders that redraw the whole figure
+
+    The acquisition rate is that of `fetch`, and the display rate
+    that of `render`.
+    """
+
+    stages = ('fetch', 'reduce', 'update_plot', 'render', 'full_draw')
+
+    def __init__(self, size=256):
+        self.size = size
+        self.timers = dict((stage, StageTimer(size)) for stage in self.stages)
+        # for adding timers while other threads read the dict
+        self.lock = threading.Lock()
+
+    def __getitem__(self, stage):
+        t = self.timers.get(stage)
+        if t is None:
+            with self.lock:
+                t = self.timers.setdefault(stage, StageTimer(self.size))
+        return t
+
+    def add(self, stage, start, end=None):
+        self[stage].add(start, end)
+
+    def names(self):
+        """The stages timed so far, the usual ones first."""
+        with self.lock:
+            stages = list(self.timers)
+        usual = [s for s in self.stages if self.timers[s].count]
+        return usual + sorted(set(stages) - set(self.stages))
+
+    def status_text(self):
+        """One line, e.g. for a status bar."""
+        parts = ["acquiring %.1f fps, displaying %.1f fps"
+                 % (self['fetch'].rate(), self['render'].rate())]
+        for stage in self.names():
+            t = self.timers[stage]
+            if t.count:
+                parts.append("%s %.1f/%.1f ms" % (stage,
+                        1e3 * t.percentile(50), 1e3 * t.percentile(99)))
+        return " | ".join(parts)
+
+    def row(self):
+        """Rates and median/99th percentile durations, for StatsLog."""
+        row = {'acquire_fps': self['fetch'].rate(),
+               'display_fps': self['render'].rate()}
+        for stage in self.stages:
+            t = self[stage]
+            row[stage + '_p50'] = t.percentile(50) if t.count else ''
+            row[stage + '_p99'] = t.percentile(99) if t.count else ''
+        return row
+
+class StatsLog(object):
+    """
+    Appends a row to a CSV file each time `write` is called, with
+    the time, the rates and percentiles from Stats.row, and any
+    other counters given.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.columns = None
+
+    def write(self, stats, **counters):
+        row = stats.row()
+        row.update(counters)
+        if self.columns is None:
+            self.columns = ['time'] + sorted(row)
+            self.file.write(','.join(self.columns) + '\n')
+        row['time'] = '%.3f' % time()
+        self.file.write(','.join(str(row.get(c, '')) for c in self.columns)
+                        + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
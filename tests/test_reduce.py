@@ -0,0 +1,45 @@
+"""Tests of reduce.SpikeFilter with integer work buffers.
+
+Run from the top of the source tree::
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from reduce import Reducer, SpikeFilter
+
+
+def frames(n, shape=(16, 64), seed=0):
+    rng = numpy.random.RandomState(seed)
+    for i in range(n):
+        grid = rng.poisson(100, shape).astype(numpy.uint16)
+        grid[5, 10] = 60000  # a spike
+        yield grid
+
+
+def test_rows_int64():
+    spikes = SpikeFilter('rows')
+    reduce = Reducer(dtype=numpy.int64, filters=[spikes])
+    grid = next(frames(1))
+    x, y = reduce(numpy.arange(grid.shape[1]), grid)
+    assert y.dtype == numpy.int64
+    assert spikes.rejected >= 1
+    assert reduce.work[5, 10] < 1000
+    assert (reduce.work == numpy.round(reduce.work)).all()
+
+
+def test_frames_int64():
+    spikes = SpikeFilter('frames')
+    reduce = Reducer(dtype=numpy.int64, filters=[spikes])
+    for grid in frames(4):
+        grid[5, 10] = 100
+        x, y = reduce(numpy.arange(grid.shape[1]), grid)
+    grid[7, 20] = 60000
+    x, y = reduce(numpy.arange(grid.shape[1]), grid)
+    assert spikes.rejected >= 1
+    assert reduce.work[7, 20] < 1000
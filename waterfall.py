@@ -0,0 +1,179 @@
+"""Image views of the live stream: the raw CCD frame, and a waterfall.
+
+The spectrum display shows only the latest frame, summed down the
+rows. A WaterfallFrame shows, next to it, the raw 2D frame that the
+spectrum came from, and a waterfall of the last N spectra, newest at
+the top, for watching how a spectrum changes with time.
+
+The spectra are kept in a History, a preallocated ring that is filled
+from the acquisition thread. The images are only ever updated with
+`set_data`, after shrinking the data to about the size of the axes on
+screen, and are blitted over a cached background like the lines of
+save.Graph, so they keep up with the frame rate.
+"""
+
+import wx
+import matplotlib
+matplotlib.use('WXAgg',warn=False)
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_wxagg import \
+        FigureCanvasWxAgg as FigCanvas
+import numpy
+
+from save import Mailbox, FrameEvent, EVT_FRAME
+
+class History(object):
+    """
+    The last `length` spectra, in a ring.
+
+    Each spectrum is written twice, `length` rows apart, so that
+    the last `length` of them, oldest first, are always a single
+    slice of the ring (see `view`). Starts over if the length of
+    the spectra changes.
+    """
+
+    def __init__(self, length=200):
+        self.length = length
+        self.ring = None
+        self.count = 0
+
+    def add(self, y):
+        if self.ring is None or self.ring.shape[1] != len(y):
+            self.ring = numpy.zeros((2 * self.length, len(y)))
+            self.count = 0
+        i = self.count % self.length
+        self.ring[i] = y
+        self.ring[i + self.length] = y
+        self.count += 1
+
+    def view(self):
+        """(length, pixels) array of the spectra, oldest first."""
+        start = self.count % self.length
+        return self.ring[start:start + self.length]
+
+def downsample(a, shape, out=None):
+    """
+    `a` shrunk to at most `shape` by averaging blocks of whole
+    rows and columns; `a` itself if it is no bigger. Extra rows and
+    columns at the end, that do not fill a block, are left out.
+    """
+    rows, cols = a.shape
+    fr = max(rows // max(shape[0], 1), 1)
+    fc = max(cols // max(shape[1], 1), 1)
+    if fr == fc == 1:
+        return a
+    r, c = rows // fr, cols // fc
+    blocks = a[:r * fr, :c * fc].reshape(r, fr, c, fc)
+    if out is None or out.shape != (r, c):
+        out = numpy.empty((r, c))
+    return numpy.mean(blocks, axis=(1, 3), out=out)
+
+class WaterfallFrame(wx.Frame):
+    """
+    A window with the raw frame and a waterfall of the last
+    `length` spectra of a Graph, to which it adds itself as a tap.
+    Closing the window removes the tap again.
+    """
+
+    title = "CCD frame and waterfall"
+
+    def __init__(self, parent, graph, length=200):
+        wx.Frame.__init__(self, parent, -1, self.title)
+        self.graph = graph
+        self.history = History(length)
+        self.mailbox = Mailbox(1)
+        self.x = None
+        self.background = None
+        self.scratch = {}
+
+        self.fig = Figure((6.0, 6.0))
+        self.frame_axes = self.fig.add_subplot(211)
+        self.frame_axes.set_title('Raw frame', fontsize=10)
+        self.frame_axes.set_ylabel('row')
+        self.waterfall_axes = self.fig.add_subplot(212)
+        self.waterfall_axes.set_xlabel('wavelength (nm)')
+        self.waterfall_axes.set_ylabel('frames ago')
+        empty = numpy.zeros((1, 1))
+        self.frame_image = self.frame_axes.imshow(
+            empty, aspect='auto', origin='lower', animated=True,
+            interpolation='nearest')
+        self.waterfall_image = self.waterfall_axes.imshow(
+            empty, aspect='auto', origin='lower', animated=True,
+            interpolation='nearest')
+        self.images = (self.frame_image, self.waterfall_image)
+
+        self.canvas = FigCanvas(self, -1, self.fig)
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(self.canvas, 1, wx.EXPAND)
+        self.SetSizer(sizer)
+        sizer.Fit(self)
+
+        self.Bind(EVT_FRAME, self.on_frames)
+        self.Bind(wx.EVT_CLOSE, self.on_close)
+        graph.taps.append(self.tap)
+
+    def tap(self, raw, reduced):
+        # on the acquisition thread, with every frame
+        x, y = reduced
+        self.history.add(y)
+        # only the ends of x, since the pipeline will reuse x itself
+        if self.mailbox.put((raw, (x[0], x[-1]))):
+            wx.PostEvent(self, FrameEvent())
+
+    def on_frames(self, event):
+        frames = self.mailbox.drain()
+        if not frames:
+            return
+        raw, (x0, x1) = frames[-1]
+        full = False
+        if raw is not None:
+            full |= self.update_image(self.frame_image, raw[1],
+                                      (0, raw[1].shape[1], 0, raw[1].shape[0]))
+        else:
+            self.frame_axes.set_title('Raw frames are not available '
+                                      'in this mode', fontsize=10)
+        if self.history.count:
+            n = self.history.length
+            full |= self.update_image(self.waterfall_image,
+                                      self.history.view(),
+                                      (x0, x1, -n, 0))
+        if full or self.background is None:
+            self.canvas.draw()
+        else:
+            self.blit()
+
+    def update_image(self, image, data, extent):
+        """
+        Show `data`, downsampled to the size of the axes on screen.
+        Returns True if the axes changed, and need a full redraw.
+        """
+        box = image.axes.get_window_extent()
+        small = downsample(data, (int(box.height), int(box.width)),
+                           self.scratch.get(image))
+        if small is not data:
+            self.scratch[image] = small
+        image.set_data(small)
+        lo, hi = numpy.percentile(small, (1, 99.5))
+        image.set_clim(lo, hi if hi > lo else lo + 1)
+        if tuple(image.get_extent()) != tuple(extent):
+            image.set_extent(extent)
+            return True
+        return False
+
+    def on_draw(self, event):
+        # as in Graph.on_draw: keep the background, then draw the images
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        for image in self.images:
+            image.axes.draw_artist(image)
+
+    def blit(self):
+        self.canvas.restore_region(self.background)
+        for image in self.images:
+            image.axes.draw_artist(image)
+            self.canvas.blit(image.axes.bbox)
+
+    def on_close(self, event):
+        if self.tap in self.graph.taps:
+            self.graph.taps.remove(self.tap)
+        event.Skip()
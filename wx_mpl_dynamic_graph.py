@@ -29,11 +29,11 @@ import wx
 import matplotlib
 matplotlib.use('WXAgg')
 from matplotlib.figure import Figure
+from matplotlib.artist import setp
 from matplotlib.backends.backend_wxagg import \
     FigureCanvasWxAgg as FigCanvas, \
     NavigationToolbar2WxAgg as NavigationToolbar
 import numpy as np
-import pylab
 
 
 class DataGen(object):
@@ -101,6 +101,7 @@ class BoundControlBox(wx.Panel):
     
     def on_text_enter(self, event):
         self.value = self.manual_text.GetValue()
+        event.Skip()  # for the parent, to redraw with the new value
     
     def is_auto(self):
         return self.radio_auto.GetValue()
@@ -202,8 +203,8 @@ class GraphFrame(wx.Frame):
         self.axes.set_axis_bgcolor('black')
         self.axes.set_title('Very important random data', size=12)
         
-        pylab.setp(self.axes.get_xticklabels(), fontsize=8)
-        pylab.setp(self.axes.get_yticklabels(), fontsize=8)
+        setp(self.axes.get_xticklabels(), fontsize=8)
+        setp(self.axes.get_yticklabels(), fontsize=8)
 
         # plot the data as a line series, and save the reference 
         # to the plotted line series
@@ -265,7 +266,7 @@ class GraphFrame(wx.Frame):
         # returns a list over which one needs to explicitly 
         # iterate, and setp already handles this.
         #  
-        pylab.setp(self.axes.get_xticklabels(), 
+        setp(self.axes.get_xticklabels(), 
             visible=self.cb_xlab.IsChecked())
         
         self.plot_data.set_xdata(np.arange(len(self.data)))